@@ -47,11 +47,12 @@ def myNetwork():
 
     info( '*** Post configure switches and hosts\n')
     
-    s1.cmd('ovs-vsctl set-ssl /etc/openvswitch/sc-privkey.pem '
+    # SSL, controller and protocol settings in one ovs-vsctl transaction
+    s1.cmd('ovs-vsctl -- set-ssl /etc/openvswitch/sc-privkey.pem '
            '/etc/openvswitch/sc-cert.pem '
-           '/var/lib/openvswitch/pki/controllerca/cacert.pem')
-    s1.cmd('ovs-vsctl set-controller s1 ssl:127.0.0.1:6633')
-    s1.cmd('ovs-vsctl set bridge s1 protocols=OpenFlow10')
+           '/var/lib/openvswitch/pki/controllerca/cacert.pem'
+           ' -- set-controller s1 ssl:127.0.0.1:6633'
+           ' -- set bridge s1 protocols=OpenFlow10')
     CLI(net)
     net.stop()
 
@@ -35,8 +35,9 @@ def myNetwork():
     c0.start()
     s1.start([c0])
     s2.start([c0])
-    s1.cmd('ovs-vsctl set bridge s1 protocols=OpenFlow13')
-    s2.cmd('ovs-vsctl set bridge s2 protocols=OpenFlow13')
+    # One ovs-vsctl transaction for both bridges
+    s1.cmd('ovs-vsctl -- set bridge s1 protocols=OpenFlow13'
+           ' -- set bridge s2 protocols=OpenFlow13')
     CLI(net)
     net.stop()
 
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Closed-loop path selection.
+
+Every round the router probes all candidate paths concurrently
+(delay_test.measure_paths_concurrently), folds the median delay and the
+loss seen by the probes and by the ONOS port counters on each path into
+EWMA scores (weighted by link utilization when a port_stats sampler is
+attached), and moves HTTP traffic to a better path only when:
+
+  * its score beats the current path by more than switch_threshold,
+  * it has done so for hold_rounds consecutive rounds (dampening), and
+  * at least min_switch_interval seconds passed since the last switch.
+
+A round holds app_core.path_lock from the first probe to the path change,
+so the manual path routes and best-delay runs wait for it and vice versa.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from collections import deque
+
+import app_core
+import delay_test
+import port_stats
+
+
+def port_counters():
+    # {(device, port): (packets sent, packets dropped)} from one bulk call
+    stats = app_core.snapshot.get_json("/statistics/ports").get("statistics", [])
+    counters = {}
+    for dev in stats:
+        for p in dev.get("ports", []):
+            counters[(dev["device"], str(p.get("port")))] = (
+                p.get("packetsSent", 0) + p.get("packetsReceived", 0),
+                p.get("packetsRxDropped", 0) + p.get("packetsTxDropped", 0),
+            )
+    return counters
+
+
+class AdaptiveRouter:
+    def __init__(self, interval=15, samples=5, ewma_alpha=0.3, loss_penalty=10.0,
+                 switch_threshold=0.15, hold_rounds=3, min_switch_interval=60,
+                 sampler=None, util_penalty=1.0):
+        self.interval = interval
+        self.samples = samples
+        self.ewma_alpha = ewma_alpha
+        self.loss_penalty = loss_penalty
+        self.switch_threshold = switch_threshold
+        self.hold_rounds = hold_rounds
+        self.min_switch_interval = min_switch_interval
+        self.sampler = sampler
+        self.util_penalty = util_penalty
+
+        self.paths = {mode: {"delay": None, "loss": 0.0, "utilization": 0.0, "score": None, "last_delay": None}
+                      for mode in app_core.probe_ports}
+        self.current = None
+        self.candidate, self.streak = None, 0
+        self.last_switch = 0.0
+        self.rounds = 0
+        self.events = deque(maxlen=50)
+        self.last_counters = None
+        self.last_error = None
+
+        self.lock = threading.Lock()
+        self.control = threading.Lock()  # serializes start() and stop()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _ewma(self, old, new):
+        if old is None:
+            return new
+        return self.ewma_alpha * new + (1 - self.ewma_alpha) * old
+
+    def _path_port_loss(self, counters):
+        # Drop ratio on the OvS1 egress and OvS5 return port of each path since last round
+        loss = {}
+        if self.last_counters is None:
+            return loss
+        for mode, (out1, out5) in app_core.path_ports.items():
+            sent = dropped = 0
+            for dev, port in ((app_core.devices["OvS1"], str(out1)), (app_core.devices["OvS5"], str(out5))):
+                now, before = counters.get((dev, port)), self.last_counters.get((dev, port))
+                if now is None or before is None or now[0] < before[0] or now[1] < before[1]:
+                    continue  # counter reset
+                sent += now[0] - before[0]
+                dropped += now[1] - before[1]
+            if sent + dropped:
+                loss[mode] = dropped / (sent + dropped)
+        return loss
+
+    def _path_utilization(self, mode):
+        # Busiest of the path's OvS1 egress and OvS5 return ports
+        out1, out5 = app_core.path_ports[mode]
+        return max(self.sampler.utilization(app_core.devices["OvS1"], out1, samples=3),
+                   self.sampler.utilization(app_core.devices["OvS5"], out5, samples=3))
+
+    @app_core.serialized
+    def step(self):
+        results, failures = delay_test.measure_paths_concurrently(self.samples)
+        try:
+            counters = port_counters()
+        except Exception as e:
+            counters, self.last_error = None, f"port statistics: {e}"
+        port_loss = self._path_port_loss(counters) if counters else {}
+        if counters:
+            self.last_counters = counters
+
+        with self.lock:
+            self.rounds += 1
+            self.current = app_core.current_path or self.current or app_core.detect_current_path()
+            for mode, path in self.paths.items():
+                samples = results.get(mode, [])
+                failed = failures.get(mode, 0)
+                probe_loss = failed / (len(samples) + failed) if samples or failed else 1.0
+                loss = max(probe_loss, port_loss.get(mode, 0.0))
+                path["loss"] = self._ewma(path["loss"], loss)
+                if samples:
+                    path["last_delay"] = statistics.median(s.total for s in samples)
+                    path["delay"] = self._ewma(path["delay"], path["last_delay"])
+                if self.sampler is not None:
+                    path["utilization"] = self._path_utilization(mode)
+                if path["delay"] is not None:
+                    path["score"] = (path["delay"] * (1 + self.loss_penalty * path["loss"])
+                                     * (1 + self.util_penalty * path["utilization"]))
+            target = self._decide()
+
+        if target:
+            app_core.apply_path(target)
+            with self.lock:
+                self._event(f"switched {self.current} -> {target}")
+                self.current = target
+                self.last_switch = time.time()
+                self.candidate, self.streak = None, 0
+
+    def _decide(self):
+        scored = {m: p["score"] for m, p in self.paths.items() if p["score"] is not None}
+        if not scored:
+            return None
+        best = min(scored, key=scored.get)
+        cur = scored.get(self.current)
+        if cur is None:
+            # Nothing known about the active path (or none installed yet):
+            # any scored path beats it, but still has to hold and wait
+            gap = 1.0
+        else:
+            gap = (cur - scored[best]) / cur if cur > 0 else 0.0
+        if best == self.current or gap < self.switch_threshold:
+            self.candidate, self.streak = None, 0
+            return None
+        if best != self.candidate:
+            self.candidate, self.streak = best, 0
+        self.streak += 1
+        if self.streak < self.hold_rounds:
+            return None
+        wait = self.min_switch_interval - (time.time() - self.last_switch)
+        if wait > 0:
+            self._event(f"switch to {best} held back for {wait:.0f}s (rate limit)")
+            return None
+        return best
+
+    def _event(self, text):
+        self.events.append({"time": time.strftime("%H:%M:%S"), "event": text})
+
+    def run(self):
+        while not self.stop_event.is_set():
+            start = time.time()
+            try:
+                self.step()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self.stop_event.wait(max(0.0, self.interval - (time.time() - start)))
+
+    def start(self):
+        with self.control:
+            if self.thread and self.thread.is_alive():
+                if not self.stop_event.is_set():
+                    return
+                # Stopped but still finishing its round: wait for it
+                self.thread.join()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name="adaptive-routing", daemon=True)
+            self.thread.start()
+            if self.sampler is not None:
+                self.sampler.start()
+            self._event("started")
+
+    def stop(self):
+        with self.control:
+            self.stop_event.set()
+            if self.thread and self.thread is not threading.current_thread():
+                self.thread.join()
+            if self.sampler is not None:
+                self.sampler.stop()
+            self._event("stopped")
+
+    def status(self):
+        with self.lock:
+            return {
+                "running": bool(self.thread and self.thread.is_alive() and not self.stop_event.is_set()),
+                "current": self.current,
+                "candidate": self.candidate,
+                "streak": self.streak,
+                "rounds": self.rounds,
+                "last_switch": self.last_switch or None,
+                "last_error": self.last_error,
+                "paths": {m: dict(p) for m, p in self.paths.items()},
+                "events": list(self.events),
+                "config": {
+                    "interval": self.interval,
+                    "samples": self.samples,
+                    "switch_threshold": self.switch_threshold,
+                    "hold_rounds": self.hold_rounds,
+                    "min_switch_interval": self.min_switch_interval,
+                },
+            }
+
+
+# Shared instances for web_app
+sampler = port_stats.PortStatsSampler(app_core.snapshot.get_json)
+sampler.load_capacities(app_core.topo)
+router = AdaptiveRouter(sampler=sampler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep HTTP on the best-scoring path")
+    parser.add_argument("--interval", type=float, default=15)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--hold-rounds", type=int, default=3)
+    parser.add_argument("--min-switch-interval", type=float, default=60)
+    args = parser.parse_args()
+
+    r = AdaptiveRouter(interval=args.interval, samples=args.samples, switch_threshold=args.threshold,
+                       hold_rounds=args.hold_rounds, min_switch_interval=args.min_switch_interval,
+                       sampler=sampler)
+    sampler.start()
+    try:
+        while True:
+            start = time.time()
+            r.step()
+            st = r.status()
+            scores = ", ".join(f"{m} {p['score']:.3f}" if p["score"] is not None else f"{m} -"
+                               for m, p in st["paths"].items())
+            print(f"[{time.strftime('%H:%M:%S')}] current {st['current']}: {scores}")
+            time.sleep(max(0.0, args.interval - (time.time() - start)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 
+import functools
+import threading
+
 import requests
 from requests.auth import HTTPBasicAuth
 
+import flow_snapshot
+import flow_trace
+import topology
+
 
 controller_ip = "10.224.78.63"
 controller_port = 8181
@@ -11,16 +18,13 @@ rest_url = f"http://{controller_ip}:{controller_port}/onos/v1"
 headers_global = {"Content-Type": "application/json"}
 
 
-devices = {
-    "OvS1": "of:0000000000000001",
-    "OvS2": "of:0000000000000002",
-    "OvS3": "of:0000000000000003",
-    "OvS4": "of:0000000000000004",
-    "OvS5": "of:0000000000000005",
-    "OvS6": "of:0000000000000006",
-    "OvS7": "of:0000000000000007",
-    "OvS8": "of:0000000000000008",
-}
+# Switch names and OpenFlow ids come from the shared topology descriptor
+# (lab8_topo.json, or the file named by LAB8_TOPOLOGY)
+topo = topology.load()
+devices = topo.devices()
+
+# Bulk /flows snapshot shared by remove_flows; refetched only when stale
+snapshot = flow_snapshot.FlowSnapshot(rest_url, auth_creds)
 
 host_ip_address = "10.0.0.1"
 server_ip = "10.0.0.2"
@@ -28,8 +32,41 @@ host_ipv6_address = "1::1"
 server_ipv6_address = "2::2"
 http_port = 8080
 
+# HTTP egress port on OvS1 and return port on OvS5 for each path mode
+path_ports = {
+    "default": (3, 2),   # OvS6–OvS7
+    "shortest": (4, 3),  # OvS8
+    "longest": (2, 1),   # OvS2–OvS3–OvS4
+}
+
+# Probe classes: H1 opens the probe connection from this TCP source port and
+# only that class is steered onto the candidate path
+# First source port of each probe class. A class rotates through
+# probe_port_span ports (one masked match), so back-to-back samples never
+# wait for the previous connection's TIME_WAIT to clear
+probe_ports = {"shortest": 40016, "longest": 40032, "default": 40048}
+probe_port_span = 16
+probe_port_mask = 0xffff - (probe_port_span - 1)
+probe_app_id = "org.lab8.probe"
+
+# Path mode last installed by this process (None until one is applied)
+current_path = None
 
-def push_static_flows(device, selector, treatment, priority=100, comment=""):
+# Held by every path change and probe install/removal, and by callers that
+# must see the flows stay put across several of them (a probe round, an
+# adaptive routing step). Reentrant: path functions call each other.
+path_lock = threading.RLock()
+
+
+def serialized(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with path_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def push_static_flows(device, selector, treatment, priority=100, comment="", app_id=None):
     body = {
         "priority": priority,
         "timeout": 0,
@@ -40,6 +77,7 @@ def push_static_flows(device, selector, treatment, priority=100, comment=""):
     }
     r = requests.post(
         f"{rest_url}/flows/{devices[device]}",
+        params={"appId": app_id} if app_id else None,
         json=body,
         headers=headers_global,
         auth=auth_creds,
@@ -52,22 +90,27 @@ def push_static_flows(device, selector, treatment, priority=100, comment=""):
 
 
 def remove_flows():
-    for name, did in devices.items():
-        # Get flows for that device
-        res = requests.get(f"{rest_url}/flows/{did}", auth=auth_creds, timeout=5)
-        if res.status_code != 200:
-            print(f"Could not fetch flows for {name}: {res.status_code}")
-            continue
-
-        flows = res.json().get("flows", [])
-        for f in flows:
-            fid = f["id"]
-            del_url = f"{rest_url}/flows/{did}/{fid}"
-            r = requests.delete(del_url, auth=auth_creds, timeout=5)
-            if r.status_code == 204:
-                print(f"Deleted flow")
-            else:
-                print(f"Could not delete flow {fid} on {name}: {r.status_code}")
+    # One GET for every device's flows, then one batch DELETE
+    snapshot.refresh(force=True)
+    batch = [{"deviceId": did, "flowId": fid}
+             for did in devices.values() for fid in snapshot.flow_ids(did)]
+    snapshot.invalidate()
+    if not batch:
+        return
+    r = snapshot.session.delete(f"{rest_url}/flows", json={"flows": batch},
+                                headers=headers_global, timeout=10)
+    if r.status_code in (200, 204):
+        print(f"Deleted {len(batch)} flows")
+        return
+
+    # Older controllers without batch delete: one request per flow
+    for item in batch:
+        did, fid = item["deviceId"], item["flowId"]
+        r = snapshot.session.delete(f"{rest_url}/flows/{did}/{fid}", timeout=5)
+        if r.status_code == 204:
+            print(f"Deleted flow")
+        else:
+            print(f"Could not delete flow {fid} on {did}: {r.status_code}")
 
 
 def initial_setup():
@@ -96,15 +139,8 @@ def initial_setup():
     # Basic IPv4 forwarding between static links (for simplicity use wildcard IPv4)
     ipv4_sel = [{"type": "ETH_TYPE", "ethType": "0x0800"}]
 
-    # Simple “port-to-port” connectivity
-    link_ports = {
-        "OvS2": [(1, 2), (2, 1)],
-        "OvS3": [(1, 2), (2, 1)],
-        "OvS4": [(1, 2), (2, 1)],
-        "OvS6": [(1, 2), (2, 1)],
-        "OvS7": [(1, 2), (2, 1)],
-        "OvS8": [(1, 2), (2, 1)],
-    }
+    # Simple “port-to-port” connectivity on the transit switches
+    link_ports = topo.link_ports()
     for sw, tuples in link_ports.items():
         for inport, outport in tuples:
             push_static_flows(sw, ipv4_sel + [{"type": "IN_PORT", "port": str(inport)}], outport,
@@ -120,7 +156,9 @@ def initial_setup():
     print("Initial setup complete.")
 
 
+@serialized
 def default_path():
+    global current_path
     print("Setting default path (all traffic via OvS6–OvS7–OvS5)")
     remove_flows()
     initial_setup()
@@ -140,10 +178,13 @@ def default_path():
     ipv6_sel = [{"type": "ETH_TYPE", "ethType": "0x86DD"}]
     push_static_flows("OvS1", ipv6_sel, 3, comment="IPv6 fwd to OvS6")
     push_static_flows("OvS5", ipv6_sel, 4, comment="IPv6 fwd to Server")
+    current_path = "default"
     print("Default path installed.")
 
 
+@serialized
 def shortest_path():
+    global current_path
 
     print("Setting shortest path (HTTP via OvS8, others default path)")
     remove_flows()
@@ -163,10 +204,13 @@ def shortest_path():
     ]
     push_static_flows("OvS1", http_sel_dest, 4, priority=200, comment="HTTP via OvS8")
     push_static_flows("OvS5", http_sel_source, 3, priority=200, comment="HTTP return")
+    current_path = "shortest"
     print("Shortest-path flows installed.")
 
 
+@serialized
 def longest_path():
+    global current_path
     print("Setting longest path (HTTP via OvS2–OvS3–OvS4–OvS5)")
     remove_flows()
     initial_setup()
@@ -185,9 +229,67 @@ def longest_path():
     # Path 1–2–3–4–5
     push_static_flows("OvS1", http_sel_dest, 2, priority=200, comment="HTTP via OvS2")
     push_static_flows("OvS5", http_sel_source, 1, priority=200, comment="HTTP return")
+    current_path = "longest"
     print("[+] Longest-path (HTTP) flows installed.")
 
 
+def apply_path(mode):
+    {"default": default_path, "shortest": shortest_path, "longest": longest_path}[mode]()
+
+
+@serialized
+def install_probe_paths():
+    """
+    Install every candidate path at once, each carrying only its own probe
+    class, on top of whatever production path is active. Probe flows are
+    owned by probe_app_id so they can be removed in one call.
+    """
+    for mode, sport in probe_ports.items():
+        out1, out5 = path_ports[mode]
+        probe_out = [
+            {"type": "ETH_TYPE", "ethType": "0x0800"},
+            {"type": "IP_PROTO", "protocol": 6},
+            {"type": "TCP_SRC_MASKED", "tcpPort": sport, "tcpMask": probe_port_mask},
+        ]
+        probe_back = [
+            {"type": "ETH_TYPE", "ethType": "0x0800"},
+            {"type": "IP_PROTO", "protocol": 6},
+            {"type": "TCP_DST_MASKED", "tcpPort": sport, "tcpMask": probe_port_mask},
+        ]
+        push_static_flows("OvS1", probe_out, out1, priority=300,
+                          comment=f"{mode} probe out", app_id=probe_app_id)
+        push_static_flows("OvS5", probe_back, out5, priority=300,
+                          comment=f"{mode} probe return", app_id=probe_app_id)
+    snapshot.invalidate()
+
+
+@serialized
+def remove_probe_paths():
+    r = snapshot.session.delete(f"{rest_url}/flows/application/{probe_app_id}", timeout=10)
+    if r.status_code not in (200, 204):
+        print(f"Could not remove probe flows: {r.status_code} {r.text}")
+    snapshot.invalidate()
+
+
+def detect_current_path():
+    """
+    Work out which path mode is installed from OvS1's flow table, for when
+    this process did not install it itself.
+    """
+    snapshot.refresh(force=True)
+    table = flow_trace.FlowTable(snapshot.device_flows(devices["OvS1"]))
+    header = flow_trace.make_header(eth_type=0x0800, ip_proto=6, in_port="1",
+                                    ipv4_src="10.0.0.1", ipv4_dst="1.1.1.1",
+                                    tcp_src=50000, tcp_dst=http_port)
+    cf = table.lookup(header)
+    if cf is None or not cf.outputs:
+        return None
+    for mode, (out1, _) in path_ports.items():
+        if cf.outputs[0] == str(out1):
+            return mode
+    return None
+
+
 def main():
     remove_flows()
 
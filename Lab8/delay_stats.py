@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Delay samples, summary statistics and path decisions for delay_test.
+
+Each sample splits one HTTP fetch into TCP connect time, time to first byte
+(after the connection is up) and transfer time, taken from curl's -w
+timers so ssh and process start-up are not counted. Paths are compared on
+their medians; a switch away from the current path needs both a
+significant Mann-Whitney U test and a relative improvement larger than the
+hysteresis margin.
+"""
+
+import json
+import math
+import os
+import statistics
+import time
+from collections import namedtuple
+
+# curl -w format matching parse_sample
+curl_format = "%{time_connect} %{time_starttransfer} %{time_total}"
+
+Sample = namedtuple("Sample", "connect ttfb transfer total")
+
+default_log = os.path.join(os.path.dirname(os.path.abspath(__file__)), "delay_results.jsonl")
+
+
+def parse_sample(fields):
+    # fields: [time_connect, time_starttransfer, time_total] as strings
+    connect, start, total = (float(f) for f in fields)
+    if total <= 0:
+        return None
+    return Sample(connect, max(0.0, start - connect), max(0.0, total - start), total)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def median_ci(sorted_values, z=1.96):
+    # Distribution-free confidence interval for the median (order statistics)
+    n = len(sorted_values)
+    if n < 3:
+        return sorted_values[0], sorted_values[-1]
+    half = z * math.sqrt(n) / 2
+    lo = max(0, int(math.floor(n / 2 - half)))
+    hi = min(n - 1, int(math.ceil(n / 2 + half)) - 1)
+    return sorted_values[lo], sorted_values[hi]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"n": 0}
+    lo, hi = median_ci(values)
+    return {
+        "n": len(values),
+        "median": statistics.median(values),
+        "p95": percentile(values, 0.95),
+        "ci_low": lo,
+        "ci_high": hi,
+    }
+
+
+def summarize_samples(samples):
+    return {part: summarize([getattr(s, part) for s in samples]) for part in Sample._fields}
+
+
+def mann_whitney_p(a, b):
+    """
+    Two-sided p-value of the Mann-Whitney U test (normal approximation with
+    tie correction). Good enough for the 10-50 samples per path used here.
+    """
+    n1, n2 = len(a), len(b)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    ranked = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        avg = (i + j) / 2 + 1
+        for k in range(i, j + 1):
+            ranks[k] = avg
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    r1 = sum(r for r, (_, group) in zip(ranks, ranked) if group == 0)
+    u = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    mean = n1 * n2 / 2
+    var = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    z = (abs(u - mean) - 0.5) / math.sqrt(var)
+    return max(0.0, min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2))))
+
+
+def decide(samples_by_path, current=None, alpha=0.05, hysteresis=0.1, min_samples=5):
+    """
+    Pick the path to use. Returns (path, reason). The current path is kept
+    unless the best path has enough samples, a median total delay at least
+    `hysteresis` lower and a significant difference (p < alpha).
+    """
+    totals = {p: [s.total for s in samples] for p, samples in samples_by_path.items()
+              if len(samples) >= min_samples}
+    if not totals:
+        return current, "not enough samples"
+    medians = {p: statistics.median(v) for p, v in totals.items()}
+    best = min(medians, key=medians.get)
+    if current is None or current not in totals:
+        return best, "no usable measurement of the current path"
+    if best == current:
+        return current, "current path is fastest"
+    p = mann_whitney_p(totals[best], totals[current])
+    gain = 1 - medians[best] / medians[current] if medians[current] > 0 else 0.0
+    if p >= alpha:
+        return current, f"difference not significant (p={p:.3f})"
+    if gain < hysteresis:
+        return current, f"gain {gain:.1%} below hysteresis {hysteresis:.0%}"
+    return best, f"{gain:.1%} lower median delay (p={p:.3f})"
+
+
+def record(samples_by_path, current, chosen, reason, failures=None, path=default_log):
+    # Append one timestamped decision with its per-path statistics (JSON lines)
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "timestamp": time.time(),
+        "current": current,
+        "chosen": chosen,
+        "reason": reason,
+        "paths": {p: dict(summarize_samples(s), failures=(failures or {}).get(p, 0))
+                  for p, s in samples_by_path.items()},
+    }
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
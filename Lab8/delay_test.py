@@ -1,17 +1,27 @@
 #!/usr/bin/env python3
+import argparse
 import subprocess
 import re
 import time
 import app_core
+import delay_stats
+import probe_client
 
 # ssh connection details
 mininet_host = "mininet@10.224.79.89"
 h1_cmd = "sudo mnexec -a 1 bash -c 'wget -O /dev/null -T 10 http://1.1.1.1:8080 2>&1'"
+server_url = "http://1.1.1.1:8080"
+settle_time = 1
+probe_host = "H1"
 
-def run_remote_command(cmd):
+# Address (host:port) of probe_agent.py on the Mininet VM; without it every
+# measurement goes through a fresh ssh session
+probe_agent = probe_client.default_agent
+
+def run_remote_command(cmd, timeout=20):
     """Run a command remotely on the Mininet VM via SSH and return output."""
     full_cmd = ["ssh", "-o", "StrictHostKeyChecking=no", mininet_host, cmd]
-    result = subprocess.run(full_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=20)
+    result = subprocess.run(full_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout)
     return result.stdout + result.stderr
 
 def measure_wget_delay():
@@ -49,7 +59,113 @@ def measure_wget_delay():
         print(f"wget failed: {e}")
         return None
 
-def choose_best_delay():
+def probe_command(ports, rounds=1, url=server_url, span=app_core.probe_port_span):
+    # Each round starts one curl per probe class together inside H1's namespace.
+    # Round i uses source port p + i % span; results are labelled with p
+    fmt = delay_stats.curl_format
+    curls = " ".join(
+        f"(o=$(curl -s -o /dev/null -m 10 --local-port $(({p} + i % {span})) -w \"{p} {fmt}\" {url}) "
+        f"&& echo \"$o\" || echo \"{p} fail\") &"
+        for p in ports)
+    return f"sudo mnexec -a 1 bash -c 'for i in $(seq {rounds}); do {curls} wait; done'"
+
+
+def parse_probe_output(output):
+    # ({source_port: [Sample, ...]}, {source_port: failed probes})
+    samples, failures = {}, {}
+    for line in output.splitlines():
+        parts = line.split()
+        if not parts or not parts[0].isdigit():
+            continue
+        port = int(parts[0])
+        samples.setdefault(port, [])
+        if len(parts) == 2 and parts[1] == "fail":
+            failures[port] = failures.get(port, 0) + 1
+            continue
+        if len(parts) != 4:
+            continue
+        try:
+            sample = delay_stats.parse_sample(parts[1:])
+        except ValueError:
+            sample = None
+        if sample is not None:
+            samples[port].append(sample)
+    return samples, failures
+
+
+def measure_paths_concurrently(samples=10):
+    """
+    Install all candidate paths side by side (one probe class each), take
+    `samples` rounds of parallel requests from H1 and remove the probe flows
+    again. Production traffic keeps using the current path throughout, and
+    path changes from other threads wait until the probe flows are gone.
+    Returns ({mode: [Sample, ...]}, {mode: failed probes}).
+    """
+    with app_core.path_lock:
+        app_core.install_probe_paths()
+        try:
+            time.sleep(settle_time)
+            if probe_agent:
+                specs = {mode: {"host": probe_host, "url": server_url, "local_port": port, "count": samples,
+                                "port_span": app_core.probe_port_span}
+                         for mode, port in app_core.probe_ports.items()}
+                measured = probe_client.run_probes(probe_agent, specs)
+                results = {mode: measured[mode][0] for mode in specs}
+                failures = {mode: measured[mode][1] for mode in specs}
+                return results, failures
+
+            by_port = {port: mode for mode, port in app_core.probe_ports.items()}
+            output = run_remote_command(probe_command(by_port, rounds=samples),
+                                        timeout=20 + 12 * samples)
+            by_port_samples, by_port_failures = parse_probe_output(output)
+            results = {mode: by_port_samples.get(port, []) for port, mode in by_port.items()}
+            failures = {mode: by_port_failures.get(port, 0) for port, mode in by_port.items()}
+            return results, failures
+        except subprocess.TimeoutExpired:
+            print("Probe run timed out.")
+            return {}, {}
+        finally:
+            app_core.remove_probe_paths()
+
+
+def print_summary(mode, samples, failed):
+    if not samples:
+        print(f"Could not measure {mode} path delay ({failed} failed probes).")
+        return
+    st = delay_stats.summarize_samples(samples)
+    t = st["total"]
+    print(f"{mode.capitalize():9} n={t['n']:<3} median {t['median']:.3f}s "
+          f"[95% CI {t['ci_low']:.3f}-{t['ci_high']:.3f}] p95 {t['p95']:.3f}s | "
+          f"connect {st['connect']['median']:.3f}s ttfb {st['ttfb']['median']:.3f}s "
+          f"transfer {st['transfer']['median']:.3f}s | {failed} failed")
+
+
+def choose_best_delay_concurrent(samples=10, alpha=0.05, hysteresis=0.1):
+
+    print(f"\nProbing all path options concurrently ({samples} samples each)...\n")
+    results, failures = measure_paths_concurrently(samples)
+    for mode in app_core.probe_ports:
+        print_summary(mode, results.get(mode, []), failures.get(mode, 0))
+
+    current = app_core.current_path or app_core.detect_current_path()
+    chosen, reason = delay_stats.decide(results, current, alpha=alpha, hysteresis=hysteresis)
+    delay_stats.record(results, current, chosen, reason, failures)
+    print(f"\nDecision: {chosen or 'none'} ({reason})\n")
+
+    if chosen is None:
+        print("No valid delay measurements — keeping current path.")
+        return
+    if chosen == current:
+        print(f"{chosen} path stays active, production flows left untouched.\n")
+        return
+    app_core.apply_path(chosen)
+    print(f"Optimal path ({chosen}) activated based on measured delay.\n")
+
+
+@app_core.serialized
+def choose_best_delay(concurrent=True, **kwargs):
+    if concurrent:
+        return choose_best_delay_concurrent(**kwargs)
 
     print("\nEvaluating end-to-end delay for all path options...\n")
     delays = {}
@@ -106,7 +222,22 @@ def choose_best_delay():
     print(f"Optimal path ({best}) reactivated based on measured delay.\n")
 
 def main():
-    choose_best_delay()
+    global probe_agent
+    parser = argparse.ArgumentParser(description="Pick the path with the lowest HTTP delay")
+    parser.add_argument("--sequential", action="store_true",
+                        help="apply and measure each path in turn instead of probing them together")
+    parser.add_argument("--samples", type=int, default=10, help="samples per path")
+    parser.add_argument("--alpha", type=float, default=0.05, help="significance level for switching paths")
+    parser.add_argument("--hysteresis", type=float, default=0.1,
+                        help="minimum relative median improvement before switching")
+    parser.add_argument("--agent", metavar="HOST:PORT", help="probe_agent.py address on the Mininet VM")
+    args = parser.parse_args()
+    if args.agent:
+        probe_agent = args.agent
+    if args.sequential:
+        choose_best_delay(concurrent=False)
+    else:
+        choose_best_delay(samples=args.samples, alpha=args.alpha, hysteresis=args.hysteresis)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+One-sweep snapshot of every flow in ONOS.
+
+GET /onos/v1/flows is fetched once over a keep-alive session and parsed
+incrementally as it streams in, so the full response body is never held as
+one document. Each flow is reduced to the fields the tools use and grouped
+by device. A refresh is skipped while the snapshot is younger than max_age,
+and a 304 reply to If-None-Match keeps the current data when the controller
+supports ETags.
+"""
+
+import codecs
+import json
+import time
+
+import requests
+
+# Fields kept from each flow; counters, timestamps and table ids are dropped
+flow_fields = ("id", "priority", "state", "appId", "selector", "treatment")
+
+_decoder = json.JSONDecoder()
+
+
+def iter_array_items(chunks, key):
+    """
+    Yield the items of the top-level array `key` from a stream of byte
+    chunks without waiting for the whole body.
+    """
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf, pos = "", 0
+    chunks = iter(chunks)
+
+    def more():
+        nonlocal buf, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+        return True
+
+    # Find the opening bracket of the array
+    marker = f'"{key}"'
+    while True:
+        i = buf.find(marker, pos)
+        if i >= 0:
+            j = buf.find("[", i + len(marker))
+            if j >= 0:
+                pos = j + 1
+                break
+        if not more():
+            return
+
+    while True:
+        # Skip separators, stop at the closing bracket
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                break
+            if not more():
+                return
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Object continues in the next chunk
+            if not more():
+                raise
+            continue
+        if (isinstance(item, (int, float)) and not isinstance(item, bool)
+                and (end == len(buf) or buf[end] not in " \t\r\n,]")):
+            # A number may go on in the next chunk ("1" of "12", "-7" of "-7.5"):
+            # wait for its delimiter
+            if more():
+                continue
+        yield item
+        pos = end
+
+
+def compact(flow):
+    return {k: flow[k] for k in flow_fields if k in flow}
+
+
+class FlowSnapshot:
+    def __init__(self, rest_url, auth, max_age=2.0, timeout=10):
+        self.rest_url = rest_url
+        self.max_age = max_age
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.headers.update({"Accept": "application/json"})
+        self.flows = {}  # device id -> [compact flow, ...]
+        self.fetched_at = 0.0
+        self.etag = None
+        self._links = None
+        self._links_at = 0.0
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+    def invalidate(self):
+        # Force the next refresh, e.g. after flows were added or removed
+        self.fetched_at = 0.0
+        self.etag = None
+
+    def refresh(self, force=False):
+        """
+        Fetch /flows unless the snapshot is still fresh. Returns True when
+        new data was loaded.
+        """
+        if not force and self.fetched_at and self.age() < self.max_age:
+            return False
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        with self.session.get(f"{self.rest_url}/flows", headers=headers,
+                              stream=True, timeout=self.timeout) as r:
+            if r.status_code == 304:
+                self.fetched_at = time.time()
+                return False
+            r.raise_for_status()
+            flows = {}
+            for f in iter_array_items(r.iter_content(chunk_size=65536), "flows"):
+                flows.setdefault(f.get("deviceId"), []).append(compact(f))
+            self.etag = r.headers.get("ETag")
+        self.flows = flows
+        self.fetched_at = time.time()
+        return True
+
+    def flow_counts(self):
+        """
+        {device id: flow entries} from the flow table statistics: one small
+        request whatever the size of the tables, to tell which devices
+        changed since the last call.
+        """
+        stats = self.get_json("/statistics/flows/tables").get("statistics", [])
+        return {s.get("device"): sum(t.get("activeEntries", 0) for t in s.get("table", []))
+                for s in stats}
+
+    def refresh_device(self, device_id):
+        # Fetch one device's flows into the snapshot, leaving the others as they are
+        with self.session.get(f"{self.rest_url}/flows/{device_id}",
+                              stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            flows = [compact(f) for f in iter_array_items(r.iter_content(chunk_size=65536), "flows")]
+        self.flows[device_id] = flows
+        return flows
+
+    def device_flows(self, device_id):
+        self.refresh()
+        return self.flows.get(device_id, [])
+
+    def flow_ids(self, device_id):
+        return [f["id"] for f in self.device_flows(device_id)]
+
+    def get_json(self, path):
+        r = self.session.get(f"{self.rest_url}{path}", timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def links(self):
+        # /links over the same session, cached for max_age like the flows
+        if self._links is None or time.time() - self._links_at >= self.max_age:
+            self._links = self.get_json("/links").get("links", [])
+            self._links_at = time.time()
+        return self._links
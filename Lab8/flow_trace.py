@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Offline hop-by-hop tracing over ONOS flow tables.
+
+Each device's flows are compiled once into match checks and bucketed by
+(eth_type, ip_proto, in_port); a lookup merges the (at most eight) buckets
+that can match a header, in priority order, and caches the merged list.
+A trace then walks the links map hop by hop until the packet leaves on a
+host port, is dropped, is punted to the controller or loops.
+"""
+
+import heapq
+import ipaddress
+from collections import namedtuple
+
+# Packet header fields understood by the matcher and the ONOS criterion
+# (type, value key) they come from
+criteria_fields = {
+    "IN_PORT": ("in_port", "port"),
+    "ETH_TYPE": ("eth_type", "ethType"),
+    "ETH_SRC": ("eth_src", "mac"),
+    "ETH_DST": ("eth_dst", "mac"),
+    "VLAN_VID": ("vlan_vid", "vlanId"),
+    "IP_PROTO": ("ip_proto", "protocol"),
+    "IP_DSCP": ("ip_dscp", "ipDscp"),
+    "IPV4_SRC": ("ipv4_src", "ip"),
+    "IPV4_DST": ("ipv4_dst", "ip"),
+    "IPV6_SRC": ("ipv6_src", "ip"),
+    "IPV6_DST": ("ipv6_dst", "ip"),
+    "TCP_SRC": ("tcp_src", "tcpPort"),
+    "TCP_DST": ("tcp_dst", "tcpPort"),
+    "UDP_SRC": ("udp_src", "udpPort"),
+    "UDP_DST": ("udp_dst", "udpPort"),
+}
+
+ip_fields = ("ipv4_src", "ipv4_dst", "ipv6_src", "ipv6_dst")
+
+# priority, checks ((field, value, mask), ...), outputs (port strings), flow id
+CompiledFlow = namedtuple("CompiledFlow", "priority checks outputs id")
+
+# hops: [(device, in_port, out_port)], outcome: host | drop | controller | loop | max-hops
+TraceResult = namedtuple("TraceResult", "hops outcome")
+
+
+def _to_int(value):
+    if isinstance(value, int):
+        return value
+    value = str(value)
+    return int(value, 16) if value.lower().startswith("0x") else int(value)
+
+
+def _prefix(value):
+    net = ipaddress.ip_network(str(value), strict=False)
+    return int(net.network_address), int(net.netmask)
+
+
+def compile_flow(flow):
+    """
+    Turn an ONOS flow (as returned by /flows) into a CompiledFlow, or None
+    if it uses a criterion the matcher cannot evaluate.
+    """
+    checks = []
+    for c in flow.get("selector", {}).get("criteria", []):
+        field = criteria_fields.get(c.get("type"))
+        if field is None:
+            return None
+        name, key = field
+        value = c.get(key)
+        if name in ip_fields:
+            addr, mask = _prefix(value)
+            checks.append((name, addr, mask))
+        elif name in ("eth_src", "eth_dst"):
+            checks.append((name, str(value).lower(), None))
+        elif name == "in_port":
+            checks.append((name, str(value), None))
+        else:
+            checks.append((name, _to_int(value), None))
+    outputs = tuple(str(i.get("port")) for i in flow.get("treatment", {}).get("instructions", [])
+                    if i.get("type") == "OUTPUT")
+    return CompiledFlow(int(flow.get("priority", 0)), tuple(checks), outputs, flow.get("id"))
+
+
+def make_header(**fields):
+    """
+    Build a packet header for lookups. IPs may be given as strings, ports and
+    protocol numbers as ints; in_port is set by the tracer at each hop.
+    """
+    header = {}
+    for name, value in fields.items():
+        if value is None:
+            continue
+        if name in ip_fields:
+            header[name] = int(ipaddress.ip_address(value))
+        elif name in ("eth_src", "eth_dst"):
+            header[name] = value.lower()
+        elif name == "in_port":
+            header[name] = str(value)
+        else:
+            header[name] = _to_int(value)
+    return header
+
+
+def _bucket_key(checks):
+    key = {"eth_type": None, "ip_proto": None, "in_port": None}
+    for name, value, mask in checks:
+        if name in key:
+            key[name] = value
+    return key["eth_type"], key["ip_proto"], key["in_port"]
+
+
+class FlowTable:
+    def __init__(self, flows=()):
+        self.buckets = {}
+        self.cache = {}
+        self.skipped = 0
+        for f in flows:
+            self.add(f)
+        self.finish()
+
+    def add(self, flow):
+        # Flows being removed no longer forward anything
+        if flow.get("state") in ("PENDING_REMOVE", "REMOVED"):
+            return
+        cf = compile_flow(flow)
+        if cf is None:
+            self.skipped += 1
+            return
+        self.buckets.setdefault(_bucket_key(cf.checks), []).append(cf)
+
+    def finish(self):
+        # Highest priority first; stable, so equal priorities keep table order
+        for bucket in self.buckets.values():
+            bucket.sort(key=lambda cf: -cf.priority)
+        self.cache.clear()
+
+    def _candidates(self, key):
+        merged = self.cache.get(key)
+        if merged is None:
+            et, proto, port = key
+            lists = [self.buckets[k] for k in (
+                (et, proto, port), (et, proto, None), (et, None, port), (et, None, None),
+                (None, proto, port), (None, proto, None), (None, None, port), (None, None, None),
+            ) if k in self.buckets]
+            merged = list(heapq.merge(*lists, key=lambda cf: -cf.priority))
+            self.cache[key] = merged
+        return merged
+
+    def lookup(self, header):
+        # Highest priority flow whose checks all match, or None
+        key = (header.get("eth_type"), header.get("ip_proto"), header.get("in_port"))
+        for cf in self._candidates(key):
+            for name, value, mask in cf.checks:
+                h = header.get(name)
+                if h is None:
+                    break
+                if mask is None:
+                    if h != value:
+                        break
+                elif h & mask != value:
+                    break
+            else:
+                return cf
+        return None
+
+
+class FlowIndex:
+    """
+    Flow tables for every device plus the inter-switch links, as
+    {(device, port): (neighbor_device, neighbor_port)}.
+    """
+
+    def __init__(self, link_ports_map, flows_by_device=None):
+        self.links = link_ports_map
+        self.tables = {}
+        for device, flows in (flows_by_device or {}).items():
+            self.load_device(device, flows)
+
+    def load_device(self, device, flows):
+        self.tables[device] = FlowTable(flows)
+
+    def next_hop(self, device, header):
+        table = self.tables.get(device)
+        cf = table.lookup(header) if table else None
+        if cf is None or not cf.outputs:
+            return None
+        return cf.outputs[0]
+
+    def trace(self, device, in_port, header, max_hops=64):
+        header = dict(header)
+        hops = []
+        seen = set()
+        for _ in range(max_hops):
+            in_port = str(in_port)
+            if (device, in_port) in seen:
+                return TraceResult(hops, "loop")
+            seen.add((device, in_port))
+            header["in_port"] = in_port
+            out = self.next_hop(device, header)
+            if out is None:
+                hops.append((device, in_port, None))
+                return TraceResult(hops, "drop")
+            if out == "IN_PORT":
+                out = in_port
+            hops.append((device, in_port, out))
+            if out == "CONTROLLER":
+                return TraceResult(hops, "controller")
+            peer = self.links.get((device, out))
+            if peer is None:
+                return TraceResult(hops, "host")
+            device, in_port = peer
+        return TraceResult(hops, "max-hops")
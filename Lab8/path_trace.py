@@ -1,19 +1,35 @@
 #!/usr/bin/env python3
-import requests
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import time
+
 from requests.auth import HTTPBasicAuth
 
+import flow_snapshot
+import flow_trace
+import topology
+
 controller_ip = "10.224.78.63"
 authentication = HTTPBasicAuth("onos", "rocks")
 rest_url = f"http://{controller_ip}:8181/onos/v1"
 json_headers = {"Accept": "application/json"}
+http_port = 8080
+
+# All flows and links come from one bulk sweep over a keep-alive session
+snapshot = flow_snapshot.FlowSnapshot(rest_url, authentication)
+
+topo = topology.load()
+device_names = {ofid: name for name, ofid in topo.devices().items()}
 
-# We only care about the edge switches:
-devices = {
-    "OvS1": "of:0000000000000001",
-    "OvS5": "of:0000000000000005",
-}
+# We only care about the edge switches (the ones with hosts attached):
+devices = topo.edge_devices()
 
 def of_to_name(ofid: str) -> str:
+    if ofid in device_names:
+        return device_names[ofid]
     if ofid.startswith("of:00000000000000"):
         try:
             return f"OvS{int(ofid[-2:], 16)}"
@@ -22,21 +38,25 @@ def of_to_name(ofid: str) -> str:
     return ofid
 
 def get_json(url):
-    r = requests.get(url, auth=authentication, headers=json_headers)
+    r = snapshot.session.get(url, headers=json_headers)
     r.raise_for_status()
     return r.json()
 
-def get_links_map():
-    # Return map {(device,port) → neighbor_device} for inter-switch links
-    links = get_json(f"{rest_url}/links").get("links", [])
+def get_link_ports_map():
+    # Return map {(device,port) → (neighbor_device, neighbor_port)} for inter-switch links
+    links = snapshot.links()
     link_map = {}
     for l in links:
         sdev, sport = l["src"]["device"], l["src"]["port"]
         ddev, dport = l["dst"]["device"], l["dst"]["port"]
-        link_map[(sdev, sport)] = ddev
-        link_map[(ddev, dport)] = sdev
+        link_map[(sdev, sport)] = (ddev, dport)
+        link_map[(ddev, dport)] = (sdev, sport)
     return link_map
 
+def get_links_map():
+    # Return map {(device,port) → neighbor_device} for inter-switch links
+    return {k: dev for k, (dev, _) in get_link_ports_map().items()}
+
 def flow_output_port(flow):
     for inst in flow.get("treatment", {}).get("instructions", []):
         if inst.get("type") == "OUTPUT":
@@ -56,40 +76,230 @@ def is_http(flow):
             return True
     return False
 
-def summarize_network_outbound(device_id, links_map):
-    flows = get_json(f"{rest_url}/flows/{device_id}").get("flows", [])
-    http_next, ip_next = None, None
+def load_flow_index(link_ports):
+    # Every device's flow table, compiled once for repeated tracing
+    index = flow_trace.FlowIndex(link_ports)
+    snapshot.refresh()
+    for ofid in topo.devices().values():
+        index.load_device(ofid, snapshot.device_flows(ofid))
+    return index
 
-    for f in flows:
-        if not is_ipv4(f):
-            continue
-        outp = flow_output_port(f)
-        if not outp or outp == "CONTROLLER":
-            continue
+def host_attachments():
+    # {host: (device_id, port, ip)}
+    devs = topo.devices()
+    return {h: (devs[sw], str(port), topo.hosts[h].get("ip"))
+            for sw, port, h in topo.host_links()}
+
+def probe_headers(src_ip, dst_ip):
+    # Plain IP (ICMP), HTTP request and HTTP reply as seen leaving the source
+    return {
+        "IP": flow_trace.make_header(eth_type=0x0800, ip_proto=1, ipv4_src=src_ip, ipv4_dst=dst_ip),
+        "HTTP": flow_trace.make_header(eth_type=0x0800, ip_proto=6, ipv4_src=src_ip, ipv4_dst=dst_ip,
+                                       tcp_src=40000, tcp_dst=http_port),
+        "HTTP reply": flow_trace.make_header(eth_type=0x0800, ip_proto=6, ipv4_src=src_ip, ipv4_dst=dst_ip,
+                                             tcp_src=http_port, tcp_dst=40000),
+    }
+
+def first_hop(result):
+    # Next switch after the ingress device, if the packet left it on a link
+    if len(result.hops) > 1:
+        return of_to_name(result.hops[1][0])
+    return None
+
+def format_trace(result):
+    path = " -> ".join(of_to_name(dev) for dev, _, _ in result.hops)
+    last_out = result.hops[-1][2] if result.hops else None
+    if result.outcome == "host":
+        return f"{path} -> port {last_out} (host)"
+    return f"{path} ({result.outcome})"
+
+def summarize_network_outbound(index, device_id, in_port, src_ip, dst_ip):
+    # Trace each probe class from a host port and return {kind: TraceResult}
+    return {kind: index.trace(device_id, in_port, header)
+            for kind, header in probe_headers(src_ip, dst_ip).items()}
 
-        # Only consider links that lead to another switch
-        nxt = links_map.get((device_id, str(outp)))
-        if not nxt:
-            continue  # skip host/gw ports
+def bench(index, attachments, count):
+    # Random header combinations between host pairs, traced end to end
+    pairs = [(a, b) for a in attachments for b in attachments if a != b]
+    if not pairs:
+        print("No host pairs to trace.")
+        return
+    rng = random.Random(0)
+    probes = []
+    for _ in range(count):
+        src, dst = rng.choice(pairs)
+        dev, port, src_ip = attachments[src]
+        proto = rng.choice((1, 6, 17))
+        sport = rng.choice((http_port, rng.randrange(1024, 65535)))
+        dport = rng.choice((http_port, rng.randrange(1024, 65535)))
+        fields = dict(eth_type=0x0800, ip_proto=proto, ipv4_src=src_ip, ipv4_dst=attachments[dst][2])
+        if proto == 6:
+            fields.update(tcp_src=sport, tcp_dst=dport)
+        elif proto == 17:
+            fields.update(udp_src=sport, udp_dst=dport)
+        probes.append((dev, port, flow_trace.make_header(**fields)))
+    start = time.perf_counter()
+    outcomes = {}
+    for dev, port, header in probes:
+        r = index.trace(dev, port, header)
+        outcomes[r.outcome] = outcomes.get(r.outcome, 0) + 1
+    elapsed = time.perf_counter() - start
+    print(f"Traced {count} headers in {elapsed:.3f}s ({count / elapsed:.0f}/s): {outcomes}")
 
-        nxt_name = of_to_name(nxt)
-        if is_http(f):
-            http_next = nxt_name
-        else:
-            ip_next = nxt_name
+def device_hash(flows):
+    # Content hash of a device's flow set; ONOS flow ids do not cover the treatment
+    items = sorted(json.dumps([f.get("priority"), f.get("state"), f.get("selector"), f.get("treatment")],
+                              sort_keys=True) for f in flows)
+    return hashlib.sha1("\n".join(items).encode()).hexdigest()
 
-    return ip_next, http_next
+def timestamp():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def watch(interval, quiet_polls=1, resync=30.0):
+    """
+    Poll the per-device flow counts and re-trace only the probes whose last
+    path went through a device whose flow set changed. Only devices whose
+    count moved are fetched again, so each poll costs one small request
+    plus the changed tables. A change that keeps a device's count (a flow
+    modified in place) is only seen at the full resync every `resync`
+    seconds. Prints next-hop diffs as they happen and the convergence time
+    of each change burst; returns [(burst start, seconds, device updates)].
+    """
+    attachments = host_attachments()
+    probes = {}
+    for src, (dev, port, src_ip) in attachments.items():
+        for dst, (_, _, dst_ip) in attachments.items():
+            if dst != src:
+                for kind, header in probe_headers(src_ip, dst_ip).items():
+                    probes[(src, dst, kind)] = (dev, port, header)
+
+    all_devices = list(topo.devices().values())
+    resync_polls = max(1, int(resync / interval))
+    index = None
+    link_ports = None
+    counts = {}
+    hashes = {}
+    results = {}
+    convergence = []  # (burst start, seconds to converge, device updates)
+    burst_start, burst_changes, quiet = None, 0, 0
+    first_poll = True
+    since_sync = resync_polls
+    print(f"[{timestamp()}] Watching {len(probes)} probes across {len(all_devices)} devices "
+          f"every {interval}s, full resync every {resync_polls} polls (Ctrl-C to stop)")
+    try:
+        while True:
+            poll_start = time.time()
+            new_links = get_link_ports_map()
+            if new_links != link_ports:
+                # Topology change: everything has to be traced again
+                link_ports = new_links
+                index = flow_trace.FlowIndex(link_ports)
+                hashes.clear()
+                results.clear()
+                since_sync = resync_polls
+
+            # Counts first: a change after them shows up in the next poll
+            new_counts = snapshot.flow_counts()
+            if since_sync >= resync_polls:
+                snapshot.refresh(force=True)
+                suspects = all_devices
+                since_sync = 0
+            else:
+                suspects = [d for d in all_devices if new_counts.get(d) != counts.get(d)]
+                for ofid in suspects:
+                    snapshot.refresh_device(ofid)
+                since_sync += 1
+            counts = new_counts
+
+            changed = set()
+            for ofid in suspects:
+                flows = snapshot.flows.get(ofid, [])
+                h = device_hash(flows)
+                if hashes.get(ofid) != h:
+                    hashes[ofid] = h
+                    index.load_device(ofid, flows)
+                    changed.add(ofid)
+
+            diffs = []
+            for key, (dev, port, header) in probes.items():
+                old = results.get(key)
+                if old is not None and not changed.intersection(d for d, _, _ in old.hops):
+                    continue
+                new = index.trace(dev, port, header)
+                results[key] = new
+                if old is None or old.hops != new.hops or old.outcome != new.outcome:
+                    diffs.append((key, old, new))
+
+            now = timestamp()
+            for (src, dst, kind), old, new in diffs:
+                before = (first_hop(old) or "-") if old else "?"
+                print(f"[{now}] {src} -> {dst} {kind}: next hop {before} -> {first_hop(new) or '-'}   "
+                      f"{format_trace(new)}")
+
+            # A burst runs from the first poll that saw a flow change to the
+            # first poll without one; it is closed after quiet_polls such polls
+            if changed and not first_poll:
+                if burst_start is None:
+                    burst_start, burst_changes = poll_start, 0
+                burst_changes += len(changed)
+                quiet = 0
+            elif burst_start is not None:
+                quiet += 1
+                if quiet == 1:
+                    settled = poll_start
+                if quiet >= quiet_polls:
+                    took = settled - burst_start
+                    convergence.append((burst_start, took, burst_changes))
+                    unreachable = sum(1 for r in results.values() if r.outcome != "host")
+                    print(f"[{now}] Converged within {took:.2f}s ({burst_changes} device updates, "
+                          f"{unreachable} probes not reaching a host)")
+                    burst_start = None
+            first_poll = False
+
+            time.sleep(max(0.0, interval - (time.time() - poll_start)))
+    except KeyboardInterrupt:
+        print()
+    return convergence
 
 def main():
-    links_map = get_links_map()
+    parser = argparse.ArgumentParser(description="Trace IP/HTTP paths through the ONOS flow tables")
+    parser.add_argument("--bench", type=int, metavar="N", help="trace N random headers and report the rate")
+    parser.add_argument("--watch", action="store_true", help="keep polling and print next-hop changes")
+    parser.add_argument("--interval", type=float, default=1.0, help="poll interval for --watch (seconds)")
+    parser.add_argument("--resync", type=float, default=30.0,
+                        help="full flow snapshot every this many seconds in --watch (seconds)")
+    args = parser.parse_args()
+
+    if args.watch:
+        convergence = watch(args.interval, resync=args.resync)
+        if convergence:
+            times = [took for _, took, _ in convergence]
+            print(f"{len(times)} change bursts, convergence mean {sum(times) / len(times):.2f}s, "
+                  f"max {max(times):.2f}s (resolution {args.interval}s)")
+            for started, took, updates in convergence:
+                print(f"  {datetime.datetime.fromtimestamp(started).strftime('%H:%M:%S')}  "
+                      f"{took:6.2f}s  {updates} device updates")
+        return
+
+    index = load_flow_index(get_link_ports_map())
+    attachments = host_attachments()
+    if args.bench:
+        bench(index, attachments, args.bench)
+        return
+
     print()
-    for name, ofid in devices.items():
-        ip_next, http_next = summarize_network_outbound(ofid, links_map)
-        print(f"{name}:")
-        print(f"   IP traffic outbound -> {ip_next or '(no network flow found)'}")
-        print(f"   HTTP traffic outbound -> {http_next or '(no network flow found)'}")
-        print()
+    for src, (dev, port, src_ip) in attachments.items():
+        if dev not in devices.values():
+            continue
+        for dst, (_, _, dst_ip) in attachments.items():
+            if dst == src:
+                continue
+            results = summarize_network_outbound(index, dev, port, src_ip, dst_ip)
+            print(f"{of_to_name(dev)} ({src} -> {dst}):")
+            for kind, result in results.items():
+                print(f"   {kind} traffic outbound -> {first_hop(result) or '(no network flow found)'}")
+                print(f"      {format_trace(result)}")
+            print()
 
 if __name__ == "__main__":
     main()
-
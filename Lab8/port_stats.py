@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Port statistics sampler and link-utilization model.
+
+One GET /onos/v1/statistics/ports per interval covers every port in the
+network. Cumulative byte counters are turned into rates (handling 64-bit
+wrap and counter resets) and written into fixed-size ring buffers. Every
+port has a slot in flat array.array columns, so memory is O(ports * window)
+and a sample allocates nothing on the storage side. Current utilization
+and headroom per link direction can be used as edge weights for
+topology.Topology.shortest_path.
+"""
+
+import argparse
+import threading
+import time
+from array import array
+
+counter_wrap = 1 << 64
+
+
+class PortStatsSampler:
+    def __init__(self, get_json, window=60, default_capacity_mbps=1000.0, capacity_hint=64):
+        self.get_json = get_json  # callable: path -> parsed JSON
+        self.window = window
+        self.default_capacity = default_capacity_mbps * 1e6 / 8  # bytes/s
+        self.slots = {}  # (device, port) -> slot index
+        self.keys = []   # slot index -> (device, port)
+
+        # Per-slot columns
+        self.capacity = array("d")
+        self.last_rx = array("Q")
+        self.last_tx = array("Q")
+        self.last_dur = array("q")
+        self.seen = array("b")
+        self.rx_rate = array("d")  # window entries per slot, bytes/s
+        self.tx_rate = array("d")
+        self._grow(capacity_hint)
+        self.used = 0
+
+        self.head = -1    # ring position of the newest sample
+        self.filled = 0   # samples in the ring (<= window)
+        self.last_time = None
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _grow(self, slots):
+        # Extend every column to hold `slots` ports; only happens when new ports appear
+        extra = slots - len(self.capacity)
+        if extra <= 0:
+            return
+        self.capacity.extend([self.default_capacity] * extra)
+        self.last_rx.extend([0] * extra)
+        self.last_tx.extend([0] * extra)
+        self.last_dur.extend([0] * extra)
+        self.seen.extend([0] * extra)
+        self.rx_rate.extend([0.0] * (extra * self.window))
+        self.tx_rate.extend([0.0] * (extra * self.window))
+
+    def _slot(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.used
+            if slot >= len(self.capacity):
+                self._grow(max(2 * len(self.capacity), 64))
+            self.slots[key] = slot
+            self.keys.append(key)
+            self.used += 1
+        return slot
+
+    def set_capacity(self, device, port, mbps):
+        self.capacity[self._slot((device, str(port)))] = mbps * 1e6 / 8
+
+    def load_capacities(self, topo):
+        # Use the "bw" (Mbps) option of TCLinks in a topology descriptor
+        devs = topo.devices()
+        for a, pa, b, pb, opts in topo.links:
+            bw = opts.get("bw")
+            if bw is None:
+                continue
+            if a in devs:
+                self.set_capacity(devs[a], pa, bw)
+            if b in devs:
+                self.set_capacity(devs[b], pb, bw)
+
+    @staticmethod
+    def _delta(new, old, reset):
+        if reset:
+            return None
+        if new >= old:
+            return new - old
+        # Counter went backwards without a reset: 64-bit wrap
+        return new + counter_wrap - old
+
+    def sample(self, stats=None, now=None):
+        """
+        Take one sample. stats is the parsed /statistics/ports response
+        (fetched when not given).
+        """
+        if stats is None:
+            stats = self.get_json("/statistics/ports").get("statistics", [])
+        now = time.time() if now is None else now
+        with self.lock:
+            dt = (now - self.last_time) if self.last_time is not None else 0.0
+            head = (self.head + 1) % self.window
+            w = self.window
+            for dev in stats:
+                device = dev.get("device")
+                for p in dev.get("ports", []):
+                    slot = self._slot((device, str(p.get("port"))))
+                    rx = p.get("bytesReceived", 0)
+                    tx = p.get("bytesSent", 0)
+                    dur = p.get("durationSec", 0)
+                    i = slot * w + head
+                    prev = slot * w + self.head if self.head >= 0 else i
+                    if self.seen[slot] and dt > 0:
+                        reset = dur < self.last_dur[slot]
+                        drx = self._delta(rx, self.last_rx[slot], reset)
+                        dtx = self._delta(tx, self.last_tx[slot], reset)
+                        # After a reset keep the previous rate for this sample
+                        self.rx_rate[i] = drx / dt if drx is not None else self.rx_rate[prev]
+                        self.tx_rate[i] = dtx / dt if dtx is not None else self.tx_rate[prev]
+                    else:
+                        self.rx_rate[i] = 0.0
+                        self.tx_rate[i] = 0.0
+                        self.seen[slot] = 1
+                    self.last_rx[slot] = rx
+                    self.last_tx[slot] = tx
+                    self.last_dur[slot] = dur
+            self.head = head
+            self.last_time = now
+            self.samples += 1
+            if dt > 0:
+                self.filled = min(self.filled + 1, w)
+
+    # ---------------------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------------------
+    def rate(self, device, port, direction="tx", samples=1):
+        # Mean bytes/s over the newest `samples` entries of the ring
+        slot = self.slots.get((device, str(port)))
+        if slot is None or self.filled == 0:
+            return 0.0
+        ring = self.tx_rate if direction == "tx" else self.rx_rate
+        n = min(samples, self.filled)
+        base = slot * self.window
+        total = 0.0
+        for k in range(n):
+            total += ring[base + (self.head - k) % self.window]
+        return total / n
+
+    def history(self, device, port, direction="tx"):
+        # Rates oldest to newest (allocates; for display only)
+        slot = self.slots.get((device, str(port)))
+        if slot is None:
+            return []
+        ring = self.tx_rate if direction == "tx" else self.rx_rate
+        base = slot * self.window
+        return [ring[base + (self.head - k) % self.window] for k in range(self.filled - 1, -1, -1)]
+
+    def utilization(self, device, port, samples=1):
+        slot = self.slots.get((device, str(port)))
+        if slot is None:
+            return 0.0
+        return min(1.0, self.rate(device, port, "tx", samples) / self.capacity[slot])
+
+    def headroom(self, device, port, samples=1):
+        # Spare capacity in bits/s on the egress direction of (device, port)
+        slot = self.slots.get((device, str(port)))
+        if slot is None:
+            return self.default_capacity * 8
+        return max(0.0, self.capacity[slot] - self.rate(device, port, "tx", samples)) * 8
+
+    def edge_weights(self, topo, samples=3, max_util=0.99):
+        """
+        {(switch, neighbor): weight} for Topology.shortest_path. A link costs
+        1 / (1 - utilization), so idle links cost 1 and nearly full ones a lot.
+        """
+        devs = topo.devices()
+        weights = {}
+        for a, pa, b, pb in topo.switch_links():
+            for src, port, dst in ((a, pa, b), (b, pb, a)):
+                u = min(self.utilization(devs[src], port, samples), max_util)
+                weights[(src, dst)] = 1.0 / (1.0 - u)
+        return weights
+
+    # ---------------------------------------------------------------------
+    # Background polling
+    # ---------------------------------------------------------------------
+    def run(self, interval):
+        while not self.stop_event.is_set():
+            start = time.time()
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Port statistics poll failed: {e}")
+            self.stop_event.wait(max(0.0, interval - (time.time() - start)))
+
+    def start(self, interval=2.0):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(interval,), name="port-stats", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Join so that a start() right after this one is not ignored
+        self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+def main():
+    import app_core
+
+    parser = argparse.ArgumentParser(description="Sample ONOS port statistics and print link utilization")
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--window", type=int, default=60)
+    args = parser.parse_args()
+
+    sampler = PortStatsSampler(app_core.snapshot.get_json, window=args.window)
+    sampler.load_capacities(app_core.topo)
+    names = {ofid: name for name, ofid in app_core.devices.items()}
+    try:
+        while True:
+            start = time.time()
+            sampler.sample()
+            busiest = sorted(((sampler.utilization(d, p), d, p) for d, p in sampler.keys), reverse=True)[:5]
+            print(f"[{time.strftime('%H:%M:%S')}] " + ", ".join(
+                f"{names.get(d, d)}:{p} {u:.1%}" for u, d, p in busiest))
+            time.sleep(max(0.0, args.interval - (time.time() - start)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
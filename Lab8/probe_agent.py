@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Measurement agent for the Mininet VM.
+
+Start it once next to Mininet (sudo python3 probe_agent.py). It accepts
+long-lived TCP connections carrying JSON lines and runs HTTP probes from any
+Mininet host's network namespace, streaming one result line per sample back
+on the same connection. Requests are handled concurrently and tagged with
+the client's id so many probes can share one connection.
+
+    -> {"id": 7, "op": "probe", "host": "H1", "url": "http://1.1.1.1:8080",
+        "local_port": 40016, "port_span": 16, "count": 10, "timeout": 10}
+    <- {"id": 7, "seq": 0, "ok": true, "connect": 0.001, "ttfb": 0.004, "transfer": 0.002, "total": 0.007}
+    ...
+    <- {"id": 7, "done": true}
+
+Other ops: {"op": "hosts"} lists the namespaces the agent can use,
+{"op": "ping"} answers {"pong": true}.
+
+The agent runs curl as root, so it listens on 127.0.0.1 by default (reach
+it over an ssh tunnel: ssh -L 9099:127.0.0.1:9099 vm). Every request must
+carry the shared token given with --token or LAB8_PROBE_TOKEN; the agent
+refuses to listen on any other address without one. --allow-url limits the
+URLs it will fetch to the given prefixes.
+
+With --local the agent is a stand-in for testing away from Mininet: a host
+name that matches a network namespace (ip netns) runs there, anything else
+runs in the agent's own namespace (e.g. against a loopback server).
+"""
+
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+
+curl_format = "%{time_connect} %{time_starttransfer} %{time_total}"
+
+
+def find_mininet_hosts():
+    # Mininet host shells run as "bash ... mininet:<name>"; map name -> pid
+    hosts = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                args = f.read().split(b"\0")
+        except OSError:
+            continue
+        for a in args:
+            if a.startswith(b"mininet:"):
+                hosts[a[len("mininet:"):].decode()] = int(pid)
+    return hosts
+
+
+def find_netns():
+    try:
+        return {name: name for name in os.listdir("/var/run/netns")}
+    except OSError:
+        return {}
+
+
+class ProbeAgent:
+    def __init__(self, local=False, max_concurrent=64, token=None, allow_urls=()):
+        self.local = local
+        self.limit = asyncio.Semaphore(max_concurrent)
+        self.token = token
+        self.allow_urls = tuple(allow_urls)
+        self.hosts = {}
+        self.refresh_hosts()
+
+    def refresh_hosts(self):
+        self.hosts = find_netns() if self.local else find_mininet_hosts()
+
+    def command_prefix(self, host):
+        if host not in self.hosts:
+            self.refresh_hosts()
+        if self.local:
+            if host in self.hosts:
+                return ["ip", "netns", "exec", host]
+            return []
+        if host not in self.hosts:
+            raise KeyError(f"unknown Mininet host {host}")
+        return ["mnexec", "-a", str(self.hosts[host])]
+
+    async def probe_once(self, prefix, url, local_port, timeout):
+        argv = prefix + ["curl", "-s", "-o", "/dev/null", "-m", str(timeout), "-w", curl_format]
+        if local_port:
+            argv += ["--local-port", str(local_port)]
+        argv.append(url)
+        async with self.limit:
+            proc = await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            try:
+                out, _ = await proc.communicate()
+            finally:
+                # Cancelled (client gone): don't leave curl running
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+        if proc.returncode != 0:
+            return {"ok": False, "error": f"curl exit {proc.returncode}"}
+        try:
+            connect, start, total = (float(v) for v in out.decode().split())
+        except ValueError:
+            return {"ok": False, "error": "unparsable curl output"}
+        return {"ok": True, "connect": connect, "ttfb": max(0.0, start - connect),
+                "transfer": max(0.0, total - start), "total": total}
+
+    def authorized(self, req):
+        if not self.token:
+            return True
+        return hmac.compare_digest(str(req.get("token", "")).encode(), self.token.encode())
+
+    def url_allowed(self, url):
+        return not self.allow_urls or any(url.startswith(p) for p in self.allow_urls)
+
+    async def run_probe(self, req, send):
+        rid = req.get("id")
+        if not self.url_allowed(req.get("url", "")):
+            await send({"id": rid, "error": f"url not allowed: {req.get('url')}", "done": True})
+            return
+        try:
+            prefix = self.command_prefix(req["host"])
+        except KeyError as e:
+            await send({"id": rid, "error": str(e), "done": True})
+            return
+        local_port, span = req.get("local_port"), max(1, int(req.get("port_span", 1)))
+        for seq in range(int(req.get("count", 1))):
+            # Rotate the source port so a sample never reuses one still in TIME_WAIT
+            port = local_port + seq % span if local_port else None
+            result = await self.probe_once(prefix, req["url"], port, req.get("timeout", 10))
+            await send(dict(result, id=rid, seq=seq))
+        await send({"id": rid, "done": True})
+
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def send(obj):
+            async with lock:
+                writer.write((json.dumps(obj) + "\n").encode())
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    req = json.loads(line)
+                except ValueError:
+                    await send({"error": "bad json"})
+                    continue
+                if not self.authorized(req):
+                    await send({"id": req.get("id"), "error": "bad token", "done": True})
+                    break
+                op = req.get("op", "probe")
+                if op == "ping":
+                    await send({"id": req.get("id"), "pong": True})
+                elif op == "hosts":
+                    self.refresh_hosts()
+                    await send({"id": req.get("id"), "hosts": sorted(self.hosts)})
+                elif op == "probe":
+                    task = asyncio.ensure_future(self.run_probe(req, send))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    await send({"id": req.get("id"), "error": f"unknown op {op}", "done": True})
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+async def serve(host, port, local, max_concurrent, token=None, allow_urls=()):
+    agent = ProbeAgent(local=local, max_concurrent=max_concurrent, token=token, allow_urls=allow_urls)
+    server = await asyncio.start_server(agent.handle, host, port)
+    mode = "local stand-in" if local else "Mininet"
+    print(f"Probe agent ({mode}) listening on {host}:{port}, hosts: {', '.join(sorted(agent.hosts)) or 'none'}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running probe agent for Mininet hosts")
+    parser.add_argument("--listen", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--local", action="store_true",
+                        help="run probes in local netns or the agent's namespace instead of Mininet hosts")
+    parser.add_argument("--max-concurrent", type=int, default=64)
+    parser.add_argument("--token", default=os.environ.get("LAB8_PROBE_TOKEN"),
+                        help="shared secret every request must carry (default $LAB8_PROBE_TOKEN)")
+    parser.add_argument("--allow-url", action="append", default=[], metavar="PREFIX",
+                        help="only probe URLs starting with PREFIX (repeatable)")
+    args = parser.parse_args()
+    if not args.token and not is_loopback(args.listen):
+        parser.error(f"--token (or LAB8_PROBE_TOKEN) is required to listen on {args.listen}")
+    try:
+        asyncio.run(serve(args.listen, args.port, args.local, args.max_concurrent,
+                          args.token, args.allow_url))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
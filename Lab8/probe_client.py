@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Async client for probe_agent.py.
+
+One TCP connection to the agent carries every probe; responses are routed
+back to the waiting coroutine by request id, so any number of probes can be
+in flight at once.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+
+import delay_stats
+
+# host:port of the agent on the Mininet VM; unset means "use ssh"
+default_agent = os.environ.get("LAB8_PROBE_AGENT")
+# Shared secret the agent was started with
+default_token = os.environ.get("LAB8_PROBE_TOKEN")
+
+
+def parse_address(addr, default_port=9099):
+    host, _, port = addr.partition(":")
+    return host, int(port or default_port)
+
+
+class ProbeClient:
+    def __init__(self, host, port=9099, token=default_token):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.reader = None
+        self.writer = None
+        self.ids = itertools.count(1)
+        self.pending = {}  # request id -> asyncio.Queue of response dicts
+        self.reader_task = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.reader_task = asyncio.ensure_future(self._read_loop())
+        return self
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+        if self.reader_task:
+            self.reader_task.cancel()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                queue = self.pending.get(msg.get("id"))
+                if queue is not None:
+                    queue.put_nowait(msg)
+        finally:
+            # Wake everyone still waiting on a closed connection
+            for queue in self.pending.values():
+                queue.put_nowait({"error": "connection closed", "done": True})
+
+    async def _request(self, req):
+        rid = next(self.ids)
+        queue = asyncio.Queue()
+        self.pending[rid] = queue
+        if self.token:
+            req = dict(req, token=self.token)
+        self.writer.write((json.dumps(dict(req, id=rid)) + "\n").encode())
+        await self.writer.drain()
+        return rid, queue
+
+    async def stream(self, host, url, local_port=None, count=1, timeout=10, port_span=1):
+        """
+        Yield one response dict per sample as the agent reports it. Sample i
+        uses source port local_port + i % port_span.
+        """
+        rid, queue = await self._request({"op": "probe", "host": host, "url": url,
+                                          "local_port": local_port, "count": count,
+                                          "timeout": timeout, "port_span": port_span})
+        try:
+            while True:
+                msg = await queue.get()
+                if msg.get("done"):
+                    if "error" in msg:
+                        raise RuntimeError(msg["error"])
+                    return
+                yield msg
+        finally:
+            self.pending.pop(rid, None)
+
+    async def probe(self, host, url, local_port=None, count=1, timeout=10, port_span=1):
+        # ([delay_stats.Sample, ...], failed probes)
+        samples, failed = [], 0
+        async for msg in self.stream(host, url, local_port, count, timeout, port_span):
+            if msg.get("ok"):
+                samples.append(delay_stats.Sample(msg["connect"], msg["ttfb"],
+                                                  msg["transfer"], msg["total"]))
+            else:
+                failed += 1
+        return samples, failed
+
+    async def hosts(self):
+        rid, queue = await self._request({"op": "hosts"})
+        try:
+            return (await queue.get()).get("hosts", [])
+        finally:
+            self.pending.pop(rid, None)
+
+
+async def probe_all(agent, specs):
+    """
+    Run several probes concurrently over one connection. specs maps a key
+    to keyword arguments for ProbeClient.probe; returns {key: (samples, failed)}.
+    """
+    host, port = parse_address(agent)
+    async with ProbeClient(host, port) as client:
+        keys = list(specs)
+        results = await asyncio.gather(*(client.probe(**specs[k]) for k in keys),
+                                       return_exceptions=True)
+    out = {}
+    for key, res in zip(keys, results):
+        out[key] = ([], specs[key].get("count", 1)) if isinstance(res, Exception) else res
+    return out
+
+
+def run_probes(agent, specs):
+    # Blocking wrapper for the synchronous tools
+    return asyncio.run(probe_all(agent, specs))
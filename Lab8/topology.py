@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Topology descriptors shared by the Mininet scripts and the ONOS apps.
+
+A descriptor is a JSON file:
+
+    {
+        "name": "lab8",
+        "controller": {"name": "Controller", "ip": "10.224.78.63", "port": 6653, "protocol": "tcp"},
+        "protocols": "OpenFlow13",
+        "switches": [{"name": "OvS1", "dpid": "0000000000000001"}, ...],
+        "hosts": [{"name": "H1", "ip": "10.0.0.1", "defaultRoute": "10.0.0.2"}, ...],
+        "links": [["H1", "OvS1"], ["OvS1", "OvS2"], ...]
+    }
+
+Links may also be objects ({"src", "dst", "src_port", "dst_port", "opts"}).
+Ports that are not given are numbered per node in link order, the same way
+Mininet numbers them, so the port maps used by app_core and path_trace line
+up with the interfaces Mininet creates.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+
+default_descriptor = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lab8_topo.json")
+
+
+def dpid_to_of(dpid: str) -> str:
+    return f"of:{dpid.lower().zfill(16)}"
+
+
+class Topology:
+    def __init__(self, desc):
+        self.name = desc.get("name", "topology")
+        self.controller = desc.get("controller", {})
+        self.protocols = desc.get("protocols", "OpenFlow13")
+        self.switches = {}  # name -> dpid (16 hex digits)
+        self.hosts = {}     # name -> host options
+        for i, sw in enumerate(desc.get("switches", []), start=1):
+            self.switches[sw["name"]] = str(sw.get("dpid", f"{i:016x}")).zfill(16)
+        for h in desc.get("hosts", []):
+            opts = dict(h)
+            self.hosts[opts.pop("name")] = opts
+
+        # Resolved links: (node_a, port_a, node_b, port_b, opts)
+        self.links = []
+        next_port = {}
+        for l in desc.get("links", []):
+            if isinstance(l, (list, tuple)):
+                l = {"src": l[0], "dst": l[1]}
+            a, b = l["src"], l["dst"]
+            for node in (a, b):
+                if node not in self.switches and node not in self.hosts:
+                    raise ValueError(f"link {a}-{b} references unknown node {node}")
+            pa = l.get("src_port") or self._next_port(next_port, a)
+            pb = l.get("dst_port") or self._next_port(next_port, b)
+            next_port[a] = max(next_port.get(a, 0), pa)
+            next_port[b] = max(next_port.get(b, 0), pb)
+            self.links.append((a, int(pa), b, int(pb), l.get("opts", {})))
+
+    def _next_port(self, next_port, node):
+        # Mininet numbers switch ports from 1 and host interfaces from 0
+        if node in next_port:
+            return next_port[node] + 1
+        return 1 if node in self.switches else 0
+
+    def to_dict(self):
+        links = []
+        for a, pa, b, pb, opts in self.links:
+            link = {"src": a, "dst": b, "src_port": pa, "dst_port": pb}
+            if opts:
+                link["opts"] = opts
+            links.append(link)
+        return {
+            "name": self.name,
+            "controller": self.controller,
+            "protocols": self.protocols,
+            "switches": [{"name": n, "dpid": d} for n, d in self.switches.items()],
+            "hosts": [dict(name=n, **opts) for n, opts in self.hosts.items()],
+            "links": links,
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    # ---------------------------------------------------------------------
+    # Maps used by the controller-side tools
+    # ---------------------------------------------------------------------
+    def devices(self):
+        # {"OvS1": "of:0000000000000001", ...} as used by app_core
+        return {name: dpid_to_of(dpid) for name, dpid in self.switches.items()}
+
+    def switch_links(self):
+        for a, pa, b, pb, _ in self.links:
+            if a in self.switches and b in self.switches:
+                yield a, pa, b, pb
+
+    def host_links(self):
+        # (switch, port, host) for every host attachment
+        for a, pa, b, pb, _ in self.links:
+            if a in self.switches and b in self.hosts:
+                yield a, pa, b
+            elif b in self.switches and a in self.hosts:
+                yield b, pb, a
+
+    def links_map(self):
+        # Same shape as path_trace.get_links_map: {(device, port): neighbor_device}
+        devs = self.devices()
+        link_map = {}
+        for a, pa, b, pb in self.switch_links():
+            link_map[(devs[a], str(pa))] = devs[b]
+            link_map[(devs[b], str(pb))] = devs[a]
+        return link_map
+
+    def link_ports_map(self):
+        # {(device, port): (neighbor_device, neighbor_port)}
+        devs = self.devices()
+        link_map = {}
+        for a, pa, b, pb in self.switch_links():
+            link_map[(devs[a], str(pa))] = (devs[b], str(pb))
+            link_map[(devs[b], str(pb))] = (devs[a], str(pa))
+        return link_map
+
+    def edge_devices(self):
+        # Switches with at least one host attached, in descriptor order
+        edge = {sw for sw, _, _ in self.host_links()}
+        return {name: ofid for name, ofid in self.devices().items() if name in edge}
+
+    def link_ports(self):
+        # Transit switches (exactly two ports, no hosts) forward port-to-port,
+        # matching the link_ports table in app_core.initial_setup
+        ports = {}
+        for a, pa, b, pb, _ in self.links:
+            ports.setdefault(a, []).append(pa)
+            ports.setdefault(b, []).append(pb)
+        edge = {sw for sw, _, _ in self.host_links()}
+        transit = {}
+        for name in self.switches:
+            p = sorted(ports.get(name, []))
+            if len(p) == 2 and name not in edge:
+                transit[name] = [(p[0], p[1]), (p[1], p[0])]
+        return transit
+
+    def adjacency(self):
+        # {switch: [(neighbor, out_port), ...]}
+        adj = {name: [] for name in self.switches}
+        for a, pa, b, pb in self.switch_links():
+            adj[a].append((b, pa))
+            adj[b].append((a, pb))
+        return adj
+
+    def shortest_path(self, src, dst, weights=None):
+        """
+        Dijkstra over the switch graph. weights maps (switch, neighbor) to an
+        edge cost (default 1). Returns the list of switch names or None.
+        """
+        adj = self.adjacency()
+        dist = {src: 0}
+        prev = {}
+        heap = [(0, src)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node == dst:
+                break
+            if d > dist.get(node, float("inf")):
+                continue
+            for nbr, _ in adj[node]:
+                w = weights.get((node, nbr), 1) if weights else 1
+                nd = d + w
+                if nd < dist.get(nbr, float("inf")):
+                    dist[nbr] = nd
+                    prev[nbr] = node
+                    heapq.heappush(heap, (nd, nbr))
+        if dst not in dist:
+            return None
+        path = [dst]
+        while path[-1] != src:
+            path.append(prev[path[-1]])
+        return path[::-1]
+
+    # ---------------------------------------------------------------------
+    # Mininet
+    # ---------------------------------------------------------------------
+    def build(self, controller_ip=None):
+        # Imported here so the controller-side tools do not need Mininet
+        from mininet.net import Mininet
+        from mininet.node import RemoteController, OVSKernelSwitch, Host
+        from mininet.link import TCLink
+
+        net = Mininet(topo=None, build=False, ipBase="10.0.0.0/8")
+        ctrl = self.controller
+        net.addController(name=ctrl.get("name", "c0"),
+                          controller=RemoteController,
+                          ip=controller_ip or ctrl.get("ip", "127.0.0.1"),
+                          protocol=ctrl.get("protocol", "tcp"),
+                          port=int(ctrl.get("port", 6653)))
+        for name, dpid in self.switches.items():
+            net.addSwitch(name, cls=OVSKernelSwitch, dpid=dpid, protocols=self.protocols)
+        for name, opts in self.hosts.items():
+            net.addHost(name, cls=Host, ip=opts.get("ip"), defaultRoute=opts.get("defaultRoute"))
+        for a, pa, b, pb, opts in self.links:
+            kwargs = {}
+            if opts:
+                kwargs = dict(opts, cls=TCLink)
+            # Host interfaces are named by Mininet, only pin switch ports
+            if a in self.switches:
+                kwargs["port1"] = pa
+            if b in self.switches:
+                kwargs["port2"] = pb
+            net.addLink(a, b, **kwargs)
+        return net
+
+
+def load(path=None):
+    """
+    Load a JSON descriptor or a MiniEdit .mn file. Without a path the
+    LAB8_TOPOLOGY environment variable is used, then lab8_topo.json.
+    """
+    path = path or os.environ.get("LAB8_TOPOLOGY") or default_descriptor
+    with open(path) as f:
+        desc = json.load(f)
+    if path.endswith(".mn"):
+        desc = from_miniedit(desc)
+    return Topology(desc)
+
+
+def from_miniedit(mn):
+    # Convert a MiniEdit save file into a descriptor
+    ctrl = {}
+    if mn.get("controllers"):
+        opts = mn["controllers"][0]["opts"]
+        ctrl = {"name": opts.get("hostname", "c0"), "ip": opts.get("remoteIP", "127.0.0.1"),
+                "port": opts.get("remotePort", 6653), "protocol": opts.get("controllerProtocol", "tcp")}
+    switches = sorted(mn.get("switches", []), key=lambda s: int(s["number"]))
+    hosts = sorted(mn.get("hosts", []), key=lambda h: int(h["number"]))
+    return {
+        "name": "miniedit",
+        "controller": ctrl,
+        "switches": [{"name": s["opts"]["hostname"], "dpid": s["opts"].get("dpid") or f"{int(s['number']):016x}"}
+                     for s in switches],
+        "hosts": [{"name": h["opts"]["hostname"], "ip": h["opts"].get("ip"),
+                   "defaultRoute": h["opts"].get("defaultRoute")} for h in hosts],
+        "links": [[l["src"], l["dest"]] for l in mn.get("links", [])],
+    }
+
+
+# -------------------------------------------------------------------------
+# Generators for scale testing
+# -------------------------------------------------------------------------
+def _host_ip(i):
+    # 10.0.0.1 upwards, carrying into the higher octets
+    n = i + 1
+    return f"10.{(n >> 16) & 0xff}.{(n >> 8) & 0xff}.{n & 0xff}"
+
+
+def _descriptor(name, switches, hosts, links, controller=None):
+    return {
+        "name": name,
+        "controller": controller or {"name": "c0", "ip": "127.0.0.1", "port": 6653, "protocol": "tcp"},
+        "protocols": "OpenFlow13",
+        "switches": [{"name": s, "dpid": f"{i:016x}"} for i, s in enumerate(switches, start=1)],
+        "hosts": [{"name": h, "ip": _host_ip(i)} for i, h in enumerate(hosts)],
+        "links": links,
+    }
+
+
+def fat_tree(k=4, controller=None):
+    """
+    k-ary fat tree: (k/2)^2 core, k pods of k/2 aggregation + k/2 edge
+    switches, k/2 hosts per edge switch. k=28 gives 980 switches.
+    """
+    if k % 2:
+        raise ValueError("fat-tree k must be even")
+    half = k // 2
+    core = [f"c{i}" for i in range(1, half * half + 1)]
+    switches, hosts, links = list(core), [], []
+    for pod in range(k):
+        aggs = [f"a{pod}_{i}" for i in range(half)]
+        edges = [f"e{pod}_{i}" for i in range(half)]
+        switches += aggs + edges
+        for i, agg in enumerate(aggs):
+            # Aggregation switch i connects to core group i
+            for j in range(half):
+                links.append([agg, core[i * half + j]])
+            for edge in edges:
+                links.append([edge, agg])
+        for i, edge in enumerate(edges):
+            for j in range(half):
+                h = f"h{pod}_{i}_{j}"
+                hosts.append(h)
+                links.append([h, edge])
+    return _descriptor(f"fat-tree-k{k}", switches, hosts, links, controller)
+
+
+def leaf_spine(spines=4, leaves=16, hosts_per_leaf=2, controller=None):
+    spine = [f"sp{i}" for i in range(1, spines + 1)]
+    leaf = [f"lf{i}" for i in range(1, leaves + 1)]
+    hosts, links = [], []
+    for l in leaf:
+        for s in spine:
+            links.append([l, s])
+        for j in range(1, hosts_per_leaf + 1):
+            h = f"h{l[2:]}_{j}"
+            hosts.append(h)
+            links.append([h, l])
+    return _descriptor(f"leaf-spine-{spines}x{leaves}", spine + leaf, hosts, links, controller)
+
+
+def random_topology(n=100, degree=3, hosts=None, seed=None, controller=None):
+    """
+    Connected random graph: a random spanning tree plus extra edges until
+    the average degree is reached. One host per switch unless hosts is given.
+    """
+    rng = random.Random(seed)
+    switches = [f"s{i}" for i in range(1, n + 1)]
+    edges = set()
+    order = switches[:]
+    rng.shuffle(order)
+    for i in range(1, n):
+        a, b = order[i], order[rng.randrange(i)]
+        edges.add((min(a, b), max(a, b)))
+    target = n * degree // 2
+    while len(edges) < min(target, n * (n - 1) // 2):
+        a, b = rng.sample(switches, 2)
+        edges.add((min(a, b), max(a, b)))
+    host_count = n if hosts is None else hosts
+    host_names = [f"h{i}" for i in range(1, host_count + 1)]
+    links = [[h, switches[i % n]] for i, h in enumerate(host_names)]
+    links += [list(e) for e in sorted(edges)]
+    return _descriptor(f"random-{n}", switches, host_names, links, controller)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate topology descriptors")
+    sub = parser.add_subparsers(dest="kind", required=True)
+    ft = sub.add_parser("fat-tree")
+    ft.add_argument("--k", type=int, default=4)
+    ls = sub.add_parser("leaf-spine")
+    ls.add_argument("--spines", type=int, default=4)
+    ls.add_argument("--leaves", type=int, default=16)
+    ls.add_argument("--hosts-per-leaf", type=int, default=2)
+    rnd = sub.add_parser("random")
+    rnd.add_argument("--switches", type=int, default=100)
+    rnd.add_argument("--degree", type=int, default=3)
+    rnd.add_argument("--seed", type=int, default=None)
+    for p in (ft, ls, rnd):
+        p.add_argument("--controller", default="127.0.0.1")
+        p.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    ctrl = {"name": "c0", "ip": args.controller, "port": 6653, "protocol": "tcp"}
+    if args.kind == "fat-tree":
+        desc = fat_tree(args.k, ctrl)
+    elif args.kind == "leaf-spine":
+        desc = leaf_spine(args.spines, args.leaves, args.hosts_per_leaf, ctrl)
+    else:
+        desc = random_topology(args.switches, args.degree, seed=args.seed, controller=ctrl)
+
+    topo = Topology(desc)
+    topo.save(args.output)
+    print(f"{topo.name}: {len(topo.switches)} switches, {len(topo.hosts)} hosts, "
+          f"{len(topo.links)} links -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
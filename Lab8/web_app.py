@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
-from flask import Flask, render_template, redirect, url_for, flash
+from flask import Flask, render_template, redirect, url_for, flash, jsonify
+import adaptive_routing
 import app_core
+import delay_test
 
 app = Flask(__name__)
 app.secret_key = "secret-key-for-lab"
@@ -9,7 +11,7 @@ app.secret_key = "secret-key-for-lab"
 
 @app.route("/")
 def index():
-    return render_template("index.html")
+    return render_template("index.html", adaptive=adaptive_routing.router.status())
 
 
 @app.route("/default", methods=["POST"])
@@ -40,5 +42,24 @@ def bestdelay():
     return redirect(url_for("index"))
 
 
+@app.route("/adaptive")
+def adaptive_status():
+    return jsonify(adaptive_routing.router.status())
+
+
+@app.route("/adaptive/start", methods=["POST"])
+def adaptive_start():
+    adaptive_routing.router.start()
+    flash("Adaptive routing started.", "success")
+    return redirect(url_for("index"))
+
+
+@app.route("/adaptive/stop", methods=["POST"])
+def adaptive_stop():
+    adaptive_routing.router.stop()
+    flash("Adaptive routing stopped.", "success")
+    return redirect(url_for("index"))
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,515 @@
+"""
+L4StatefulLB for a multi-switch fabric (leaf-spine or any connected graph).
+
+Nothing assumes fixed ports. Switch links come from LLDP (lb_fabric), and
+hosts are learned on edge ports (L2 learning: MAC -> edge port in the
+switch's shard, MAC -> switch in the app). Backends are recognised by IP;
+every other host that ARPs for the VIP is a client. State is sharded by
+dpid. A client, its sessions and their timers live only in the shard of
+the switch where it is attached.
+
+Flows:
+  client's switch   per session: VIP -> backend rewrite, out towards it
+                    per client:  traffic for this switch's locator MAC and
+                                 the client IP gets the VIP source and the
+                                 client's MAC back
+  every switch      per backend: eth_dst = backend MAC -> towards it
+                    per switch:  eth_dst = locator MAC -> towards it
+  on a miss         per host:    eth_dst = learned MAC -> its edge port, or
+                                 towards its switch (plain forwarding
+                                 between hosts, idle timeout)
+
+A backend ARPing for a client is answered with the locator MAC of the
+client's switch. Replies then cross the fabric on the per-switch flows
+and are rewritten only where the client is. Transit switches hold
+O(switches + backends) flows plus per-host flows for hosts whose traffic
+actually crosses them, and no switch holds state for clients attached
+elsewhere. Broadcasts between hosts (ARP) are flooded by the controller
+to every edge port; unicast to a MAC nobody has learned is dropped.
+"""
+
+import time
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+from ryu.lib.packet import packet, ethernet, arp, tcp, ether_types
+
+import fast_parse
+import lb_cookie
+import lb_fabric
+import lb_strategies
+import session_table
+
+
+class Shard(object):
+    """State of one datapath: what is attached to it and the sessions it serves."""
+    __slots__ = ("dpid", "hosts", "clients", "backends", "sessions", "stats_probes")
+
+    def __init__(self, dpid, now):
+        self.dpid = dpid
+        self.hosts = {}      # mac -> edge port (L2 learning)
+        self.clients = {}    # ip -> {mac, port, seen}
+        self.backends = {}   # ip -> edge port
+        self.sessions = session_table.SessionTable(now=now)
+        self.stats_probes = {}  # flow-stats xid -> session id
+
+
+class FabricL4LB(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(FabricL4LB, self).__init__(*args, **kwargs)
+
+        # Backends: anywhere in the fabric, located by learning
+        self.backends = [
+            {"ip": "10.0.0.1", "mac": "00:00:00:00:00:01", "services": [8080]},
+            {"ip": "10.0.0.2", "mac": "00:00:00:00:00:02", "services": [8080, 8181]},
+            {"ip": "10.0.0.3", "mac": "00:00:00:00:00:03", "services": [8181]},
+        ]
+        self.backend_by_ip = {b["ip"]: b for b in self.backends}
+        self.backend_by_mac = {b["mac"]: b for b in self.backends}
+        self.backend_index = {b["ip"]: i for i, b in enumerate(self.backends)}
+
+        self.virtual_ip = "10.0.0.100"
+        self.virtual_mac = "00:00:00:00:ff:ff"
+
+        self.idle_timeout = 60
+        self.session_backstop = 2 * self.idle_timeout
+        self.client_timeout = 300
+
+        self.strategy = "round_robin"
+        self.pools = lb_strategies.build_pools(self.backends, self.strategy)
+
+        # Sharded state: dpid -> Shard. The directory only says which shard
+        # holds a host (ip -> dpid), so its size is the number of hosts.
+        self.shards = {}
+        self.directory = {}
+        self.mac_directory = {}  # mac -> dpid whose shard has it in hosts
+        self.datapaths = {}
+
+        self.lldp_interval = 5.0
+        self.topology = lb_fabric.FabricTopology(link_timeout=3 * self.lldp_interval)
+
+        self.threads = [hub.spawn(self._lldp_loop), hub.spawn(self._expiry_loop)]
+
+    # -- switches ------------------------------------------------------------
+    @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    def switch_features_handler(self, ev):
+        dp = ev.msg.datapath
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+
+        self._add_flow(dp, 0, parser.OFPMatch(),
+                       [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)])
+        self._add_flow(dp, 65535, parser.OFPMatch(eth_type=ether_types.ETH_TYPE_LLDP),
+                       [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)])
+        self.datapaths[dp.id] = dp
+        self.shards[dp.id] = Shard(dp.id, time.time())
+        dp.send_msg(parser.OFPPortDescStatsRequest(dp, 0))
+        self.logger.info("Switch %s connected", dp.id)
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def _port_desc_handler(self, ev):
+        dp = ev.msg.datapath
+        ports = [p.port_no for p in ev.msg.body if p.port_no <= dp.ofproto.OFPP_MAX]
+        self.topology.add_switch(dp.id, ports)
+        self._send_lldp(dp)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        dpid = ev.datapath.id
+        if dpid is None or dpid not in self.datapaths:
+            return
+        del self.datapaths[dpid]
+        shard = self.shards.pop(dpid, None)
+        if shard:
+            for session in shard.sessions:
+                self._end_session(shard, session.id, "switch gone")
+            for ip in list(shard.clients) + list(shard.backends):
+                self.directory.pop(ip, None)
+            for mac in shard.hosts:
+                if self.mac_directory.get(mac) == dpid:
+                    del self.mac_directory[mac]
+        if self.topology.remove_switch(dpid):
+            self._install_forwarding()
+
+    def _add_flow(self, dp, priority, match, actions, idle_timeout=0, cookie=0, flags=0):
+        parser = dp.ofproto_parser
+        inst = [parser.OFPInstructionActions(dp.ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        dp.send_msg(parser.OFPFlowMod(datapath=dp, priority=priority, match=match, instructions=inst,
+                                      idle_timeout=idle_timeout, cookie=cookie, flags=flags))
+
+    def _packet_out(self, dp, in_port, actions, data):
+        dp.send_msg(dp.ofproto_parser.OFPPacketOut(datapath=dp, buffer_id=dp.ofproto.OFP_NO_BUFFER,
+                                                   in_port=in_port, actions=actions, data=data))
+
+    # -- topology ------------------------------------------------------------
+    def _lldp_loop(self):
+        while True:
+            hub.sleep(self.lldp_interval)
+            for dp in list(self.datapaths.values()):
+                self._send_lldp(dp)
+            if self.topology.expire():
+                self._install_forwarding()
+            self._probe_backends()
+
+    def _send_lldp(self, dp):
+        parser = dp.ofproto_parser
+        for port in self.topology.ports.get(dp.id, ()):
+            self._packet_out(dp, dp.ofproto.OFPP_CONTROLLER, [parser.OFPActionOutput(port)],
+                             lb_fabric.lldp_frame(dp.id, port))
+
+    def _lldp_in(self, dp, in_port, data):
+        src = lb_fabric.parse_lldp(data)
+        if src is None:
+            return
+        if self.topology.link_seen(src, (dp.id, in_port)):
+            self.logger.info("Link %s:%s -> %s:%s", src[0], src[1], dp.id, in_port)
+            # Whatever was learned on that port was the far side of a link
+            shard = self.shards.get(dp.id)
+            if shard:
+                for mac in [m for m, p in shard.hosts.items() if p == in_port]:
+                    self._forget_host(mac)
+            self._install_forwarding()
+
+    def _probe_backends(self):
+        # ARP for backends nobody has seen yet, out of every edge port
+        missing = [b for b in self.backends if b["ip"] not in self.directory]
+        for dp in list(self.datapaths.values()):
+            parser = dp.ofproto_parser
+            ports = self.topology.edge_ports(dp.id)
+            if not ports:
+                continue
+            for b in missing:
+                pkt = packet.Packet()
+                pkt.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_ARP,
+                                                   dst="ff:ff:ff:ff:ff:ff", src=self.virtual_mac))
+                pkt.add_protocol(arp.arp(opcode=arp.ARP_REQUEST, src_mac=self.virtual_mac,
+                                         src_ip=self.virtual_ip, dst_mac="00:00:00:00:00:00",
+                                         dst_ip=b["ip"]))
+                pkt.serialize()
+                self._packet_out(dp, dp.ofproto.OFPP_CONTROLLER,
+                                 [parser.OFPActionOutput(p) for p in ports], pkt.data)
+
+    def _towards(self, dpid, dst_dpid, dst_port):
+        # Output port on dpid for a host at (dst_dpid, dst_port)
+        if dpid == dst_dpid:
+            return dst_port
+        return self.topology.port_towards(dpid, dst_dpid)
+
+    def _backend_port(self, dpid, backend):
+        # Output port on dpid towards backend, or None if it is not located or has no path
+        where = self.directory.get(backend["ip"])
+        shard = self.shards.get(where)
+        if shard is None or backend["ip"] not in shard.backends:
+            return None
+        return self._towards(dpid, where, shard.backends[backend["ip"]])
+
+    def _install_forwarding(self, only_backend=None):
+        # Per-switch locator flows and per-backend flows on every switch.
+        # On a topology change per-host flows go too; misses reinstall them.
+        for dpid, dp in list(self.datapaths.items()):
+            parser = dp.ofproto_parser
+            if only_backend is None:
+                cookie = lb_cookie.make(lb_cookie.KIND_FORWARD)
+                self._delete_flows(dp, parser.OFPMatch(), cookie,
+                                   lb_cookie.TAG_MASK | lb_cookie.KIND_MASK | lb_cookie.BACKEND_MASK)
+                for dst, port in self.topology.next_hop.get(dpid, {}).items():
+                    self._add_flow(dp, 5, parser.OFPMatch(eth_dst=lb_fabric.locator_mac(dst)),
+                                   [parser.OFPActionOutput(port)],
+                                   cookie=lb_cookie.make(lb_cookie.KIND_FORWARD))
+            for b in self.backends:
+                if only_backend is not None and b is not only_backend:
+                    continue
+                port = self._backend_port(dpid, b)
+                if port is None:
+                    continue
+                self._add_flow(dp, 5, parser.OFPMatch(eth_dst=b["mac"]), [parser.OFPActionOutput(port)],
+                               cookie=lb_cookie.make(lb_cookie.KIND_FORWARD, self.backend_index[b["ip"]]))
+
+    def _delete_flows(self, dp, match, cookie, cookie_mask):
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        dp.send_msg(parser.OFPFlowMod(datapath=dp, command=ofproto.OFPFC_DELETE, cookie=cookie,
+                                      cookie_mask=cookie_mask, out_port=ofproto.OFPP_ANY,
+                                      out_group=ofproto.OFPG_ANY, match=match))
+
+    def _forward_l2(self, dp, in_port, eth_dst, data):
+        # Plain forwarding between hosts: broadcasts are flooded to every edge
+        # port, unicast to a learned MAC gets a flow on this switch
+        if int(eth_dst.split(":")[0], 16) & 1:
+            self._flood(dp.id, in_port, data)
+            return
+        where = self.mac_directory.get(eth_dst)
+        if where not in self.shards:
+            return
+        out_port = self._towards(dp.id, where, self.shards[where].hosts[eth_dst])
+        if out_port is None or (where == dp.id and out_port == in_port):
+            return
+        parser = dp.ofproto_parser
+        actions = [parser.OFPActionOutput(out_port)]
+        b = self.backend_by_mac.get(eth_dst)
+        if b is not None:
+            # Same flow as _install_forwarding, which had not placed it yet
+            self._add_flow(dp, 5, parser.OFPMatch(eth_dst=eth_dst), actions,
+                           cookie=lb_cookie.make(lb_cookie.KIND_FORWARD, self.backend_index[b["ip"]]))
+        else:
+            self._add_flow(dp, 5, parser.OFPMatch(eth_dst=eth_dst), actions, idle_timeout=self.idle_timeout,
+                           cookie=lb_cookie.make(lb_cookie.KIND_FORWARD))
+        self._packet_out(dp, in_port, actions, data)
+
+    def _flood(self, dpid, in_port, data):
+        for d, dp in list(self.datapaths.items()):
+            ports = [p for p in self.topology.edge_ports(d) if (d, p) != (dpid, in_port)]
+            if ports:
+                self._packet_out(dp, dp.ofproto.OFPP_CONTROLLER,
+                                 [dp.ofproto_parser.OFPActionOutput(p) for p in ports], data)
+
+    # -- hosts ---------------------------------------------------------------
+    def _locate(self, shard, ip):
+        # ip now lives in this shard; the shard that had it before forgets it
+        old = self.directory.get(ip)
+        if old is not None and old != shard.dpid and old in self.shards:
+            other = self.shards[old]
+            other.clients.pop(ip, None)
+            other.backends.pop(ip, None)
+        self.directory[ip] = shard.dpid
+
+    def _learn_host(self, shard, port, mac, ip):
+        # L2 learning on an edge port; backends are also placed in the directory
+        if self.mac_directory.get(mac) != shard.dpid or shard.hosts.get(mac) != port:
+            # New or moved: flows towards the old place go
+            self._forget_host(mac)
+            shard.hosts[mac] = port
+            self.mac_directory[mac] = shard.dpid
+        b = self.backend_by_ip.get(ip)
+        if b is not None and (self.directory.get(ip) != shard.dpid or shard.backends.get(ip) != port):
+            self._locate(shard, ip)
+            shard.backends[ip] = port
+            self.logger.info("Backend %s at switch %s port %s", ip, shard.dpid, port)
+            self._install_forwarding(only_backend=b)
+
+    def _forget_host(self, mac):
+        where = self.mac_directory.pop(mac, None)
+        if where is None:
+            return
+        if where in self.shards:
+            self.shards[where].hosts.pop(mac, None)
+        cookie, mask = lb_cookie.kind_match(lb_cookie.KIND_FORWARD)
+        for dp in list(self.datapaths.values()):
+            self._delete_flows(dp, dp.ofproto_parser.OFPMatch(eth_dst=mac), cookie, mask)
+
+    def _learn_client(self, dp, shard, ip, mac, port):
+        now = time.time()
+        self._locate(shard, ip)
+        new = ip not in shard.clients
+        shard.clients[ip] = {"mac": mac, "port": port, "seen": now}
+        if new:
+            shard.sessions.wheel.schedule(("client", ip), now + self.client_timeout)
+        self._install_client_flow(dp, ip, mac, port)
+
+    def _install_client_flow(self, dp, ip, mac, port):
+        # Backend replies addressed to this switch's locator: VIP source, real client MAC
+        parser = dp.ofproto_parser
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, eth_dst=lb_fabric.locator_mac(dp.id),
+                                ipv4_dst=ip)
+        actions = [
+            parser.OFPActionSetField(ipv4_src=self.virtual_ip),
+            parser.OFPActionSetField(eth_src=self.virtual_mac),
+            parser.OFPActionSetField(eth_dst=mac),
+            parser.OFPActionOutput(port),
+        ]
+        self._add_flow(dp, 20, match, actions, idle_timeout=self.client_timeout,
+                       cookie=lb_cookie.make(lb_cookie.KIND_REVERSE))
+        return actions
+
+    # -- packet-in -----------------------------------------------------------
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        msg = ev.msg
+        dp = msg.datapath
+        parser = dp.ofproto_parser
+        in_port = msg.match['in_port']
+
+        hdr = fast_parse.parse(msg.data)
+        if hdr is None:
+            return
+        if hdr.ethertype == ether_types.ETH_TYPE_LLDP:
+            self._lldp_in(dp, in_port, msg.data)
+            return
+        shard = self.shards.get(dp.id)
+        if shard is None:
+            return
+
+        if self.topology.is_fabric_port(dp.id, in_port):
+            # Came over a link and missed: a reply for a client that has no flow here any more
+            c = shard.clients.get(hdr.ip_dst)
+            if c and hdr.eth_dst == lb_fabric.locator_mac(dp.id):
+                actions = self._install_client_flow(dp, hdr.ip_dst, c["mac"], c["port"])
+                self._packet_out(dp, in_port, actions, msg.data)
+            else:
+                self._forward_l2(dp, in_port, hdr.eth_dst, msg.data)
+            return
+
+        self._learn_host(shard, in_port, hdr.eth_src, hdr.arp_src_ip or hdr.ip_src)
+
+        if hdr.arp_op == arp.ARP_REQUEST:
+            if hdr.arp_dst_ip == self.virtual_ip:
+                if hdr.arp_src_ip not in self.backend_by_ip:
+                    self._learn_client(dp, shard, hdr.arp_src_ip, hdr.eth_src, in_port)
+                    self._send_arp_reply(dp, hdr.eth_src, hdr.arp_src_ip, in_port,
+                                         self.virtual_mac, self.virtual_ip)
+                return
+            if hdr.arp_src_ip in self.backend_by_ip:
+                where = self.directory.get(hdr.arp_dst_ip)
+                if where in self.shards and hdr.arp_dst_ip in self.shards[where].clients:
+                    # Backend asking for a client: the client's switch locator
+                    self._send_arp_reply(dp, hdr.eth_src, hdr.arp_src_ip, in_port,
+                                         lb_fabric.locator_mac(where), hdr.arp_dst_ip)
+                    return
+        if hdr.ip_dst != self.virtual_ip:
+            # Not for the load balancer: between hosts
+            self._forward_l2(dp, in_port, hdr.eth_dst, msg.data)
+            return
+        if hdr.ip_proto != fast_parse.IPPROTO_TCP or hdr.dst_port is None or hdr.ip_src in self.backend_by_ip:
+            return
+
+        # Client -> VIP, at the client's own switch
+        if hdr.ip_src not in shard.clients:
+            self._learn_client(dp, shard, hdr.ip_src, hdr.eth_src, in_port)
+        shard.clients[hdr.ip_src]["seen"] = time.time()
+        if hdr.tcp_flags & (tcp.TCP_FIN | tcp.TCP_RST):
+            session = shard.sessions.get(hdr.ip_src, hdr.dst_port)
+            if session:
+                self._end_session(shard, session.id, "ended")
+            return
+
+        session = self._select_backend(shard, hdr.ip_src, hdr.dst_port)
+        if session is None:
+            self.logger.warning("No reachable backend for %s:%s", hdr.ip_src, hdr.dst_port)
+            return
+        backend = session.backend
+        out_port = self._backend_port(dp.id, backend)
+        if out_port is None:
+            # An existing session whose backend's switch or path has gone since
+            self._end_session(shard, session.id, "backend unreachable")
+            return
+        actions = [
+            parser.OFPActionSetField(ipv4_dst=backend["ip"]),
+            parser.OFPActionSetField(eth_dst=backend["mac"]),
+            parser.OFPActionSetField(eth_src=self.virtual_mac),
+            parser.OFPActionOutput(out_port),
+        ]
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ip_proto=6, ipv4_src=hdr.ip_src,
+                                ipv4_dst=self.virtual_ip, tcp_dst=hdr.dst_port)
+        cookie = lb_cookie.make(lb_cookie.KIND_SESSION, self.backend_index[backend["ip"]], session.id)
+        self._add_flow(dp, 20, match, actions, idle_timeout=self.idle_timeout,
+                       cookie=cookie, flags=dp.ofproto.OFPFF_SEND_FLOW_REM)
+        self._packet_out(dp, in_port, actions, msg.data)
+
+    # -- sessions ------------------------------------------------------------
+    def _select_backend(self, shard, client_ip, service_port):
+        session = shard.sessions.get(client_ip, service_port)
+        if session:
+            return session
+        pool = self.pools.get(service_port)
+        backend = pool.select(client_ip) if pool else None
+        # Located and with a path from the client's switch, before the session takes a slot
+        if backend is None or self._backend_port(shard.dpid, backend) is None:
+            return None
+        pool.acquire(backend)
+        return shard.sessions.open(client_ip, service_port, backend, shard.dpid,
+                                   time.time(), self.session_backstop)
+
+    def _end_session(self, shard, sid, reason):
+        session = shard.sessions.close(sid)
+        if session is None:
+            return None
+        pool = self.pools.get(session.service_port)
+        if pool:
+            pool.release(session.backend)
+        c = shard.clients.get(session.client_ip)
+        if c is not None and not shard.sessions.client_sessions(session.client_ip):
+            # Last session gone: check the client when it goes idle
+            shard.sessions.wheel.schedule(("client", session.client_ip), c["seen"] + self.client_timeout)
+        self.logger.info("Session %s on switch %s: %s:%s (backend %s)", reason, shard.dpid,
+                         session.client_ip, session.service_port, session.backend["ip"])
+        return session
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        c = lb_cookie.decode(ev.msg.cookie)
+        shard = self.shards.get(ev.msg.datapath.id)
+        if shard is not None and c is not None and c.kind == lb_cookie.KIND_SESSION:
+            self._end_session(shard, c.session, "expired")
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        shard = self.shards.get(ev.msg.datapath.id)
+        if shard is None:
+            return
+        sid = shard.stats_probes.pop(ev.msg.xid, None)
+        if sid is None or sid not in shard.sessions.by_id:
+            return
+        if ev.msg.body:
+            shard.sessions.wheel.schedule(("session", sid), time.time() + self.session_backstop)
+        else:
+            self._end_session(shard, sid, "expired (no flow)")
+
+    def _expiry_loop(self):
+        while True:
+            hub.sleep(1.0)
+            self._expire(time.time())
+
+    def _expire(self, now):
+        for shard in list(self.shards.values()):
+            for kind, key in shard.sessions.wheel.advance(now):
+                if kind == "session":
+                    self._check_session(shard, key, now)
+                else:
+                    self._check_client(shard, key, now)
+
+    def _check_session(self, shard, sid, now):
+        session = shard.sessions.by_id.get(sid)
+        dp = self.datapaths.get(shard.dpid)
+        if session is None or dp is None:
+            return
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        cookie, mask = lb_cookie.session_match(sid)
+        req = parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                         cookie, mask, parser.OFPMatch())
+        shard.sessions.wheel.schedule(("session", sid), now + self.session_backstop)
+        dp.set_xid(req)
+        shard.stats_probes[req.xid] = sid
+        dp.send_msg(req)
+
+    def _check_client(self, shard, ip, now):
+        c = shard.clients.get(ip)
+        if c is None:
+            return
+        idle_until = c["seen"] + self.client_timeout
+        if shard.sessions.client_sessions(ip) or idle_until > now:
+            shard.sessions.wheel.schedule(("client", ip), max(idle_until, now + self.client_timeout))
+        else:
+            del shard.clients[ip]
+            if self.directory.get(ip) == shard.dpid:
+                del self.directory[ip]
+
+    def state_sizes(self):
+        # {dpid: (clients, sessions, hosts)}: per-switch state for monitoring
+        return {dpid: (len(s.clients), len(s.sessions), len(s.hosts)) for dpid, s in self.shards.items()}
+
+    # ARP reply helper
+    def _send_arp_reply(self, dp, dst_mac, dst_ip, out_port, src_mac, src_ip):
+        e = ethernet.ethernet(ethertype=ether_types.ETH_TYPE_ARP, dst=dst_mac, src=src_mac)
+        a = arp.arp(opcode=arp.ARP_REPLY, src_mac=src_mac, src_ip=src_ip, dst_mac=dst_mac, dst_ip=dst_ip)
+        pkt = packet.Packet()
+        pkt.add_protocol(e)
+        pkt.add_protocol(a)
+        pkt.serialize()
+        self._packet_out(dp, dp.ofproto.OFPP_CONTROLLER, [dp.ofproto_parser.OFPActionOutput(out_port)],
+                         pkt.data)
@@ -0,0 +1,143 @@
+"""
+Fast-path header extraction for the load balancer packet-in handlers.
+
+packet.Packet(msg.data) builds a ryu protocol object for every layer, and
+each get_protocol() call then scans that list again. The balancers only
+need a handful of fields, so parse() reads them from fixed offsets in a
+memoryview instead: Ethernet (through 802.1Q / 802.1ad tags), ARP opcode
+and addresses, IPv4 addresses and protocol, and TCP/UDP ports plus TCP
+flags. Addresses come out as strings, in the same format ryu uses.
+
+Headers.packet() still gives the full ryu packet.Packet, parsed the first
+time it is needed (for example to build a reply from the original packet).
+"""
+
+import socket
+import struct
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_8021AD = 0x88a8
+ETH_TYPE_LLDP = 0x88cc
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+_u16 = struct.Struct("!H").unpack_from
+_ports = struct.Struct("!HH").unpack_from
+_ntoa = socket.inet_ntoa
+
+
+class Headers(object):
+    __slots__ = ("data", "eth_dst", "eth_src", "ethertype", "vlan",
+                 "arp_op", "arp_src_ip", "arp_dst_ip",
+                 "ip_src", "ip_dst", "ip_proto",
+                 "src_port", "dst_port", "tcp_flags", "_pkt")
+
+    def __init__(self, data):
+        self.data = data
+        self.eth_dst = self.eth_src = None
+        self.ethertype = self.vlan = None
+        self.arp_op = self.arp_src_ip = self.arp_dst_ip = None
+        self.ip_src = self.ip_dst = self.ip_proto = None
+        self.src_port = self.dst_port = self.tcp_flags = None
+        self._pkt = None
+
+    def packet(self):
+        # Full ryu parse, only on demand
+        if self._pkt is None:
+            from ryu.lib.packet import packet
+            self._pkt = packet.Packet(self.data)
+        return self._pkt
+
+    def __repr__(self):
+        fields = ("%s=%r" % (k, getattr(self, k)) for k in self.__slots__[1:-1]
+                  if getattr(self, k) is not None)
+        return "Headers(%s)" % ", ".join(fields)
+
+
+def _mac(buf, off):
+    return buf[off:off + 6].hex(":")
+
+
+def parse(data):
+    """
+    Extract the load balancer's header fields from a raw frame. Returns
+    None for frames too short to hold an Ethernet header; fields of layers
+    that are absent or truncated stay None.
+    """
+    buf = memoryview(data)
+    n = len(buf)
+    if n < 14:
+        return None
+    h = Headers(data)
+    h.eth_dst = _mac(buf, 0)
+    h.eth_src = _mac(buf, 6)
+    ethertype = _u16(buf, 12)[0]
+    off = 14
+    while (ethertype == ETH_TYPE_8021Q or ethertype == ETH_TYPE_8021AD) and n >= off + 4:
+        if h.vlan is None:
+            h.vlan = _u16(buf, off)[0] & 0x0fff  # outermost VLAN id
+        ethertype = _u16(buf, off + 2)[0]
+        off += 4
+    h.ethertype = ethertype
+
+    if ethertype == ETH_TYPE_ARP:
+        if n >= off + 28:
+            h.arp_op = _u16(buf, off + 6)[0]
+            h.arp_src_ip = _ntoa(buf[off + 14:off + 18])
+            h.arp_dst_ip = _ntoa(buf[off + 24:off + 28])
+    elif ethertype == ETH_TYPE_IP:
+        if n >= off + 20:
+            ihl = (buf[off] & 0x0f) * 4
+            proto = buf[off + 9]
+            h.ip_proto = proto
+            h.ip_src = _ntoa(buf[off + 12:off + 16])
+            h.ip_dst = _ntoa(buf[off + 16:off + 20])
+            frag_offset = _u16(buf, off + 6)[0] & 0x1fff
+            l4 = off + ihl
+            if frag_offset == 0 and ihl >= 20:
+                if proto == IPPROTO_TCP and n >= l4 + 14:
+                    h.src_port, h.dst_port = _ports(buf, l4)
+                    h.tcp_flags = buf[l4 + 13] & 0x3f  # URG..FIN, like ryu's tcp.bits
+                elif proto == IPPROTO_UDP and n >= l4 + 4:
+                    h.src_port, h.dst_port = _ports(buf, l4)
+    return h
+
+
+def from_packet(pkt):
+    """
+    Headers filled from an already parsed ryu packet.Packet. This is the
+    slow reference path, used for comparison and benchmarks.
+    """
+    from ryu.lib.packet import ethernet, vlan, arp, ipv4, tcp, udp
+
+    h = Headers(pkt.data)
+    h._pkt = pkt
+    eth = pkt.get_protocol(ethernet.ethernet)
+    if eth is None:
+        return None
+    h.eth_dst, h.eth_src, h.ethertype = eth.dst, eth.src, eth.ethertype
+    tags = [p for p in pkt.protocols if isinstance(p, (vlan.vlan, vlan.svlan))]
+    if tags:
+        h.vlan = tags[0].vid
+        h.ethertype = tags[-1].ethertype
+    arp_pkt = pkt.get_protocol(arp.arp)
+    if arp_pkt:
+        h.arp_op, h.arp_src_ip, h.arp_dst_ip = arp_pkt.opcode, arp_pkt.src_ip, arp_pkt.dst_ip
+    ip_pkt = pkt.get_protocol(ipv4.ipv4)
+    if ip_pkt:
+        h.ip_src, h.ip_dst, h.ip_proto = ip_pkt.src, ip_pkt.dst, ip_pkt.proto
+        tcp_pkt = pkt.get_protocol(tcp.tcp)
+        udp_pkt = pkt.get_protocol(udp.udp)
+        if tcp_pkt:
+            h.src_port, h.dst_port, h.tcp_flags = tcp_pkt.src_port, tcp_pkt.dst_port, tcp_pkt.bits
+        elif udp_pkt:
+            h.src_port, h.dst_port = udp_pkt.src_port, udp_pkt.dst_port
+    return h
@@ -0,0 +1,179 @@
+"""
+Flow-table budget for the per-connection flows of L4StatefulLB.
+
+A hardware switch may hold only a few thousand flows, and the LB installs
+one per (client, service). FlowBudget keeps, per datapath, the session
+flows it knows are installed in LRU order. Entries move to the back when a
+flow is installed and when a flow-stats poll shows that its packet count
+went up. FlowRemoved drops them.
+
+Occupancy then drives two things:
+
+  granularity   new flows are installed at the finest level the table can
+                afford: per 5-tuple, per client or per client /24. The
+                level gets coarser above high_water and finer again below
+                low_water (hysteresis, so it does not flap).
+  eviction      above evict_at, the least recently used flows are deleted
+                down to evict_to, before the switch starts rejecting
+                FlowMods.
+
+Counters: hits (packets the LB flows forwarded, from the polls), misses
+(VIP packets that came to the controller), installs, evictions and
+occupancy.
+"""
+
+import time
+from collections import OrderedDict
+
+# Finest to coarsest; priorities keep finer flows in front of coarser ones
+granularities = ("5tuple", "client", "prefix24")
+priorities = {"5tuple": 22, "client": 20, "prefix24": 18}
+
+
+def session_key(granularity, client_ip, client_port):
+    # What a session is keyed on (in place of the client IP) at this granularity
+    if granularity == "5tuple":
+        return "%s:%d" % (client_ip, client_port)
+    if granularity == "prefix24":
+        return client_ip.rsplit(".", 1)[0] + ".0/24"
+    return client_ip
+
+
+def match_fields(granularity, client_ip, client_port, service_port, virtual_ip):
+    fields = {"eth_type": 0x0800, "ip_proto": 6, "ipv4_dst": virtual_ip, "tcp_dst": service_port}
+    if granularity == "prefix24":
+        fields["ipv4_src"] = (client_ip.rsplit(".", 1)[0] + ".0", "255.255.255.0")
+    else:
+        fields["ipv4_src"] = client_ip
+    if granularity == "5tuple":
+        fields["tcp_src"] = client_port
+    return fields
+
+
+class FlowEntry(object):
+    __slots__ = ("sid", "cookie", "match", "priority", "packets", "used")
+
+    def __init__(self, sid, cookie, match, priority, now):
+        self.sid = sid
+        self.cookie = cookie
+        self.match = match
+        self.priority = priority
+        self.packets = 0
+        self.used = now
+
+
+class TableState(object):
+    def __init__(self, level):
+        self.lru = OrderedDict()  # session id -> FlowEntry, least recently used first
+        self.level = level
+        self.polls = set()        # xids of outstanding flow-stats polls
+        self.seen = set()         # session ids in the poll being collected
+        self.poll_started = 0.0
+        self.hits = self.misses = self.installs = self.evictions = 0
+
+
+class FlowBudget(object):
+    def __init__(self, capacity=2000, levels=("client", "prefix24"), high_water=0.75, low_water=0.5,
+                 evict_at=0.9, evict_to=0.8):
+        self.capacity = capacity
+        self.levels = tuple(levels)
+        self.high_water = high_water
+        self.low_water = low_water
+        self.evict_at = evict_at
+        self.evict_to = evict_to
+        self.tables = {}
+
+    def table(self, dpid):
+        t = self.tables.get(dpid)
+        if t is None:
+            t = self.tables[dpid] = TableState(0)
+        return t
+
+    def forget(self, dpid):
+        self.tables.pop(dpid, None)
+
+    def granularity(self, dpid):
+        return self.levels[self.table(dpid).level]
+
+    def _adjust(self, t):
+        occupancy = len(t.lru) / float(self.capacity)
+        if occupancy > self.high_water and t.level < len(self.levels) - 1:
+            t.level += 1
+        elif occupancy < self.low_water and t.level > 0:
+            t.level -= 1
+
+    def miss(self, dpid):
+        self.table(dpid).misses += 1
+
+    def installed(self, dpid, sid, cookie, match, priority):
+        t = self.table(dpid)
+        entry = t.lru.pop(sid, None) or FlowEntry(sid, cookie, match, priority, time.time())
+        entry.used = time.time()
+        t.lru[sid] = entry
+        t.installs += 1
+        self._adjust(t)
+
+    def removed(self, dpid, sid):
+        t = self.tables.get(dpid)
+        if t is not None and t.lru.pop(sid, None) is not None:
+            self._adjust(t)
+
+    def victims(self, dpid):
+        """LRU entries to delete now, if the table is over evict_at."""
+        t = self.table(dpid)
+        if len(t.lru) < self.evict_at * self.capacity:
+            return []
+        n = len(t.lru) - int(self.evict_to * self.capacity)
+        out = []
+        for sid in list(t.lru)[:n]:
+            out.append(t.lru.pop(sid))
+        t.evictions += len(out)
+        self._adjust(t)
+        return out
+
+    # Flow-stats polls: packet counts tell which flows are still hot
+    def poll_sent(self, dpid, xid):
+        t = self.table(dpid)
+        t.polls.add(xid)
+        t.seen = set()
+        t.poll_started = time.time()
+
+    def is_poll(self, dpid, xid):
+        t = self.tables.get(dpid)
+        return t is not None and xid in t.polls
+
+    def stats_reply(self, dpid, xid, body, more, sid_of):
+        """
+        One flow-stats reply part. sid_of maps a cookie to a session id.
+        Returns the session ids whose flow has disappeared (last part only).
+        """
+        t = self.table(dpid)
+        now = time.time()
+        for stat in body:
+            sid = sid_of(stat.cookie)
+            entry = t.lru.get(sid)
+            if entry is None:
+                continue
+            t.seen.add(sid)
+            if stat.packet_count > entry.packets:
+                t.hits += stat.packet_count - entry.packets
+                entry.packets = stat.packet_count
+                entry.used = now
+                t.lru.move_to_end(sid)
+        if more:
+            return []
+        t.polls.discard(xid)
+        # Flows installed after the poll went out are not in it, and not gone
+        gone = [sid for sid, e in t.lru.items() if sid not in t.seen and e.used < t.poll_started]
+        for sid in gone:
+            del t.lru[sid]
+        self._adjust(t)
+        return gone
+
+    def report(self, dpid):
+        t = self.table(dpid)
+        lookups = t.hits + t.misses
+        return {"flows": len(t.lru), "capacity": self.capacity,
+                "occupancy": len(t.lru) / float(self.capacity), "granularity": self.levels[t.level],
+                "hits": t.hits, "misses": t.misses, "hit_ratio": t.hits / float(lookups) if lookups else 0.0,
+                "installs": t.installs, "evictions": t.evictions}
@@ -0,0 +1,237 @@
+"""
+Per-datapath output queue for the Lab9 load balancers.
+
+Without it every packet-in handler sends its FlowMod and PacketOut as two
+separate writes, and a burst of packets from one client that arrives
+before the flow is in the switch installs the same flow again for each
+packet. With it:
+
+  - messages are queued and written together: flush() serializes the
+    whole batch into one buffer, so Datapath.send() hands the socket one
+    sendall() instead of one per message. Flushes run from a green thread
+    spawned on the first queued message, i.e. right after the current
+    burst of events has been handled, or as soon as max_batch is reached.
+  - FlowMod ADDs are keyed by (table, priority, match). A second ADD for a
+    key that is still queued replaces the queued one in place; one that
+    is identical (same cookie) to a flow still being installed is dropped.
+  - each batch ends with a barrier. Its reply marks the batch's flows as
+    installed; until then installing() returns the pending FlowMod, so the
+    app can just PACKET_OUT with its actions instead of deciding again.
+    A barrier whose reply has not come within inflight_timeout is dropped
+    at the next flush, with the in-flight entries it was confirming.
+
+All messages keep their order, so a PacketOut still leaves after the
+FlowMod queued before it. Anything that is not an ADD (deletes, modifies)
+ends deduplication for the keys queued so far.
+"""
+
+import time
+
+from ryu.lib import hub
+
+
+def flow_key(table_id, priority, match):
+    return (table_id, priority, tuple(sorted(match.items())))
+
+
+class OutputQueue(object):
+    def __init__(self, dp, stats, barrier=True, max_batch=64, inflight_timeout=1.0, auto_flush=True):
+        self.dp = dp
+        self.stats = stats
+        self.barrier = barrier
+        self.max_batch = max_batch
+        self.inflight_timeout = inflight_timeout
+        self.auto_flush = auto_flush
+        self.pending = []       # messages in send order
+        self.pending_keys = {}  # flow key -> index in pending
+        self.inflight = {}      # flow key -> (FlowMod, sent at), until its barrier reply
+        self.barriers = {}      # barrier xid -> ([flow keys], sent at)
+        self.flush_scheduled = False
+
+    def send(self, msg):
+        parser = self.dp.ofproto_parser
+        if isinstance(msg, parser.OFPFlowMod):
+            self.flow_mod(msg)
+        else:
+            if isinstance(msg, parser.OFPPacketOut):
+                self.stats["packet_outs"] += 1
+            self._queue(msg)
+
+    def flow_mod(self, mod):
+        stats = self.stats
+        stats["flow_mods"] += 1
+        if mod.command != self.dp.ofproto.OFPFC_ADD:
+            self.pending_keys = {}
+            self.inflight = {}
+            self._queue(mod)
+            return
+        key = flow_key(mod.table_id, mod.priority, mod.match)
+        i = self.pending_keys.get(key)
+        if i is not None:
+            # Same match still queued: the newer FlowMod takes its place
+            self.pending[i] = mod
+            stats["saved"] += 1
+            return
+        sent = self._inflight(key)
+        if sent is not None and sent.cookie == mod.cookie:
+            stats["saved"] += 1
+            return
+        self.pending_keys[key] = len(self.pending)
+        self._queue(mod)
+
+    def installing(self, match, priority, table_id=0):
+        """
+        The FlowMod for this match if it is queued or not yet confirmed.
+        Callers skip their own FlowMod then, so a hit counts as saved.
+        """
+        key = flow_key(table_id, priority, match)
+        i = self.pending_keys.get(key)
+        mod = self.pending[i] if i is not None else self._inflight(key)
+        if mod is not None:
+            self.stats["saved"] += 1
+        return mod
+
+    def _inflight(self, key):
+        entry = self.inflight.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.inflight_timeout:
+            # Barrier reply lost or switch slow: stop trusting it
+            del self.inflight[key]
+            return None
+        return entry[0]
+
+    def _queue(self, msg):
+        self.pending.append(msg)
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.auto_flush and not self.flush_scheduled:
+            self.flush_scheduled = True
+            hub.spawn(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if not self.pending:
+            return 0
+        dp = self.dp
+        msgs, self.pending = self.pending, []
+        keys, self.pending_keys = self.pending_keys, {}
+        now = time.time()
+        self._expire(now)
+        if self.barrier and keys:
+            req = dp.ofproto_parser.OFPBarrierRequest(dp)
+            msgs.append(req)
+        bufs = []
+        for msg in msgs:
+            if msg.xid is None:
+                dp.set_xid(msg)
+            msg.serialize()
+            bufs.append(msg.buf)
+        if self.barrier and keys:
+            for key, i in keys.items():
+                self.inflight[key] = (msgs[i], now)
+            self.barriers[req.xid] = (list(keys), now)
+            self.stats["barriers"] += 1
+        dp.send(b"".join(bufs))
+        self.stats["writes"] += 1
+        self.stats["messages"] += len(msgs)
+        return len(msgs)
+
+    def _expire(self, now):
+        # Barrier replies that never came (switch reconnected, reply lost).
+        # Barriers are kept in send order, so stop at the first recent one.
+        while self.barriers:
+            xid = next(iter(self.barriers))
+            keys, sent = self.barriers[xid]
+            if now - sent <= self.inflight_timeout:
+                break
+            del self.barriers[xid]
+            for key in keys:
+                f = self.inflight.get(key)
+                if f is not None and f[1] <= sent:
+                    del self.inflight[key]
+            self.stats["expired"] += 1
+
+    def barrier_reply(self, xid):
+        entry = self.barriers.pop(xid, None)
+        if entry is None:
+            return False
+        keys, sent = entry
+        for key in keys:
+            f = self.inflight.get(key)
+            if f is not None and f[1] <= sent:
+                del self.inflight[key]
+        self.stats["confirmed"] += len(keys)
+        self.stats["confirm_time"] += time.time() - sent
+        return True
+
+
+class FlowQueues(object):
+    """One OutputQueue per datapath plus the counters they share."""
+
+    counter_names = ("flow_mods", "saved", "packet_outs", "messages", "writes", "barriers",
+                     "confirmed", "confirm_time", "expired")
+
+    def __init__(self, barrier=True, max_batch=64, auto_flush=True):
+        self.barrier = barrier
+        self.max_batch = max_batch
+        self.auto_flush = auto_flush
+        self.queues = {}
+        self.stats = dict.fromkeys(self.counter_names, 0)
+        self.last_report = (time.time(), dict(self.stats))
+        self.reporter = None
+
+    def get(self, dp):
+        q = self.queues.get(dp.id)
+        if q is None or q.dp is not dp:
+            q = self.queues[dp.id] = OutputQueue(dp, self.stats, self.barrier, self.max_batch,
+                                                 auto_flush=self.auto_flush)
+        return q
+
+    def send(self, dp, msg):
+        self.get(dp).send(msg)
+
+    def installing(self, dp, match, priority, table_id=0):
+        q = self.queues.get(dp.id)
+        return q.installing(match, priority, table_id) if q else None
+
+    def flush(self, dp):
+        q = self.queues.get(dp.id)
+        return q.flush() if q else 0
+
+    def flush_all(self):
+        return sum(q.flush() for q in self.queues.values())
+
+    def barrier_reply(self, dp, xid):
+        q = self.queues.get(dp.id)
+        return q.barrier_reply(xid) if q else False
+
+    def forget(self, dpid):
+        self.queues.pop(dpid, None)
+
+    def report(self):
+        """Counters plus rates since the previous report."""
+        now = time.time()
+        then, before = self.last_report
+        elapsed = max(now - then, 1e-9)
+        s = self.stats
+        out = dict(s)
+        out["writes_per_sec"] = (s["writes"] - before["writes"]) / elapsed
+        out["messages_per_write"] = s["messages"] / s["writes"] if s["writes"] else 0.0
+        out["saved_ratio"] = s["saved"] / s["flow_mods"] if s["flow_mods"] else 0.0
+        out["confirm_ms"] = 1e3 * s["confirm_time"] / s["confirmed"] if s["confirmed"] else 0.0
+        self.last_report = (now, dict(s))
+        return out
+
+    def start_reporting(self, logger, interval=10.0):
+        if self.reporter is None:
+            self.reporter = hub.spawn(self._report_loop, logger, interval)
+
+    def _report_loop(self, logger, interval):
+        while True:
+            hub.sleep(interval)
+            r = self.report()
+            logger.info("flow-mods %d, saved %d (%.0f%%), %.1f writes/s, %.1f messages/write, "
+                        "barrier confirm %.1f ms, %d barriers unanswered", r["flow_mods"], r["saved"],
+                        100 * r["saved_ratio"], r["writes_per_sec"], r["messages_per_write"], r["confirm_ms"],
+                        r["expired"])
@@ -0,0 +1,145 @@
+"""
+Active health checks for the Lab9 load balancer backends.
+
+Every `interval` seconds each backend's ports are probed concurrently, one
+green thread per (backend, port): a TCP connect, or an HTTP GET of
+`http_path` when one is set (any 2xx/3xx status passes). A backend counts
+as passing only when all its ports pass. Like haproxy's rise/fall, it goes
+down after `fall` failed rounds in a row and comes back after `rise` good
+ones, so one lost SYN does not reshuffle the pools.
+
+Backends start up. When a round changes any state, on_change(down, up) is
+called with the backends that changed; the apps rebuild their pools from
+is_up() and flush flows of the failed backends by cookie.
+
+Probes go to b.get("health_ip", b["ip"]) on b.get("health_ports",
+b.get("services", default_ports)).
+"""
+
+import socket
+import time
+
+from ryu.lib import hub
+
+
+def tcp_probe(ip, port, timeout, http_path=None):
+    """Returns None when the backend is fine, else a short error string."""
+    try:
+        s = socket.create_connection((ip, port), timeout=timeout)
+    except (OSError, socket.timeout) as e:
+        return "connect: %s" % (e.strerror or e)
+    try:
+        if not http_path:
+            return None
+        s.settimeout(timeout)
+        s.sendall(("GET %s HTTP/1.0\r\nHost: %s\r\n\r\n" % (http_path, ip)).encode())
+        status = s.makefile("rb").readline(256).split()
+        if len(status) < 2 or not status[1].isdigit():
+            return "bad response"
+        if not 200 <= int(status[1]) < 400:
+            return "HTTP %s" % status[1].decode()
+        return None
+    except (OSError, socket.timeout) as e:
+        return "http: %s" % (e.strerror or e)
+    finally:
+        s.close()
+
+
+class BackendHealth(object):
+    __slots__ = ("up", "passes", "failures", "error", "checked", "changed")
+
+    def __init__(self, now):
+        self.up = True
+        self.passes = 0     # good rounds in a row
+        self.failures = 0   # failed rounds in a row
+        self.error = None
+        self.checked = None
+        self.changed = now
+
+
+class HealthChecker(object):
+    def __init__(self, on_change, interval=2.0, timeout=1.0, rise=2, fall=3,
+                 http_path=None, default_ports=(80,), probe=tcp_probe):
+        self.on_change = on_change
+        self.interval = interval
+        self.timeout = timeout
+        self.rise = rise
+        self.fall = fall
+        self.http_path = http_path
+        self.default_ports = tuple(default_ports)
+        self.probe = probe
+        self.backends = []
+        self.state = {}  # backend ip -> BackendHealth
+        self.thread = None
+
+    def set_backends(self, backends):
+        # Known backends keep their state; new ones start up
+        now = time.time()
+        self.backends = list(backends)
+        self.state = {b["ip"]: self.state.get(b["ip"]) or BackendHealth(now) for b in self.backends}
+
+    def is_up(self, backend):
+        st = self.state.get(backend["ip"])
+        return st is None or st.up
+
+    def healthy(self, backends=None):
+        return [b for b in (self.backends if backends is None else backends) if self.is_up(b)]
+
+    def ports(self, backend):
+        return backend.get("health_ports") or backend.get("services") or self.default_ports
+
+    def check_once(self):
+        """One round of probes; returns (down, up), the backends that changed."""
+        errors = {}
+
+        def run(b, port):
+            err = self.probe(b.get("health_ip", b["ip"]), port, self.timeout, self.http_path)
+            if err:
+                errors.setdefault(b["ip"], "%s: %s" % (port, err))
+
+        threads = [hub.spawn(run, b, port) for b in self.backends for port in self.ports(b)]
+        hub.joinall(threads)
+
+        now = time.time()
+        down, up = [], []
+        for b in self.backends:
+            st = self.state[b["ip"]]
+            st.checked = now
+            st.error = errors.get(b["ip"])
+            if st.error:
+                st.passes = 0
+                st.failures += 1
+                if st.up and st.failures >= self.fall:
+                    st.up, st.changed = False, now
+                    down.append(b)
+            else:
+                st.failures = 0
+                st.passes += 1
+                if not st.up and st.passes >= self.rise:
+                    st.up, st.changed = True, now
+                    up.append(b)
+        if down or up:
+            self.on_change(down, up)
+        return down, up
+
+    def status(self):
+        # {ip: {...}} for logs and REST
+        return {ip: {"up": st.up, "error": st.error, "checked": st.checked, "since": st.changed}
+                for ip, st in self.state.items()}
+
+    def start(self, backends=None):
+        if backends is not None:
+            self.set_backends(backends)
+        if self.thread is None:
+            self.thread = hub.spawn(self._loop)
+
+    def stop(self):
+        if self.thread is not None:
+            hub.kill(self.thread)
+            self.thread = None
+
+    def _loop(self):
+        while True:
+            started = time.time()
+            self.check_once()
+            hub.sleep(max(0.0, self.interval - (time.time() - started)))
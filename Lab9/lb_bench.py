@@ -0,0 +1,1003 @@
+#!/usr/bin/env python3
+"""
+Packet-in micro-benchmark for the Lab9 load balancers (no Mininet needed).
+
+The apps are instantiated directly and driven with synthetic PACKET_IN
+events through the mock datapaths and switches of lb_mock, which record
+every message the app sends.
+The workload per client is: ARP for the VIP, a TCP SYN to the VIP and the
+backend's SYN-ACK back to the client.
+
+    python3 lb_bench.py                 # both apps, fast_parse vs ryu parser
+    python3 lb_bench.py --clients 5000 --repeat 3
+    python3 lb_bench.py --strategies --backends 1000   # lb_strategies only
+    python3 lb_bench.py --groups --conns 5             # packet-ins: reactive vs SELECT groups
+    python3 lb_bench.py --proactive --conns 5          # packet-ins: reactive vs proactive ARP/return path
+    python3 lb_bench.py --sessions --waves 10          # session state stays bounded
+    python3 lb_bench.py --health --clients 200         # health checks against standin_backend.py
+    python3 lb_bench.py --batching --burst 4           # flow_queue: dedupe and write coalescing
+    python3 lb_bench.py --fabric --leaves 4 --spines 2 # FabricL4LB on a mock leaf-spine
+    python3 lb_bench.py --traffic --clients 1000       # lb_stats: accounting matches the switch, one request
+    python3 lb_bench.py --meters --flood 5000          # lb_meters: packet-ins under a flood on one port
+    python3 lb_bench.py --budget --capacity 400        # flow_budget: bounded table, coarser flows, LRU eviction
+    python3 lb_bench.py --restart --clients 1000       # lb_persist: state after a controller restart, cold vs warm
+    python3 lb_bench.py --instrument --clients 5000    # lb_instrument: stage timings, overhead vs plain logging
+    python3 lb_bench.py --buffering --payload 1400     # lb_buffering: control-channel bytes, truncated packet-ins
+"""
+
+import argparse
+import io
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter, deque
+
+from ryu.lib.packet import packet, ethernet, arp, ipv4, tcp
+from ryu.controller import ofp_event
+
+import fast_parse
+import flow_budget
+import lb_cookie
+import lb_instrument
+import lb_meters
+import lb_stats
+import lb_strategies
+import pied_piper_lb
+import stateful_pied_piper_lb
+from lb_mock import (VIP, VIP_MAC, MockDatapath, MockSwitch, MockFabric, event_handlers, packet_in_event,
+                     client_addr, arp_request, arp_reply, tcp_segment)
+
+def workload(backends, clients, services=(8080,)):
+    # [(in_port, frame), ...] in arrival order
+    events = []
+    for i in range(clients):
+        ip, mac, port = client_addr(i)
+        service = services[i % len(services)]
+        eligible = [b for b in backends if service in b.get("services", [service])]
+        b = eligible[i % len(eligible)]
+        sport = 40000 + i % 20000
+        events.append((port, arp_request(mac, ip, VIP)))
+        events.append((port, tcp_segment(mac, VIP_MAC, ip, VIP, sport, service, tcp.TCP_SYN)))
+        events.append((b["port"], tcp_segment(b["mac"], VIP_MAC, b["ip"], ip, service, sport,
+                                              tcp.TCP_SYN | tcp.TCP_ACK)))
+    return events
+
+
+# -------------------------------------------------------------------------
+# Benchmarks
+# -------------------------------------------------------------------------
+def ryu_headers(data):
+    # What the handlers did before fast_parse
+    pkt = packet.Packet(data)
+    eth = pkt.get_protocols(ethernet.ethernet)[0]
+    return eth, pkt.get_protocol(arp.arp), pkt.get_protocol(ipv4.ipv4), pkt.get_protocol(tcp.tcp)
+
+
+def check_equivalence(frames):
+    fields = [k for k in fast_parse.Headers.__slots__ if k not in ("data", "_pkt")]
+    for data in frames:
+        fast, slow = fast_parse.parse(data), fast_parse.from_packet(packet.Packet(data))
+        for k in fields:
+            if getattr(fast, k) != getattr(slow, k):
+                raise AssertionError("%s differs: fast %r, ryu %r" % (k, getattr(fast, k), getattr(slow, k)))
+
+
+def bench_parse(frames, repeat):
+    out = {}
+    for name, fn in (("ryu packet.Packet", ryu_headers), ("fast_parse.parse", fast_parse.parse)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for data in frames:
+                fn(data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        out[name] = len(frames) / best
+    return out
+
+
+def run_handler(app_cls, events_spec, use_fast_parse):
+    app = app_cls()
+    app.logger.setLevel(logging.WARNING)
+    app.use_fast_parse = use_fast_parse
+    dp = MockDatapath()
+    events = [packet_in_event(dp, port, data) for port, data in events_spec]
+    start = time.perf_counter()
+    for ev in events:
+        app._packet_in_handler(ev)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(dp.sent)
+
+
+def bench_handler(app_cls, events_spec, repeat):
+    out = {}
+    for label, fast in (("ryu parser", False), ("fast_parse", True)):
+        best, sent = None, 0
+        for _ in range(repeat):
+            elapsed, sent = run_handler(app_cls, events_spec, fast)
+            best = elapsed if best is None else min(best, elapsed)
+        out[label] = (len(events_spec) / best, best / len(events_spec) * 1e6, sent)
+    return out
+
+
+def bench_instrument(clients, repeat):
+    """
+    Handler cost with and without lb_instrument. The plain handlers log
+    every new mapping and ARP reply; "logs off" is the same with the
+    logger at WARNING, and "instrumented" times every stage, counts events
+    and logs one event in sample_every. Log lines are formatted into
+    memory, so their cost is counted but nothing is printed.
+    """
+    print("Instrumentation overhead, %d clients" % clients)
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    for name, cls, services in apps:
+        events_spec = workload(cls().backends, clients, services)
+        for mode in ("logs on", "logs off", "instrumented"):
+            best = lines = app = None
+            for _ in range(repeat):
+                app = cls()
+                out = io.StringIO()
+                handler = logging.StreamHandler(out)
+                app.logger.addHandler(handler)
+                app.logger.propagate = False
+                app.logger.setLevel(logging.WARNING if mode == "logs off" else logging.INFO)
+                app.instrumentation = mode == "instrumented"
+                dp = MockDatapath()
+                events = [packet_in_event(dp, port, data) for port, data in events_spec]
+                start = time.perf_counter()
+                for ev in events:
+                    app._packet_in_handler(ev)
+                elapsed = time.perf_counter() - start
+                app.logger.removeHandler(handler)
+                best = elapsed if best is None else min(best, elapsed)
+                lines = out.getvalue().count("\n")
+            print("  %-13s %-13s %8.0f pkt/s  %6.1f us/pkt  log lines %6d"
+                  % (name, mode, len(events) / best, best / len(events) * 1e6, lines))
+        report = app.instruments.report()
+        for stage in lb_instrument.STAGES:
+            r = report["stages"][stage]
+            if r["count"]:
+                print("    %-9s n %6d  mean %6.1f us  p50 <= %6.1f us  p99 <= %6.1f us"
+                      % (stage, r["count"], r["mean"] * 1e6, r["p50"] * 1e6, r["p99"] * 1e6))
+        print("    events %s" % ", ".join("%s %d" % kv for kv in sorted(report["events"].items())))
+        text = app.instruments.prometheus(name)
+        print("    /metrics: %d lines, %d bytes" % (text.count("\n"), len(text)))
+
+
+def bench_buffering(clients, conns, payload):
+    """
+    Control-channel bytes per new connection, with and without switch
+    buffering (lb_buffering). Phase one is the usual ARP, SYN and SYN-ACK
+    per connection. In phase two the flows idle out and every client, then
+    its backend, sends a `payload`-byte segment mid-connection, which
+    misses the table again: full-size packets are where truncated
+    packet-ins pay off. "held" counts buffers never released. The third mode asks for buffering on a switch that
+    has no buffers and must fall back to whole packets.
+    """
+    print("Control-channel bytes, %d clients x %d connections, %d-byte segments after flow expiry"
+          % (clients, conns, payload))
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    data = b"x" * payload
+    for name, cls, services in apps:
+        for mode, buffering, n_buffers in (("no buffering", False, 256), ("buffering", True, 256),
+                                           ("no buffers", True, 0)):
+            app = cls()
+            app.logger.setLevel(logging.WARNING)
+            app.switch_buffering = buffering
+            sw = MockSwitch(app)
+            sw.n_buffers = n_buffers
+            sw.measure_bytes = True
+            sw.connect()
+            _, answered = run_connections(app, clients, conns, services, sw=sw)
+            total = clients * conns
+            setup = (sw.counters["bytes_up"], sw.counters["bytes_down"], sw.counters["packet_in"])
+            line = "  %-13s %-12s setup: up %5.0f down %5.0f B/conn (answered %d/%d)" % (
+                name, mode, setup[0] / total, setup[1] / total, answered, total)
+
+            sw.advance(300)
+            by_port = {b["port"]: b for b in app.backends}
+            delivered = 0
+            before = dict(sw.counters)
+            for i in range(clients):
+                ip, mac, port = client_addr(i)
+                service, sport = services[i % len(services)], 20000 + (i * conns) % 40000
+                out = sw.inject(port, tcp_segment(mac, VIP_MAC, ip, VIP, sport, service, tcp.TCP_ACK, data))
+                b = by_port.get(out[0][0]) if out else None
+                if b is None:
+                    continue
+                back = sw.inject(b["port"], tcp_segment(b["mac"], VIP_MAC, b["ip"], ip, service, sport,
+                                                        tcp.TCP_ACK, data))
+                delivered += sum(1 for p, f in back if p == port and f.get("ipv4_src") == VIP)
+                del sw.delivered[:]
+            up = sw.counters["bytes_up"] - before["bytes_up"]
+            down = sw.counters["bytes_down"] - before["bytes_down"]
+            misses = sw.counters["packet_in"] - before["packet_in"]
+            line += "  mid-stream: up %5.0f down %5.0f B/packet-in, %d/%d round trips, buffered %d, held %d" % (
+                up / max(misses, 1), down / max(misses, 1), delivered, clients, sw.counters["buffered"],
+                len(sw.buffers))
+            print(line)
+
+
+def run_connections(app, clients, conns, services, sw=None, first_client=0, backend_arp=False):
+    """
+    Drive full connections through a MockSwitch: each client ARPs for the VIP
+    and opens `conns` TCP connections. The SYN goes wherever the switch
+    sends it, and the backend it reached answers with a SYN-ACK (after
+    ARPing for the client the first time, with backend_arp). Returns the
+    switch counters and the number of SYN-ACKs the clients got back from
+    the VIP.
+    """
+    if sw is None:
+        sw = MockSwitch(app)
+        sw.connect()
+    by_port = {b["port"]: b for b in app.backends}
+    answered = 0
+    for i in range(first_client, first_client + clients):
+        ip, mac, port = client_addr(i)
+        sw.inject(port, arp_request(mac, ip, VIP))
+        arped = set()
+        for c in range(conns):
+            service = services[(i + c) % len(services)]
+            sport = 20000 + (i * conns + c) % 40000
+            out = sw.inject(port, tcp_segment(mac, VIP_MAC, ip, VIP, sport, service, tcp.TCP_SYN))
+            for out_port, f in out:
+                b = by_port.get(out_port)
+                if b is None or f.get("ipv4_dst") != b["ip"]:
+                    continue
+                if backend_arp and b["port"] not in arped:
+                    arped.add(b["port"])
+                    sw.inject(b["port"], arp_request(b["mac"], b["ip"], ip))
+                replies = sw.inject(b["port"], tcp_segment(b["mac"], VIP_MAC, b["ip"], ip, service, sport,
+                                                           tcp.TCP_SYN | tcp.TCP_ACK))
+                answered += sum(1 for p, rf in replies if p == port and rf.get("ipv4_src") == VIP)
+    return sw.counters, answered
+
+
+def bench_groups(clients, conns):
+    print("Packet-ins per mode, %d clients x %d connections" % (clients, conns))
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    for name, cls, services in apps:
+        for mode in ("reactive", "select groups"):
+            app = cls()
+            app.logger.setLevel(logging.WARNING)
+            app.select_groups = mode == "select groups"
+            start = time.perf_counter()
+            counters, answered = run_connections(app, clients, conns, services)
+            elapsed = time.perf_counter() - start
+            total = clients * conns
+            print("  %-13s %-13s packet-ins %6d (%.2f per connection)  flow-mods %6d  group-mods %3d"
+                  "  answered %d/%d  %.2fs" % (name, mode, counters["packet_in"], counters["packet_in"] / total,
+                                              counters["flow_mod"], counters["group_mod"], answered, total, elapsed))
+
+
+def bench_proactive(clients, conns):
+    """
+    Packet-ins per new client with the reactive ARP/return path and with
+    lb_proactive, backends ARPing for every client they answer. Also
+    checks that the switch-made ARP replies are correct, that a backend
+    reply still reaches its client after the client's delivery flow idled
+    out, and that a backend ARPing for another backend gets no proxy reply.
+    """
+    print("Packet-ins per client, reactive vs proactive, %d clients x %d connections" % (clients, conns))
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    for name, cls, services in apps:
+        for mode in ("reactive", "proactive", "proactive+groups"):
+            app = cls()
+            app.logger.setLevel(logging.WARNING)
+            app.proactive = mode.startswith("proactive")
+            app.select_groups = mode.endswith("groups")
+            sw = MockSwitch(app)
+            sw.connect()
+            ip, mac, port = client_addr(clients + 1)
+            reply = [f for p, f in sw.inject(port, arp_request(mac, ip, VIP)) if p == port]
+            if reply and app.proactive:
+                f = reply[0]
+                assert (f["arp_op"], f["arp_sha"], f["arp_spa"], f["arp_tha"], f["arp_tpa"], f["eth_dst"]) == \
+                    (arp.ARP_REPLY, VIP_MAC, VIP, mac, ip, mac), f
+            sw.counters["packet_in"] = 0
+            start = time.perf_counter()
+            counters, answered = run_connections(app, clients, conns, services, sw=sw, backend_arp=True)
+            elapsed = time.perf_counter() - start
+            total = clients * conns
+            print("  %-13s %-17s packet-ins %6d (%.2f per client)  flows %6d  answered %d/%d  %.2fs"
+                  % (name, mode, counters["packet_in"], counters["packet_in"] / clients, sw.flow_count(),
+                     answered, total, elapsed))
+            if app.proactive:
+                b, other = app.backends[0], app.backends[1]
+                replies = sw.inject(b["port"], arp_request(b["mac"], b["ip"], other["ip"]))
+                assert not [f for p, f in replies if p == b["port"]], replies
+                sw.advance(app.proactive_flows.client_idle_timeout + 1)
+                out = sw.inject(b["port"], tcp_segment(b["mac"], VIP_MAC, b["ip"], ip, services[0], 20000,
+                                                       tcp.TCP_ACK))
+                assert [f for p, f in out if p == port and f["ipv4_src"] == VIP and f["eth_dst"] == mac], out
+                out = sw.inject(b["port"], tcp_segment(b["mac"], VIP_MAC, b["ip"], ip, services[0], 20000,
+                                                       tcp.TCP_ACK))
+                assert [f for p, f in out if p == port], out
+
+
+def _backend_flows(sw, app, ip):
+    idx = app.backend_index[ip]
+    return sum(1 for f in sw.flows() if (lb_cookie.decode(f.cookie) or (0, None))[1] == idx)
+
+
+def bench_health(clients, conns):
+    """
+    L4StatefulLB against real stand-in servers (standin_backend.py, one
+    process per backend on 127.0.0.11-13). Backend 2 is killed and later
+    restarted, then put into HTTP 503 mode: the health checker has to take
+    it out of the pools, flush its flows by cookie and bring it back.
+    """
+    from ryu.lib import hub
+    hub.patch(thread=False)  # as ryu-manager does, so probes run concurrently
+
+    app = stateful_pied_piper_lb.L4StatefulLB()
+    app.logger.setLevel(logging.ERROR)
+    app.health.timeout, app.health.rise, app.health.fall = 0.5, 2, 2
+    for i, b in enumerate(app.backends):
+        b["health_ip"] = "127.0.0.%d" % (11 + i)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def spawn(b):
+        return subprocess.Popen([sys.executable, os.path.join(here, "standin_backend.py"),
+                                 "--ip", b["health_ip"], "--ports"] + [str(p) for p in b["services"]],
+                                stdout=subprocess.PIPE)
+
+    procs = [spawn(b) for b in app.backends]
+    for p in procs:
+        p.stdout.readline()  # "serving on ..."
+    sw = MockSwitch(app)
+    sw.connect()
+    victim = app.backends[1]
+    next_client = [0]
+
+    def traffic():
+        counters, answered = run_connections(app, clients, conns, (8080, 8181), sw=sw, first_client=next_client[0])
+        next_client[0] += clients
+        return answered
+
+    def rounds_until(cond, limit=10):
+        for n in range(1, limit + 1):
+            start = time.perf_counter()
+            app.health.check_once()
+            elapsed = time.perf_counter() - start
+            if cond():
+                return n, elapsed
+        raise AssertionError("health state did not change")
+
+    def report(label):
+        in_pools = sum(1 for pool in app.pools.values() for b in pool.backends if b["ip"] == victim["ip"])
+        sessions = sum(1 for s in app.sessions if s.backend["ip"] == victim["ip"])
+        print("  %-34s pools with it %d  its sessions %4d  its flows %4d" % (label, in_pools, sessions,
+                                                                           _backend_flows(sw, app, victim["ip"])))
+
+    print("Health checks, backend %s, %d clients x %d connections per step" % (victim["ip"], clients, conns))
+    try:
+        traffic()
+        report("all healthy")
+        procs[1].kill()
+        procs[1].wait()
+        n, probe_time = rounds_until(lambda: not app.health.is_up(victim))
+        report("killed: down after %d rounds" % n)
+        total = clients * conns
+        answered = traffic()
+        print("  %-34s answered %d/%d, round of %d probes took %.1f ms"
+              % ("traffic while down", answered, total,
+                 sum(len(app.health.ports(b)) for b in app.backends), probe_time * 1e3))
+        report("traffic while down")
+        procs[1] = spawn(victim)
+        procs[1].stdout.readline()
+        n, _ = rounds_until(lambda: app.health.is_up(victim))
+        traffic()
+        report("restarted: up after %d rounds" % n)
+        app.health.http_path = "/"
+        procs[1].send_signal(signal.SIGUSR1)
+        procs[1].stdout.readline()
+        n, _ = rounds_until(lambda: not app.health.is_up(victim))
+        report("HTTP 503: down after %d rounds" % n)
+        print("  status: %s" % app.health.status()[victim["ip"]]["error"])
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+
+
+def bench_batching(clients, burst, window):
+    """
+    Bursts of packet-ins before the switch has the flow: `window` clients
+    at a time each get `burst` copies of their first SYN to the controller,
+    then the queue flushes and the barrier replies come back. Compares
+    sending directly with flow_queue batching: flow-mods that reach the
+    switch, socket writes, and clients whose packets were spread over more
+    than one backend.
+    """
+    from ryu.lib import hub
+
+    print("Flow-mod batching, %d clients, %d packet-ins per new flow, %d clients per burst"
+          % (clients, burst, window))
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    for name, cls, services in apps:
+        for mode in ("direct", "batched"):
+            app = cls()
+            app.logger.setLevel(logging.WARNING)
+            app.batch_flow_mods = mode == "batched"
+            sw = MockSwitch(app)
+            sw.hold_barriers = True
+            sw.connect()
+            for i in range(clients):
+                ip, mac, port = client_addr(i)
+                sw.inject(port, arp_request(mac, ip, VIP))
+            hub.sleep(0)
+            sw.release_barriers()
+            by_port = {b["port"]: b for b in app.backends}
+            writes, flow_mods, packet_ins = sw.writes, sw.counters["flow_mod"], 0
+            split = 0
+            start = time.perf_counter()
+            for first in range(0, clients, window):
+                mark = len(sw.delivered)
+                for i in range(first, min(first + window, clients)):
+                    ip, mac, port = client_addr(i)
+                    data = tcp_segment(mac, VIP_MAC, ip, VIP, 30000 + i % 30000, services[i % len(services)],
+                                       tcp.TCP_SYN)
+                    for _ in range(burst):
+                        sw.dispatch(packet_in_event(sw, port, data))
+                        packet_ins += 1
+                hub.sleep(0)  # the queue's flush runs once the burst is handled
+                sw.release_barriers()
+                seen = {}
+                for out_port, f in sw.delivered[mark:]:
+                    if out_port in by_port:
+                        seen.setdefault(f.get("ipv4_src"), set()).add(out_port)
+                split += sum(1 for ports in seen.values() if len(ports) > 1)
+            elapsed = time.perf_counter() - start
+            writes, flow_mods = sw.writes - writes, sw.counters["flow_mod"] - flow_mods
+            saved = app.flow_queues.stats["saved"]
+            print("  %-13s %-8s packet-ins %6d  flow-mods sent %6d (saved %5d)  writes %6d (%7.0f/s)"
+                  "  split clients %4d  flows %5d"
+                  % (name, mode, packet_ins, flow_mods, saved, writes, writes / elapsed, split, sw.flow_count()))
+
+
+def bench_fabric(clients, conns, leaves, spines):
+    """
+    FabricL4LB on a MockFabric: LLDP discovery, backends on leaves 1..3,
+    clients spread over all leaves, each opening `conns` connections that
+    the backend answers (after ARPing for the client). Reports answered
+    connections, per-switch state and flows. Spine flows should not grow
+    with the number of clients. Last, two clients on different leaves talk
+    to each other directly (ARP, then TCP) over plain L2 forwarding.
+    """
+    import fabric_pied_piper_lb
+    from lb_fabric import locator_mac
+
+    app = fabric_pied_piper_lb.FabricL4LB()
+    app.logger.setLevel(logging.WARNING)
+    fab = MockFabric(app, leaves, spines)
+    fab.connect()
+    for sw in fab.switches.values():
+        app._send_lldp(sw)
+    links = len(app.topology.links)
+
+    where = {}
+    for i, b in enumerate(app.backends):
+        where[b["ip"]] = (fab.leaves[i % leaves], fab.first_host_port)
+        fab.inject(where[b["ip"]][0], where[b["ip"]][1], arp_request(b["mac"], b["ip"], b["ip"]))
+    services = (8080, 8181)
+    answered = arp_ok = 0
+    start = time.perf_counter()
+    for i in range(clients):
+        ip, mac, _ = client_addr(i)
+        leaf = fab.leaves[i % leaves]
+        port = fab.first_host_port + 1 + (i // leaves) % 60
+        replies = fab.inject(leaf, port, arp_request(mac, ip, VIP))
+        arp_ok += any(d == leaf and p == port and f.get("arp_op") == arp.ARP_REPLY for d, p, f in replies)
+        arped = set()
+        for c in range(conns):
+            service = services[(i + c) % len(services)]
+            sport = 20000 + (i * conns + c) % 40000
+            out = fab.inject(leaf, port, tcp_segment(mac, VIP_MAC, ip, VIP, sport, service, tcp.TCP_SYN))
+            for d, p, f in out:
+                b = app.backend_by_ip.get(f.get("ipv4_dst"))
+                if b is None or (d, p) != where[b["ip"]]:
+                    continue
+                if b["ip"] not in arped:
+                    arped.add(b["ip"])
+                    reply = fab.inject(d, p, arp_request(b["mac"], b["ip"], ip))
+                    locator = [rf["arp_sha"] for rd, rp, rf in reply if (rd, rp) == (d, p)]
+                    assert locator == [locator_mac(leaf)], locator
+                back = fab.inject(d, p, tcp_segment(b["mac"], locator_mac(leaf), b["ip"], ip, service, sport,
+                                                    tcp.TCP_SYN | tcp.TCP_ACK))
+                answered += sum(1 for rd, rp, rf in back
+                                if (rd, rp) == (leaf, port) and rf["ipv4_src"] == VIP and rf["eth_dst"] == mac)
+    elapsed = time.perf_counter() - start
+    total = clients * conns
+    sizes = app.state_sizes()
+    print("Fabric: %d leaves x %d spines (%d links found by LLDP), %d clients x %d connections"
+          % (leaves, spines, links, clients, conns))
+    print("  answered %d/%d, ARP for VIP %d/%d, packet-ins %d (%.2f per connection)  %.2fs"
+          % (answered, total, arp_ok, clients, fab.counter("packet_in"), fab.counter("packet_in") / total, elapsed))
+    for d, sw in sorted(fab.switches.items()):
+        role = "leaf " if d in fab.leaves else "spine"
+        c, n, h = sizes.get(d, (0, 0, 0))
+        print("  %s %2d  flows %5d  clients %5d  sessions %5d  hosts %5d" % (role, d, sw.flow_count(), c, n, h))
+    print("  directory %d entries" % len(app.directory))
+
+    if clients >= 2 and leaves >= 2:
+        (a_ip, a_mac, _), (b_ip, b_mac, _) = client_addr(0), client_addr(1)
+        a = (fab.leaves[0], fab.first_host_port + 1)
+        b = (fab.leaves[1], fab.first_host_port + 1)
+        flooded = (b[0], b[1]) in [(d, p) for d, p, _ in fab.inject(a[0], a[1], arp_request(a_mac, a_ip, b_ip))]
+        replied = [(d, p) for d, p, _ in fab.inject(b[0], b[1], arp_reply(b_mac, b_ip, a_mac, a_ip))] == [a]
+        before = fab.counter("packet_in")
+        delivered = 0
+        for _ in range(3):
+            out = fab.inject(a[0], a[1], tcp_segment(a_mac, b_mac, a_ip, b_ip, 30000, 22, tcp.TCP_ACK))
+            delivered += [(d, p) for d, p, _ in out] == [b]
+        print("  host to host: ARP request flooded %s, reply %s, unicast delivered %d/3, packet-ins %d"
+              % ("ok" if flooded else "MISSING", "ok" if replied else "MISSING", delivered,
+                 fab.counter("packet_in") - before))
+
+
+def bench_budget(clients, capacity, phases=10):
+    """
+    L4StatefulLB against a switch whose table should hold `capacity`
+    session flows. Clients arrive in `phases`; after each phase a hot
+    quarter of the capacity (the first clients) sends another packet, and
+    the app polls flow stats. Without the budget the session flows grow
+    with the clients; with it they stay under capacity, new flows get
+    coarser, and the hot clients keep their flows while cold ones are
+    evicted.
+    """
+    print("Flow-table budget, %d clients in %d phases, capacity %d" % (clients, phases, capacity))
+    hot = range(capacity // 4)
+    session_cookie, mask = lb_cookie.kind_match(lb_cookie.KIND_SESSION)
+    for budget in (False, True):
+        app = stateful_pied_piper_lb.L4StatefulLB()
+        app.logger.setLevel(logging.WARNING)
+        app.flow_budget = budget
+        app.budget = flow_budget.FlowBudget(capacity=capacity)
+        sw = MockSwitch(app)
+        sw.connect()
+        per_phase = clients // phases
+        peak = hot_packets = hot_misses = 0
+        levels = []
+        for phase in range(phases):
+            run_connections(app, per_phase, 1, (8080,), sw=sw, first_client=phase * per_phase)
+            sw.advance(1)
+            before = sw.counters["packet_in"]
+            for i in hot:
+                ip, mac, port = client_addr(i)
+                sw.inject(port, tcp_segment(mac, VIP_MAC, ip, VIP, 20000 + i % 40000, 8080, tcp.TCP_ACK))
+            hot_packets += len(hot)
+            hot_misses += sw.counters["packet_in"] - before
+            if budget:
+                app._poll_flow_budget(sw)
+                levels.append(app.budget.granularity(sw.id)[0])
+            sessions = sum(1 for f in sw.flows() if f.cookie & mask == session_cookie)
+            peak = max(peak, sessions)
+            del sw.delivered[:]
+        line = "  %-9s session flows peak %5d  packet-ins %6d  hot packets missed %5d / %5d" % (
+            "budget" if budget else "no budget", peak, sw.counters["packet_in"], hot_misses, hot_packets)
+        if budget:
+            r = app.budget.report(sw.id)
+            line += "  evictions %5d  hit ratio %.2f  granularity by phase %s" % (
+                r["evictions"], r["hit_ratio"], "".join(levels))
+        print(line)
+
+
+def bench_traffic(clients, conns, rounds=3):
+    """
+    Traffic accounting with lb_stats. After the connections are set up,
+    every client sends `rounds` data packets on its first connection and
+    the backend answers each; the packets that went through flows (no
+    packet-in) are the ground truth per backend. One flow-stats poll
+    before and one after that phase must account for exactly those, with
+    one request per switch whatever the number of clients.
+    """
+    print("Traffic accounting, %d clients x %d connections, %d data packets each way"
+          % (clients, conns, rounds))
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    for name, cls, services in apps:
+        app = cls()
+        app.logger.setLevel(logging.WARNING)
+        app.traffic_stats = True
+        app.traffic = lb_stats.TrafficStats()
+        sw = MockSwitch(app)
+        sw.connect()
+        run_connections(app, clients, conns, services, sw=sw)
+        by_port = {b["port"]: b for b in app.backends}
+        app.traffic.poll(sw)
+        app.traffic.tick()
+        truth = {}
+        for i in range(clients):
+            ip, mac, port = client_addr(i)
+            service, sport = services[i % len(services)], 20000 + (i * conns) % 40000
+            for _ in range(rounds):
+                before = sw.counters["packet_in"]
+                out = sw.inject(port, tcp_segment(mac, VIP_MAC, ip, VIP, sport, service, tcp.TCP_ACK))
+                b = by_port.get(out[0][0]) if out else None
+                if b is None:
+                    continue
+                if sw.counters["packet_in"] == before:
+                    truth[b["ip"]] = truth.get(b["ip"], 0) + 1
+                before = sw.counters["packet_in"]
+                sw.inject(b["port"], tcp_segment(b["mac"], VIP_MAC, b["ip"], ip, service, sport, tcp.TCP_ACK))
+                if sw.counters["packet_in"] == before:
+                    truth[b["ip"]] = truth.get(b["ip"], 0) + 1
+            del sw.delivered[:]
+        sent = len(sw.sent)
+        start = time.perf_counter()
+        app.traffic.poll(sw)
+        elapsed = time.perf_counter() - start
+        counted = {key: c[0] for (dim, key), c in app.traffic.current.items() if dim == "backend"}
+        report = app.traffic.report()
+        print("  %-13s poll: %d request(s) for %d flows, %.1f ms  services %s  top client %s"
+              % (name, len(sw.sent) - sent, sw.flow_count(), elapsed * 1e3,
+                 sorted(report["services"]), next(iter(report["clients"]), None)))
+        for ip in sorted(set(truth) | set(counted)):
+            print("    backend %-9s through flows %6d  accounted %6d  %s"
+                  % (ip, truth.get(ip, 0), counted.get(ip, 0), "ok" if truth.get(ip) == counted.get(ip) else "MISMATCH"))
+
+
+def bench_meters(clients, flood_rate, seconds=5.0):
+    """
+    One port floods SYNs to the VIP from spoofed sources at flood_rate
+    packets per second while `clients` real clients connect from other
+    ports, spread over `seconds` of switch time. Without meters every flood
+    packet is a packet-in. A switch-wide meter bounds the packet-ins, but
+    the flood uses up the budget of the real clients too (expect none
+    answered); per-port meters hold the noisy port to its own rate while
+    the backend ports stay on the switch-wide budget (expect all answered).
+    """
+    print("Packet-in meters, %d clients over %.0fs, flood of %d SYN/s on one port"
+          % (clients, seconds, flood_rate))
+    noisy = 70
+    step = 0.01
+    steps = int(seconds / step)
+    every = max(1, steps // clients)
+    for mode in ("no meters", "switch meter", "per-port meters"):
+        app = stateful_pied_piper_lb.L4StatefulLB()
+        app.logger.setLevel(logging.WARNING)
+        app.packet_in_meters = mode != "no meters"
+        app.meters = lb_meters.PacketInMeters(rate=200, arp_rate=100, port_rate=20,
+                                              per_port=mode == "per-port meters")
+        sw = MockSwitch(app)
+        sw.ports = list(range(1, noisy + 1))
+        sw.connect()
+        answered = flood = k = 0
+        owed = 0.0
+        start = time.perf_counter()
+        for n in range(steps):
+            sw.advance(step)
+            owed += flood_rate * step
+            while owed >= 1:
+                owed -= 1
+                ip = "172.16.%d.%d" % (flood // 250 % 250, flood % 250 + 1)
+                sw.inject(noisy, tcp_segment("02:ff:00:00:00:01", VIP_MAC, ip, VIP, 1024 + flood % 60000,
+                                             8080, tcp.TCP_SYN))
+                flood += 1
+            if n % every == 0 and k < clients:
+                answered += run_connections(app, 1, 1, (8080,), sw=sw, first_client=k)[1]
+                k += 1
+            del sw.delivered[:]
+        elapsed = time.perf_counter() - start
+        line = "  %-16s packet-ins %6d (%6.0f/s)  clients answered %4d/%d  handler time %5.2fs" % (
+            mode, sw.counters["packet_in"], sw.counters["packet_in"] / seconds, answered, k, elapsed)
+        if app.packet_in_meters:
+            app.meters.poll(sw)
+            packets, delivered, dropped = app.meters.report(sw.id)["all"]
+            line += "  meters: in %6d delivered %5d dropped %6d" % (packets, delivered, dropped)
+            noisiest = app.meters.noisiest(sw.id, 1)
+            if noisiest:
+                line += "  (port %d: %d)" % noisiest[0]
+        print(line)
+
+
+def bench_restart(clients, conns):
+    """
+    Controller restart with lb_persist. The first app instance sets up the
+    connections with warm_restart on; a second instance then takes over the
+    same switch, cold (empty state) or warm (store plus flow dump). The
+    reverse flows then idle out, and every backend answers its client
+    once more: the answer needs the app to still know the client. Also
+    shows what the store costs: log rows, flush and compaction time.
+    """
+    print("Controller restart, %d clients x %d connections" % (clients, conns))
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    reverse_cookie, mask = lb_cookie.kind_match(lb_cookie.KIND_REVERSE)
+    for name, cls, services in apps:
+        for mode in ("cold", "warm"):
+            path = "/tmp/lb_bench_restart_%d.sqlite" % os.getpid()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            app = cls()
+            app.logger.setLevel(logging.WARNING)
+            app.warm_restart = True
+            app.state_path = path
+            sw = MockSwitch(app)
+            sw.connect()
+            run_connections(app, clients, conns, services, sw=sw)
+            # Which backend serves each client's first connection
+            by_port = {b["port"]: b for b in app.backends}
+            served = {}
+            for i in range(clients):
+                ip, mac, port = client_addr(i)
+                service, sport = services[i % len(services)], 20000 + (i * conns) % 40000
+                out = sw.inject(port, tcp_segment(mac, VIP_MAC, ip, VIP, sport, service, tcp.TCP_ACK))
+                if out and out[0][0] in by_port:
+                    served[i] = (by_port[out[0][0]], service, sport)
+            sessions = {(s.client_ip, s.service_port): s.backend["ip"] for s in getattr(app, "sessions", ())}
+            rows = len(app.store.pending)
+            start = time.perf_counter()
+            app.store.flush()
+            flushed = time.perf_counter() - start
+            start = time.perf_counter()
+            app.store.compact()
+            compacted = time.perf_counter() - start
+            app.store.close()
+
+            app2 = cls()
+            app2.logger.setLevel(logging.WARNING)
+            app2.warm_restart = mode == "warm"
+            app2.state_path = path
+            sw.app = app2
+            sw.handlers = event_handlers(app2)
+            start = time.perf_counter()
+            sw.connect()
+            restart = time.perf_counter() - start
+            same = sum(1 for s in getattr(app2, "sessions", ()) if sessions.get((s.client_ip, s.service_port))
+                       == s.backend["ip"])
+
+            for f in list(sw.flows()):
+                if f.cookie & mask == reverse_cookie:
+                    sw._remove(f, sw.ofproto.OFPRR_IDLE_TIMEOUT)
+            before = sw.counters["packet_in"]
+            answered = 0
+            for i, (b, service, sport) in served.items():
+                ip, mac, port = client_addr(i)
+                out = sw.inject(b["port"], tcp_segment(b["mac"], VIP_MAC, b["ip"], ip, service, sport,
+                                                       tcp.TCP_ACK))
+                answered += sum(1 for p, f in out if p == port and f.get("ipv4_src") == VIP)
+            del sw.delivered[:]
+            line = "  %-13s %-5s restart %6.1f ms  clients %5d" % (name, mode, restart * 1e3, len(app2.clients))
+            if sessions:
+                line += "  sessions %5d (%5d same backend)" % (len(app2.sessions), same)
+            line += "  backend answers after reverse-flow expiry %5d/%d  packet-ins %5d" % (
+                answered, len(served), sw.counters["packet_in"] - before)
+            print(line)
+            if app2.store is not None:
+                app2.store.close()
+        print("    store: %d log rows, flush %.1f ms, compaction %.1f ms, %d KiB"
+              % (rows, flushed * 1e3, compacted * 1e3, os.path.getsize(path) // 1024))
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def bench_sessions(clients, conns, rounds, lose_flow_removed=False):
+    """
+    Waves of new clients against L4StatefulLB. After each wave the switch
+    clock passes the idle timeout, so every session flow expires. Session
+    and client state should return to zero instead of growing with every
+    wave. With lose_flow_removed the switch drops FlowRemoved messages,
+    and the timer-wheel backstop plus flow-stats check has to clean up.
+    """
+    import tracemalloc
+
+    app = stateful_pied_piper_lb.L4StatefulLB()
+    app.logger.setLevel(logging.WARNING)
+    sw = MockSwitch(app)
+    sw.connect()
+    if lose_flow_removed:
+        sw.handlers.pop(ofp_event.EventOFPFlowRemoved, None)
+    print("Session lifecycle, %d waves of %d clients x %d connections%s"
+          % (rounds, clients, conns, " (FlowRemoved lost)" if lose_flow_removed else ""))
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    clock = time.time()
+    for r in range(rounds):
+        run_connections(app, clients, conns, (8080, 8181), sw=sw, first_client=r * clients)
+        peak_sessions, peak_clients = len(app.sessions), len(app.clients)
+        sw.advance(app.idle_timeout + 1)
+        # Let the app's timers run as if the same time had passed for them
+        clock = max(clock, time.time()) + max(app.session_backstop, app.client_timeout) + 1
+        app._expire(clock)
+        clock += 1
+        app._expire(clock)
+        sw.clear()
+        del sw.delivered[:]
+        print("  wave %2d  sessions %5d -> %5d  clients %5d -> %5d  flows %5d  wheel %5d  memory %7.1f KiB"
+              % (r + 1, peak_sessions, len(app.sessions), peak_clients, len(app.clients), sw.flow_count(),
+                 len(app.sessions.wheel), (tracemalloc.get_traced_memory()[0] - base) / 1024.0))
+    tracemalloc.stop()
+
+
+def synthetic_backends(n, service=8080):
+    return [{"ip": "10.1.%d.%d" % (i // 250, i % 250 + 1), "mac": "00:00:00:01:%02x:%02x" % (i >> 8, i & 0xff),
+             "port": i + 1, "services": [service], "weight": 1 + i % 4} for i in range(n)]
+
+
+def old_select(backends, next_backend, service_port):
+    # Selection as L4StatefulLB did it before lb_strategies
+    eligible = [b for b in backends if service_port in b["services"]]
+    idx = next_backend.get(service_port, 0)
+    backend = eligible[idx % len(eligible)]
+    next_backend[service_port] = (idx + 1) % len(eligible)
+    return backend
+
+
+def bench_strategies(n_backends, selections):
+    backends = synthetic_backends(n_backends)
+    keys = ["10.%d.%d.%d" % (i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff) for i in range(selections)]
+    print("Backend selection, %d backends, %d selections" % (n_backends, selections))
+
+    next_backend = {}
+    start = time.perf_counter()
+    for _ in keys:
+        old_select(backends, next_backend, 8080)
+    elapsed = time.perf_counter() - start
+    print("  %-14s build %8.1f ms  %8.2f us/select" % ("old list scan", 0.0, elapsed / selections * 1e6))
+
+    for name, cls in lb_strategies.strategies.items():
+        start = time.perf_counter()
+        pool = cls(backends)
+        build = time.perf_counter() - start
+        open_sessions = deque()
+        start = time.perf_counter()
+        for i, key in enumerate(keys):
+            b = pool.select(key)
+            pool.acquire(b)
+            open_sessions.append(b)
+            if i % 2:
+                pool.release(open_sessions.popleft())
+        elapsed = time.perf_counter() - start
+        print("  %-14s build %8.1f ms  %8.2f us/select" % (name, build * 1e3, elapsed / selections * 1e6))
+
+    # Maglev disruption when one backend leaves the pool
+    pool = lb_strategies.Maglev(backends)
+    before = [pool.select(k)["ip"] for k in keys]
+    pool.set_backends(backends[1:])
+    after = [pool.select(k)["ip"] for k in keys]
+    moved = sum(1 for a, b in zip(before, after) if a != b)
+    lost = sum(1 for a in before if a == backends[0]["ip"])
+    print("  maglev: removing 1 of %d backends remapped %.2f%% of keys (%.2f%% were on it, ideal 1/N = %.2f%%)"
+          % (n_backends, 100.0 * moved / selections, 100.0 * lost / selections, 100.0 / n_backends))
+
+    # Weighted: each backend's share of one pass over the table against its weight
+    pool = lb_strategies.WeightedRoundRobin(backends)
+    picks = Counter(b["ip"] for b in pool.schedule)
+    total_weight = sum(b["weight"] for b in backends)
+    worst = max(abs(picks[b["ip"]] / len(pool.schedule) - b["weight"] / total_weight) / (b["weight"] / total_weight)
+                for b in backends)
+    print("  weighted: table of %d slots for total weight %d, worst share off by %.1f%% of its weight"
+          % (len(pool.schedule), total_weight, 100.0 * worst))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Lab9 packet-in handlers")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--strategies", action="store_true", help="benchmark lb_strategies instead")
+    parser.add_argument("--backends", type=int, default=1000)
+    parser.add_argument("--selections", type=int, default=100000)
+    parser.add_argument("--groups", action="store_true", help="count packet-ins with and without SELECT groups")
+    parser.add_argument("--conns", type=int, default=5, help="connections per client for --groups")
+    parser.add_argument("--proactive", action="store_true", help="packet-ins per client, reactive vs proactive")
+    parser.add_argument("--health", action="store_true", help="health checks against stand-in backends")
+    parser.add_argument("--batching", action="store_true", help="flow-mod batching under packet-in bursts")
+    parser.add_argument("--burst", type=int, default=4, help="packet-ins per new flow for --batching")
+    parser.add_argument("--window", type=int, default=50, help="clients per burst for --batching")
+    parser.add_argument("--fabric", action="store_true", help="FabricL4LB on a mock leaf-spine fabric")
+    parser.add_argument("--leaves", type=int, default=4)
+    parser.add_argument("--spines", type=int, default=2)
+    parser.add_argument("--traffic", action="store_true", help="per-backend accounting from flow-stats polls")
+    parser.add_argument("--meters", action="store_true", help="packet-in meters under a SYN flood on one port")
+    parser.add_argument("--flood", type=int, default=5000, help="flood packets per second for --meters")
+    parser.add_argument("--restart", action="store_true", help="controller restart, cold vs warm (lb_persist)")
+    parser.add_argument("--buffering", action="store_true", help="control-channel bytes with switch buffering")
+    parser.add_argument("--payload", type=int, default=1400, help="segment size for --buffering")
+    parser.add_argument("--instrument", action="store_true", help="handler cost with lb_instrument on and off")
+    parser.add_argument("--budget", action="store_true", help="flow-table budget under more clients than fit")
+    parser.add_argument("--capacity", type=int, default=400, help="session flows the switch holds, for --budget")
+    parser.add_argument("--sessions", action="store_true", help="session table lifecycle over waves of clients")
+    parser.add_argument("--waves", type=int, default=5)
+    parser.add_argument("--lose-flow-removed", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.traffic:
+        bench_traffic(args.clients, args.conns)
+        return
+
+    if args.meters:
+        bench_meters(args.clients, args.flood)
+        return
+
+    if args.buffering:
+        bench_buffering(args.clients, args.conns, args.payload)
+        return
+
+    if args.instrument:
+        bench_instrument(args.clients, args.repeat)
+        return
+
+    if args.restart:
+        bench_restart(args.clients, args.conns)
+        return
+
+    if args.budget:
+        bench_budget(args.clients, args.capacity)
+        return
+
+    if args.sessions:
+        bench_sessions(args.clients, args.conns, args.waves, args.lose_flow_removed)
+        return
+
+    if args.fabric:
+        bench_fabric(args.clients, args.conns, args.leaves, args.spines)
+        return
+
+    if args.batching:
+        bench_batching(args.clients, args.burst, args.window)
+        return
+
+    if args.health:
+        bench_health(args.clients, args.conns)
+        return
+
+    if args.proactive:
+        bench_proactive(args.clients, args.conns)
+        return
+
+    if args.groups:
+        bench_groups(args.clients, args.conns)
+        return
+
+    if args.strategies:
+        bench_strategies(args.backends, args.selections)
+        return
+
+    apps = (
+        ("RoundRobinLB", pied_piper_lb.RoundRobinLB, (8080,)),
+        ("L4StatefulLB", stateful_pied_piper_lb.L4StatefulLB, (8080, 8181)),
+    )
+    for name, cls, services in apps:
+        events_spec = workload(cls().backends, args.clients, services)
+        frames = [data for _, data in events_spec]
+        check_equivalence(frames)
+
+        print("%s: %d packet-ins (%d clients)" % (name, len(events_spec), args.clients))
+        for label, rate in bench_parse(frames, args.repeat).items():
+            print("  parse only   %-18s %10.0f pkt/s" % (label, rate))
+        results = bench_handler(cls, events_spec, args.repeat)
+        for label, (rate, usec, sent) in results.items():
+            print("  handler      %-18s %10.0f pkt/s  %6.1f us/pkt  %d messages sent" % (label, rate, usec, sent))
+        speedup = results["fast_parse"][0] / results["ryu parser"][0]
+        print("  handler speedup: %.2fx" % speedup)
+
+
+if __name__ == "__main__":
+    main()
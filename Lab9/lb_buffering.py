@@ -0,0 +1,74 @@
+"""
+Switch-side packet buffering for the Lab9 load balancers.
+
+By default the table-miss sends whole packets to the controller
+(OFPCML_NO_BUFFER), and the packet comes back in full in a PacketOut, so
+every punted packet crosses the control channel twice at full size. With
+buffering the switch keeps the packet and sends only its first
+miss_send_len bytes (OFPSetConfig, and max_len on the to-controller
+actions), enough for the headers the apps parse. The app then releases
+the packet by buffer_id:
+
+  FlowMod    buffer_id set: the switch runs the new flow on the buffered
+             packet, and no PacketOut is needed
+  PacketOut  buffer_id set and no data, where no FlowMod can carry it
+
+A packet the app does not forward (ARP it answers itself, FIN/RST, LLDP,
+no backend) would hold its buffer until the switch times it out, so the
+apps release it with release(): a PacketOut by buffer_id with no actions.
+
+Fallback: a switch that reports n_buffers = 0 in its features (Open
+vSwitch since 2.7) is left at OFPCML_NO_BUFFER, and any packet-in that
+arrives with OFP_NO_BUFFER (buffers full) carries the whole packet and is
+sent back with its data as before.
+"""
+
+# Ethernet + VLAN tag + IPv4 with options + TCP with options fits in 128
+MISS_SEND_LEN = 128
+
+
+def can_buffer(features):
+    # features: the OFPSwitchFeatures message
+    return features.n_buffers > 0
+
+
+def set_config(dp, miss_send_len=MISS_SEND_LEN):
+    parser = dp.ofproto_parser
+    dp.send_msg(parser.OFPSetConfig(dp, dp.ofproto.OFPC_FRAG_NORMAL, miss_send_len))
+
+
+def controller_max_len(dp, miss_send_len):
+    # max_len for OFPActionOutput(OFPP_CONTROLLER); None means no buffering
+    return dp.ofproto.OFPCML_NO_BUFFER if miss_send_len is None else miss_send_len
+
+
+def is_buffered(msg):
+    return msg.buffer_id != msg.datapath.ofproto.OFP_NO_BUFFER
+
+
+def flow_buffer_id(msg, queued=False):
+    """
+    buffer_id for the FlowMod answering a packet-in, or None to release
+    the packet with a PacketOut. With queued FlowMods (flow_queue.py) a
+    duplicate FlowMod may be dropped, and the packet with it.
+    """
+    if queued or not is_buffered(msg):
+        return None
+    return msg.buffer_id
+
+
+def packet_out(dp, msg, in_port, actions):
+    """PacketOut for a packet-in: by buffer_id if the switch kept it, else with its data."""
+    parser = dp.ofproto_parser
+    if is_buffered(msg):
+        return parser.OFPPacketOut(datapath=dp, buffer_id=msg.buffer_id, in_port=in_port,
+                                   actions=actions, data=None)
+    return parser.OFPPacketOut(datapath=dp, buffer_id=dp.ofproto.OFP_NO_BUFFER, in_port=in_port,
+                               actions=actions, data=msg.data)
+
+
+def release(msg):
+    """PacketOut that drops a buffered packet-in and frees its switch buffer."""
+    dp = msg.datapath
+    return dp.ofproto_parser.OFPPacketOut(datapath=dp, buffer_id=msg.buffer_id,
+                                          in_port=msg.match['in_port'], actions=[], data=None)
@@ -0,0 +1,81 @@
+"""
+Flow cookie layout shared by the Lab9 load balancer flows.
+
+    bits 63-48  0x4C42 ("LB"), marks the flow as ours
+    bits 47-40  kind of flow (KIND_*)
+    bits 39-24  backend index + 1 (0 = no backend)
+    bits 23-0   session id (0 = not a session flow)
+
+Flows can then be selected by cookie/cookie_mask in FlowMod deletes and
+flow-stats requests (all LB flows, one kind, or everything pointing at one
+backend), and a FlowRemoved or flow-stats entry can be mapped back to
+its session without keeping a match -> session index. make() raises
+ValueError for a backend index or session id that does not fit its field
+(MAX_BACKENDS backends, session ids up to SESSION_MASK), rather than
+letting it spill into the neighbouring bits.
+"""
+
+from collections import namedtuple
+
+TAG = 0x4C42
+
+KIND_SESSION = 1   # client -> backend flow of one session
+KIND_REVERSE = 2   # backend -> client NAT flow
+KIND_VIP = 3       # proactive VIP flows (SELECT groups)
+KIND_ARP = 4       # ARP handling
+KIND_CLIENT = 5    # per-client delivery after the proactive reverse rewrite
+KIND_FORWARD = 6   # plain forwarding between switches of a fabric
+KIND_PUNT = 7      # metered to-controller flows (table-miss, ARP)
+
+TAG_MASK = 0xFFFF << 48
+KIND_MASK = 0xFF << 40
+BACKEND_SHIFT = 24
+BACKEND_MASK = 0xFFFF << BACKEND_SHIFT
+SESSION_MASK = 0xFFFFFF
+MAX_BACKENDS = 0xFFFF - 1
+
+Cookie = namedtuple("Cookie", "kind backend session")
+
+
+def make(kind, backend=None, session=0):
+    # backend is an index into the app's backend list (or None)
+    if backend is not None and not 0 <= backend < MAX_BACKENDS:
+        raise ValueError("backend index %d does not fit the flow cookie" % backend)
+    if not 0 <= session <= SESSION_MASK:
+        raise ValueError("session id %d does not fit the flow cookie" % session)
+    b = 0 if backend is None else backend + 1
+    return (TAG << 48) | ((kind & 0xFF) << 40) | (b << BACKEND_SHIFT) | session
+
+
+def decode(cookie):
+    # Cookie(kind, backend index or None, session id) for our flows, else None
+    if (cookie & TAG_MASK) != TAG << 48:
+        return None
+    b = (cookie & BACKEND_MASK) >> BACKEND_SHIFT
+    return Cookie((cookie & KIND_MASK) >> 40, b - 1 if b else None, cookie & SESSION_MASK)
+
+
+def check_backends(backends):
+    # For update_backends(): a list the cookie cannot index is refused up front
+    if len(backends) > MAX_BACKENDS:
+        raise ValueError("%d backends, the flow cookie indexes at most %d" % (len(backends), MAX_BACKENDS))
+
+
+def lb_match():
+    # (cookie, mask) selecting every LB flow
+    return TAG << 48, TAG_MASK
+
+
+def kind_match(kind):
+    return make(kind), TAG_MASK | KIND_MASK
+
+
+def session_match(session):
+    # The session flow of one session id, whatever backend index it was
+    # installed with (the index changes when the backend list is renumbered)
+    return make(KIND_SESSION, None, session), TAG_MASK | KIND_MASK | SESSION_MASK
+
+
+def backend_match(backend):
+    # Every LB flow (any kind) that carries this backend index
+    return make(0, backend), TAG_MASK | BACKEND_MASK
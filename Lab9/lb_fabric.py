@@ -0,0 +1,122 @@
+"""
+Switch topology for the multi-switch load balancer (fabric_pied_piper_lb).
+
+Links are found with LLDP: the app sends one LLDP frame out of every port
+of every switch, carrying the sending dpid and port, and a frame that comes
+back as a packet-in on (dpid, port) proves the link. Ports with a link are
+fabric ports; all other ports are edge ports, where hosts are learned.
+Links not seen again within `link_timeout` are dropped.
+
+Forwarding between switches needs only one next hop per (switch,
+destination switch), from a BFS over the link graph. Hosts behind another
+switch are reached through a per-switch locator MAC (locator_mac(dpid)), so
+transit switches hold O(switches) flows, however many clients there are.
+"""
+
+import struct
+import time
+from collections import deque
+
+from ryu.lib.packet import packet, ethernet, lldp, ether_types
+
+
+def locator_mac(dpid):
+    # Locally administered unicast MAC naming a switch: 0e:xx:xx:xx:xx:xx
+    return "0e:" + ":".join("%02x" % ((dpid >> s) & 0xff) for s in (32, 24, 16, 8, 0))
+
+
+def locator_dpid(mac):
+    # Inverse of locator_mac, or None for other MACs
+    if not mac or not mac.startswith("0e:"):
+        return None
+    return int(mac[3:].replace(":", ""), 16)
+
+
+def lldp_frame(dpid, port):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=lldp.LLDP_MAC_NEAREST_BRIDGE, src=locator_mac(dpid),
+                                       ethertype=ether_types.ETH_TYPE_LLDP))
+    pkt.add_protocol(lldp.lldp(tlvs=(
+        lldp.ChassisID(subtype=lldp.ChassisID.SUB_LOCALLY_ASSIGNED, chassis_id=b"dpid:%016x" % dpid),
+        lldp.PortID(subtype=lldp.PortID.SUB_PORT_COMPONENT, port_id=struct.pack("!I", port)),
+        lldp.TTL(ttl=120),
+        lldp.End(),
+    )))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def parse_lldp(data):
+    # (dpid, port) the frame was sent from, or None if it is not one of ours
+    try:
+        tlvs = packet.Packet(data).get_protocol(lldp.lldp).tlvs
+        chassis = tlvs[0].chassis_id
+        if not chassis.startswith(b"dpid:"):
+            return None
+        return int(chassis[5:], 16), struct.unpack("!I", tlvs[1].port_id)[0]
+    except (AttributeError, IndexError, ValueError, struct.error):
+        return None
+
+
+class FabricTopology(object):
+    def __init__(self, link_timeout=15.0):
+        self.link_timeout = link_timeout
+        self.ports = {}  # dpid -> set of port numbers
+        self.links = {}  # (dpid, port) -> [peer dpid, peer port, last seen]
+        self.next_hop = {}  # dpid -> {destination dpid: out port}
+
+    def add_switch(self, dpid, ports):
+        self.ports[dpid] = set(ports)
+
+    def remove_switch(self, dpid):
+        self.ports.pop(dpid, None)
+        gone = [k for k, v in self.links.items() if k[0] == dpid or v[0] == dpid]
+        for k in gone:
+            del self.links[k]
+        if gone:
+            self.compute()
+        return bool(gone)
+
+    def is_fabric_port(self, dpid, port):
+        return (dpid, port) in self.links
+
+    def edge_ports(self, dpid):
+        return [p for p in sorted(self.ports.get(dpid, ())) if (dpid, p) not in self.links]
+
+    def link_seen(self, src, dst, now=None):
+        """src, dst: (dpid, port). Returns True if the link is new."""
+        now = time.time() if now is None else now
+        new = src not in self.links or self.links[src][:2] != list(dst)
+        self.links[src] = [dst[0], dst[1], now]
+        if new:
+            self.compute()
+        return new
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        gone = [k for k, v in self.links.items() if now - v[2] > self.link_timeout]
+        for k in gone:
+            del self.links[k]
+        if gone:
+            self.compute()
+        return gone
+
+    def compute(self):
+        # BFS from every destination over the links: next_hop[src][dst] = out port
+        adj = {}
+        for (a, port), (b, _, _) in self.links.items():
+            adj.setdefault(b, []).append((a, port))  # a reaches b through port
+        self.next_hop = {dpid: {} for dpid in self.ports}
+        for dst in self.ports:
+            seen = {dst}
+            todo = deque([dst])
+            while todo:
+                cur = todo.popleft()
+                for prev, port in sorted(adj.get(cur, ())):
+                    if prev not in seen:
+                        seen.add(prev)
+                        self.next_hop.setdefault(prev, {})[dst] = port
+                        todo.append(prev)
+
+    def port_towards(self, dpid, dst_dpid):
+        return self.next_hop.get(dpid, {}).get(dst_dpid)
@@ -0,0 +1,97 @@
+"""
+Stateless load balancing in the switch with OpenFlow SELECT groups.
+
+Each VIP service gets one OFPGT_SELECT group. The group has one bucket per
+backend (weight from b["weight"], VIP -> backend set-fields, output), and a
+single proactive flow sends the service's VIP traffic to that group. The
+switch then hashes every new connection onto a bucket itself, so connection
+setup never waits for the controller. Backend changes are pushed with
+OFPGC_MODIFY, which swaps the buckets in one message.
+"""
+
+import lb_cookie
+
+# Above the reactive per-client flows (10/20) of the LB apps
+group_flow_priority = 30
+
+
+def group_id(service_port):
+    # Group per service port; 1 for the "all VIP traffic" group of RoundRobinLB
+    return service_port or 1
+
+
+def buckets(dp, backends, virtual_mac):
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    out = []
+    for b in backends:
+        weight = int(b.get("weight", 1))
+        if weight <= 0:
+            continue
+        actions = [
+            parser.OFPActionSetField(ipv4_dst=b["ip"]),
+            parser.OFPActionSetField(eth_dst=b["mac"]),
+            parser.OFPActionSetField(eth_src=virtual_mac),
+            parser.OFPActionOutput(b["port"]),
+        ]
+        out.append(parser.OFPBucket(weight=weight, watch_port=ofproto.OFPP_ANY,
+                                    watch_group=ofproto.OFPG_ANY, actions=actions))
+    return out
+
+
+def group_mod(dp, gid, backends, virtual_mac, modify=False):
+    ofproto = dp.ofproto
+    command = ofproto.OFPGC_MODIFY if modify else ofproto.OFPGC_ADD
+    return dp.ofproto_parser.OFPGroupMod(dp, command, ofproto.OFPGT_SELECT, gid,
+                                         buckets(dp, backends, virtual_mac))
+
+
+def vip_flow_mod(dp, gid, virtual_ip, service_port=None):
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    if service_port:
+        match = parser.OFPMatch(eth_type=0x0800, ip_proto=6,
+                                ipv4_dst=virtual_ip, tcp_dst=service_port)
+    else:
+        match = parser.OFPMatch(eth_type=0x0800, ipv4_dst=virtual_ip)
+    inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                         [parser.OFPActionGroup(gid)])]
+    return parser.OFPFlowMod(datapath=dp, priority=group_flow_priority,
+                             cookie=lb_cookie.make(lb_cookie.KIND_VIP),
+                             match=match, instructions=inst)
+
+
+class SelectGroups(object):
+    """Tracks which groups each datapath has, so later syncs send MODIFY."""
+
+    def __init__(self, virtual_ip, virtual_mac):
+        self.virtual_ip = virtual_ip
+        self.virtual_mac = virtual_mac
+        self.installed = {}  # dpid -> set of group ids
+
+    def sync(self, dp, pools):
+        """
+        pools: {service_port: [backend, ...]} (service None = all VIP traffic).
+        New groups are added together with their VIP flow; existing ones are
+        modified in place.
+        """
+        if dp.id not in self.installed:
+            # Fresh connection: clear groups left over from an earlier run
+            ofproto = dp.ofproto
+            dp.send_msg(dp.ofproto_parser.OFPGroupMod(dp, ofproto.OFPGC_DELETE, ofproto.OFPGT_SELECT,
+                                                      ofproto.OFPG_ALL, []))
+        have = self.installed.setdefault(dp.id, set())
+        for service, backends in pools.items():
+            gid = group_id(service)
+            modify = gid in have
+            dp.send_msg(group_mod(dp, gid, backends, self.virtual_mac, modify))
+            if not modify:
+                dp.send_msg(vip_flow_mod(dp, gid, self.virtual_ip, service))
+                have.add(gid)
+        # Services nobody serves any more: empty the group (drops, like before)
+        for gid in have - set(group_id(s) for s in pools):
+            dp.send_msg(group_mod(dp, gid, [], self.virtual_mac, modify=True))
+
+    def forget(self, dpid):
+        # Called when a switch (re)connects or goes away, so the next sync starts from scratch
+        self.installed.pop(dpid, None)
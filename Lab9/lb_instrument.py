@@ -0,0 +1,131 @@
+"""
+Packet-in handler instrumentation for the Lab9 load balancers.
+
+Instruments keeps, per handler stage, a histogram of the time spent in it,
+counts handled events by type and samples the per-event log lines. The
+apps call it only when their `instrumentation` flag is set; with the flag
+off the handlers log every event as before and do nothing else.
+
+Stages of one packet-in, each timed from the end of the previous one:
+
+  parse     fast_parse (or the ryu parser)
+  classify  ARP/IPv4/TCP dispatch, client learning, session lookup
+  select    backend selection
+  build     building a FlowMod/PacketOut (recorded by _send, per message)
+  send      handing it to the datapath (or its flow queue)
+  total     the whole handler
+
+The histograms have fixed buckets (powers of two from 1 us), so recording
+is one bisect and two increments. Ryu runs an app's handlers one at a
+time in its event thread, so the counters need no lock; timings of sends
+made outside a packet-in (health checks, polls) are not recorded.
+
+report() is served as JSON and prometheus() as Prometheus text by
+lb_stats_rest.py.
+"""
+
+import bisect
+import time
+
+# Bucket upper bounds in seconds: 1 us .. ~131 ms, then +Inf
+BOUNDS = tuple(1e-6 * 2 ** i for i in range(18))
+
+STAGES = ("parse", "classify", "select", "build", "send", "total")
+
+
+class Histogram(object):
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return BOUNDS[i] if i < len(BOUNDS) else float("inf")
+        return float("inf")
+
+
+class Instruments(object):
+    def __init__(self, sample_every=100):
+        # Log the first event of each type, then one in sample_every
+        self.sample_every = sample_every
+        self.stages = dict((name, Histogram()) for name in STAGES)
+        self.events = {}
+        self.started = None   # handler start, None outside a packet-in
+        self.mark = None      # end of the last recorded stage
+
+    # Timing
+    def start(self):
+        self.started = self.mark = time.perf_counter()
+
+    def stage(self, name):
+        if self.mark is None:
+            return
+        now = time.perf_counter()
+        self.stages[name].record(now - self.mark)
+        self.mark = now
+
+    def finish(self):
+        if self.started is None:
+            return
+        self.stages["total"].record(time.perf_counter() - self.started)
+        self.started = self.mark = None
+
+    # Events and logs
+    def count(self, event):
+        self.events[event] = self.events.get(event, 0) + 1
+
+    def log(self, logger, event, msg, *args):
+        n = self.events.get(event, 0) + 1
+        self.events[event] = n
+        if n % self.sample_every == 1 or self.sample_every == 1:
+            logger.info(msg + " [%s #%d, 1 in %d logged]", *(args + (event, n, self.sample_every)))
+
+    def reset(self):
+        self.stages = dict((name, Histogram()) for name in STAGES)
+        self.events = {}
+
+    # Export
+    def report(self):
+        stages = {}
+        for name, h in self.stages.items():
+            stages[name] = {"count": h.count, "sum": h.sum,
+                            "mean": h.sum / h.count if h.count else None,
+                            "p50": h.quantile(0.5), "p99": h.quantile(0.99),
+                            "buckets": [[le, n] for le, n in zip(BOUNDS + ("+Inf",), h.counts) if n]}
+        return {"stages": stages, "events": dict(self.events)}
+
+    def prometheus(self, app=None):
+        """Prometheus text exposition: one histogram family, one counter family."""
+        label = 'app="%s",' % app if app else ""
+        lines = ["# HELP lb_packet_in_stage_seconds Time spent per packet-in handler stage.",
+                 "# TYPE lb_packet_in_stage_seconds histogram"]
+        for name in STAGES:
+            h = self.stages[name]
+            cumulative = 0
+            for le, n in zip(BOUNDS, h.counts):
+                cumulative += n
+                lines.append('lb_packet_in_stage_seconds_bucket{%sstage="%s",le="%g"} %d'
+                             % (label, name, le, cumulative))
+            lines.append('lb_packet_in_stage_seconds_bucket{%sstage="%s",le="+Inf"} %d' % (label, name, h.count))
+            lines.append('lb_packet_in_stage_seconds_sum{%sstage="%s"} %.9f' % (label, name, h.sum))
+            lines.append('lb_packet_in_stage_seconds_count{%sstage="%s"} %d' % (label, name, h.count))
+        lines.append("# HELP lb_events_total Packet-in events handled, by type.")
+        lines.append("# TYPE lb_events_total counter")
+        for event, n in sorted(self.events.items()):
+            lines.append('lb_events_total{%sevent="%s"} %d' % (label, event, n))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,175 @@
+"""
+Packet-in rate limiting for the Lab9 load balancers with OpenFlow 1.3 meters.
+
+The table-miss flow sends every unmatched packet to the controller, so a
+host flooding new flows (or the PACKET_IN flood of
+Lab7/Controller_Attack_and_Protect/packet_in.py) loads the controller as
+hard as it likes. Here every flow that outputs to the controller goes
+through a meter with one drop band, so the switch discards packet-ins above
+the band's rate instead of sending them:
+
+  priority 0  table-miss                      -> MISS_METER
+  priority 1  per_port: table-miss on in_port -> port_meter(in_port)
+  priority 2  ARP                             -> ARP_METER
+  priority 3  per_port: ARP on in_port        -> port_meter(in_port)
+
+With per_port, every client-facing port gets its own meter, so one noisy
+port uses up its own budget only and the other ports' ARP and first packets
+still get through. Backend ports are left on the switch-wide meters: every
+new client costs a packet-in there (the backend's first reply), so a
+per-client-port rate would throttle all clients at once. The proactive
+VIP ARP responder (lb_proactive) takes ARP_METER as well; it replies and
+notifies the controller in one flow, so the meter limits both.
+
+Meters count packets in and packets dropped by the band (meter stats),
+which poll() requests; stats_reply() keeps them per switch and report()
+gives delivered = in - dropped per meter. Open vSwitch supports meters with
+the userspace datapath and with the kernel datapath from Linux 4.15.
+"""
+
+from ryu.lib import hub
+
+import lb_cookie
+
+MISS_METER = 1
+ARP_METER = 2
+PORT_METER_BASE = 0x100
+
+miss_priority = 0
+port_miss_priority = 1
+arp_priority = 2
+port_arp_priority = 3
+
+
+def port_meter(port):
+    return PORT_METER_BASE + port
+
+
+def meter_mod(dp, meter_id, rate, burst, command=None):
+    # Packets per second, one drop band
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    return parser.OFPMeterMod(dp, command=ofproto.OFPMC_ADD if command is None else command,
+                              flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST | ofproto.OFPMF_STATS,
+                              meter_id=meter_id,
+                              bands=[parser.OFPMeterBandDrop(rate=rate, burst_size=burst)])
+
+
+def punt_flow(dp, priority, match, meter_id, max_len=None):
+    # To the controller, through meter_id; max_len with switch buffering (lb_buffering)
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    if max_len is None:
+        max_len = ofproto.OFPCML_NO_BUFFER
+    inst = [parser.OFPInstructionMeter(meter_id),
+            parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                         [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, max_len)])]
+    return parser.OFPFlowMod(datapath=dp, priority=priority, match=match, instructions=inst,
+                             cookie=lb_cookie.make(lb_cookie.KIND_PUNT))
+
+
+class PacketInMeters(object):
+    """
+    Meters and to-controller flows for one app. Rates are packet-ins per
+    second per switch (per port with per_port); burst defaults to a tenth
+    of a second's worth.
+    """
+
+    def __init__(self, rate=500, arp_rate=100, port_rate=50, burst=None, per_port=False):
+        self.rate = rate
+        self.arp_rate = arp_rate
+        self.port_rate = port_rate
+        self.burst = burst
+        self.per_port = per_port
+        self.max_len = {}  # dpid -> max_len of the to-controller actions, if the switch buffers
+        self.ports = {}  # dpid -> metered port numbers
+        self.stats = {}  # dpid -> {meter id: (packets in, packets dropped)}
+        self.poller = None
+
+    def _burst(self, rate):
+        return self.burst if self.burst is not None else max(1, rate // 10)
+
+    def sync(self, dp):
+        """
+        Replace all meters and to-controller flows of the switch with the
+        switch-wide ones. Per-port meters follow in sync_ports().
+        """
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        cookie, mask = lb_cookie.kind_match(lb_cookie.KIND_PUNT)
+        dp.send_msg(parser.OFPFlowMod(datapath=dp, command=ofproto.OFPFC_DELETE, table_id=0,
+                                      cookie=cookie, cookie_mask=mask,
+                                      out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                      match=parser.OFPMatch()))
+        dp.send_msg(parser.OFPMeterMod(dp, command=ofproto.OFPMC_DELETE, flags=0,
+                                       meter_id=ofproto.OFPM_ALL))
+        dp.send_msg(meter_mod(dp, MISS_METER, self.rate, self._burst(self.rate)))
+        dp.send_msg(meter_mod(dp, ARP_METER, self.arp_rate, self._burst(self.arp_rate)))
+        max_len = self.max_len.get(dp.id)
+        dp.send_msg(punt_flow(dp, miss_priority, parser.OFPMatch(), MISS_METER, max_len))
+        dp.send_msg(punt_flow(dp, arp_priority, parser.OFPMatch(eth_type=0x0806), ARP_METER, max_len))
+        self.ports[dp.id] = set()
+        self.stats[dp.id] = {}
+
+    def sync_ports(self, dp, ports, skip=()):
+        """
+        Per-port meters and flows for the switch's ports (per_port only),
+        except the ports in skip (backend ports).
+        """
+        if not self.per_port:
+            return
+        parser = dp.ofproto_parser
+        have = self.ports.setdefault(dp.id, set())
+        burst = self._burst(self.port_rate)
+        max_len = self.max_len.get(dp.id)
+        for port in sorted(set(ports) - have - set(skip)):
+            dp.send_msg(meter_mod(dp, port_meter(port), self.port_rate, burst))
+            dp.send_msg(punt_flow(dp, port_miss_priority, parser.OFPMatch(in_port=port), port_meter(port),
+                                  max_len))
+            dp.send_msg(punt_flow(dp, port_arp_priority, parser.OFPMatch(in_port=port, eth_type=0x0806),
+                                  port_meter(port), max_len))
+            have.add(port)
+
+    def forget(self, dpid):
+        self.ports.pop(dpid, None)
+        self.max_len.pop(dpid, None)
+        self.stats.pop(dpid, None)
+
+    # Meter stats
+    def poll(self, dp):
+        ofproto = dp.ofproto
+        dp.send_msg(dp.ofproto_parser.OFPMeterStatsRequest(dp, 0, ofproto.OFPM_ALL))
+
+    def start_polling(self, datapaths, interval=10.0):
+        # datapaths: the app's dpid -> datapath dict, read on every round
+        if self.poller is None:
+            self.poller = hub.spawn(self._poll_loop, datapaths, interval)
+
+    def _poll_loop(self, datapaths, interval):
+        while True:
+            hub.sleep(interval)
+            for dp in list(datapaths.values()):
+                self.poll(dp)
+
+    def stats_reply(self, dpid, body):
+        stats = self.stats.setdefault(dpid, {})
+        for m in body:
+            stats[m.meter_id] = (m.packet_in_count, sum(b.packet_band_count for b in m.band_stats))
+
+    def report(self, dpid):
+        """{meter id: (in, delivered, dropped)} plus totals under "all"."""
+        out = {}
+        total_in = total_dropped = 0
+        for meter_id, (packets, dropped) in sorted(self.stats.get(dpid, {}).items()):
+            out[meter_id] = (packets, packets - dropped, dropped)
+            total_in += packets
+            total_dropped += dropped
+        out["all"] = (total_in, total_in - total_dropped, total_dropped)
+        return out
+
+    def noisiest(self, dpid, n=3):
+        # Per-port meters with the most drops: [(port, dropped), ...]
+        ports = [(meter_id - PORT_METER_BASE, dropped)
+                 for meter_id, (_, dropped) in self.stats.get(dpid, {}).items()
+                 if meter_id >= PORT_METER_BASE and dropped]
+        return sorted(ports, key=lambda p: -p[1])[:n]
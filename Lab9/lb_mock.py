@@ -0,0 +1,590 @@
+"""
+Mock OpenFlow 1.3 datapaths and test frames for driving the Lab9 apps
+without Mininet or OVS (used by lb_bench.py and lb_replay.py).
+
+  MockDatapath   records what the app sends, like ryu's Datapath would
+  MockSwitch     a small switch model behind it: flow tables, groups,
+                 meters, packet buffers, timeouts on a virtual clock
+  MockFabric     MockSwitches wired as a leaf-spine fabric
+
+event_handlers() finds the app's @set_ev_cls handlers, packet_in_event()
+wraps a frame as a PACKET_IN, and client_addr(), arp_request(),
+arp_reply() and tcp_segment() build the frames.
+"""
+
+import socket
+import struct
+import zlib
+from collections import OrderedDict
+
+from ryu.lib.packet import packet, ethernet, arp, ipv4, tcp, ether_types
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+from ryu.controller import ofp_event
+
+import fast_parse
+
+VIP = "10.0.0.100"
+VIP_MAC = "00:00:00:00:ff:ff"
+
+
+class MockDatapath(object):
+    """
+    Stands in for ryu's Datapath: same ofproto modules, records what the
+    app sends. send() takes serialized batches like the real one; the
+    messages in them are found again by xid (set_xid remembers them).
+    `writes` counts socket writes: one per send_msg() or send().
+    """
+
+    def __init__(self, dpid=1):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.sent = []
+        self.xid = 0
+        self.by_xid = {}
+        self.writes = 0
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        self.by_xid[self.xid] = msg
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        self.by_xid.pop(msg.xid, None)
+        self.writes += 1
+        self._deliver(msg)
+
+    def send(self, buf):
+        self.writes += 1
+        off = 0
+        while off < len(buf):
+            length, xid = struct.unpack_from("!2xHI", buf, off)
+            self._deliver(self.by_xid.pop(xid))
+            off += length
+
+    def _deliver(self, msg):
+        self.sent.append(msg)
+
+    def clear(self):
+        del self.sent[:]
+
+
+def _ip_int(value):
+    return struct.unpack("!I", socket.inet_aton(value))[0]
+
+
+def _field_matches(have, want):
+    # want is a value or (value, mask) as ryu's OFPMatch stores masked fields
+    if have is None:
+        return False
+    if isinstance(want, tuple):
+        value, mask = want
+        if isinstance(value, str):
+            return _ip_int(have) & _ip_int(mask) == _ip_int(value) & _ip_int(mask)
+        return have & mask == value & mask
+    return have == want
+
+
+def _mac(raw):
+    return ":".join("%02x" % b for b in raw)
+
+
+def packet_fields(in_port, data):
+    # OXM-style view of a frame for flow matching, from fast_parse
+    h = fast_parse.parse(data)
+    f = {"in_port": in_port, "eth_src": h.eth_src, "eth_dst": h.eth_dst, "eth_type": h.ethertype}
+    if h.arp_op is not None:
+        off = 14 if h.vlan is None else 18  # untagged or one tag
+        f.update(arp_op=h.arp_op, arp_spa=h.arp_src_ip, arp_tpa=h.arp_dst_ip,
+                 arp_sha=_mac(data[off + 8:off + 14]), arp_tha=_mac(data[off + 18:off + 24]))
+    if h.ip_src is not None:
+        f.update(ipv4_src=h.ip_src, ipv4_dst=h.ip_dst, ip_proto=h.ip_proto)
+        if h.ip_proto == 6 and h.src_port is not None:
+            f.update(tcp_src=h.src_port, tcp_dst=h.dst_port, tcp_flags=h.tcp_flags)
+    return f
+
+
+class _Flow(object):
+    __slots__ = ("table_id", "priority", "match", "instructions", "cookie", "idle_timeout",
+                 "hard_timeout", "flags", "installed", "last_used", "packets", "bytes")
+
+
+class _Shape(object):
+    # All flows of one priority that match on the same set of fields
+    __slots__ = ("priority", "fields", "exact", "masked")
+
+    def __init__(self, priority, fields):
+        self.priority = priority
+        self.fields = fields
+        self.exact = {}    # tuple of values -> _Flow
+        self.masked = []   # flows with a masked field, checked one by one
+
+
+class MockSwitch(MockDatapath):
+    """
+    A small OpenFlow 1.3 switch model behind MockDatapath. It keeps the flow
+    tables and groups the app programs and matches injected frames against
+    them (tuple-space lookup: one dict probe per distinct match shape). It
+    runs SELECT groups with a 5-tuple hash, hands table misses to the app
+    as PACKET_INs (through token-bucket meters where a flow has one) and
+    records where every packet, PacketOuts included, leaves. Idle/hard
+    timeouts follow a virtual clock moved by advance(), and FlowRemoved
+    and flow-stats replies go back to the app's handlers.
+    With n_buffers, to-controller outputs with a max_len keep the packet
+    and send up only max_len bytes; FlowMods and PacketOuts release it by
+    buffer_id. With measure_bytes, the bytes crossing the control channel
+    are counted each way.
+    """
+
+    def __init__(self, app, dpid=1):
+        super(MockSwitch, self).__init__(dpid)
+        self.app = app
+        self.handlers = event_handlers(app)
+        self.now = 0.0
+        self.tables = {}   # table id -> [_Shape, ...] by descending priority
+        self.groups = {}   # group id -> (type, buckets)
+        self.meters = {}   # meter id -> [rate, burst, tokens, last refill, packets in, dropped]
+        self.delivered = []
+        # Table of the flow being run, reported in packet-ins
+        self.table_id = 0
+        # Hold barrier replies until release_barriers(), like a busy switch
+        self.hold_barriers = False
+        self.held = []
+        # Port numbers for port-desc replies, and port -> (peer switch, peer port)
+        self.ports = []
+        self.links = {}
+        # Packet buffers: buffer id -> (in_port, frame), oldest first
+        self.n_buffers = 0
+        self.buffers = OrderedDict()
+        self.next_buffer = 1
+        self.miss_send_len = None
+        self.measure_bytes = False
+        self.counters = {"packet_in": 0, "flow_mod": 0, "group_mod": 0, "packet_out": 0,
+                         "forwarded": 0, "dropped": 0, "flow_removed": 0, "metered": 0,
+                         "bytes_up": 0, "bytes_down": 0, "buffered": 0}
+
+    def connect(self):
+        msg = self.ofproto_parser.OFPSwitchFeatures(self, datapath_id=self.id, n_buffers=self.n_buffers)
+        self.dispatch(ofp_event.EventOFPSwitchFeatures(msg))
+
+    def dispatch(self, ev):
+        for handler in self.handlers.get(ev.__class__, ()):
+            handler(ev)
+
+    def flows(self, table_id=None):
+        for tid, shapes in self.tables.items():
+            if table_id is not None and tid != table_id:
+                continue
+            for shape in shapes:
+                for f in list(shape.exact.values()) + shape.masked:
+                    yield f
+
+    def flow_count(self):
+        return sum(len(sh.exact) + len(sh.masked) for shapes in self.tables.values() for sh in shapes)
+
+    # -- control channel ---------------------------------------------------
+    def _deliver(self, msg):
+        super(MockSwitch, self)._deliver(msg)
+        parser = self.ofproto_parser
+        if self.measure_bytes:
+            if msg.buf is None:
+                msg.serialize()
+            self.counters["bytes_down"] += len(msg.buf)
+        if isinstance(msg, parser.OFPFlowMod):
+            self.counters["flow_mod"] += 1
+            self._flow_mod(msg)
+            if msg.buffer_id != self.ofproto.OFP_NO_BUFFER:
+                self._release(msg.buffer_id, [parser.OFPActionOutput(self.ofproto.OFPP_TABLE)])
+        elif isinstance(msg, parser.OFPGroupMod):
+            self.counters["group_mod"] += 1
+            self._group_mod(msg)
+        elif isinstance(msg, parser.OFPPacketOut):
+            self.counters["packet_out"] += 1
+            if msg.buffer_id != self.ofproto.OFP_NO_BUFFER:
+                self._release(msg.buffer_id, msg.actions)
+            else:
+                fields = packet_fields(msg.in_port, msg.data)
+                self._apply(fields, msg.actions, msg.data)
+        elif isinstance(msg, parser.OFPSetConfig):
+            self.miss_send_len = msg.miss_send_len
+        elif isinstance(msg, parser.OFPFlowStatsRequest):
+            self._flow_stats(msg)
+        elif isinstance(msg, parser.OFPMeterMod):
+            self._meter_mod(msg)
+        elif isinstance(msg, parser.OFPMeterStatsRequest):
+            body = [parser.OFPMeterStats(meter_id=mid, flow_count=0, packet_in_count=m[4], byte_in_count=0,
+                                         duration_sec=0, duration_nsec=0,
+                                         band_stats=[parser.OFPMeterBandStats(packet_band_count=m[5],
+                                                                              byte_band_count=0)])
+                    for mid, m in sorted(self.meters.items())]
+            reply = parser.OFPMeterStatsReply(self, type_=self.ofproto.OFPMP_METER, flags=0, body=body)
+            reply.xid = msg.xid
+            self.dispatch(ofp_event.EventOFPMeterStatsReply(reply))
+        elif isinstance(msg, parser.OFPPortDescStatsRequest):
+            body = [parser.OFPPort(port_no=p, hw_addr="00:00:00:00:00:00", name=b"p%d" % p, config=0, state=0,
+                                   curr=0, advertised=0, supported=0, peer=0, curr_speed=0, max_speed=0)
+                    for p in self.ports]
+            reply = parser.OFPPortDescStatsReply(self, type_=self.ofproto.OFPMP_PORT_DESC, flags=0, body=body)
+            reply.xid = msg.xid
+            self.dispatch(ofp_event.EventOFPPortDescStatsReply(reply))
+        elif isinstance(msg, parser.OFPBarrierRequest):
+            reply = parser.OFPBarrierReply(self)
+            reply.xid = msg.xid
+            self.held.append(ofp_event.EventOFPBarrierReply(reply))
+            if not self.hold_barriers:
+                self.release_barriers()
+
+    def _release(self, buffer_id, actions):
+        # A buffered packet, through actions (OFPP_TABLE: the pipeline)
+        buffered = self.buffers.pop(buffer_id, None)
+        if buffered is None:
+            self.counters["dropped"] += 1
+            return
+        in_port, data = buffered
+        if len(actions) == 1 and getattr(actions[0], "port", None) == self.ofproto.OFPP_TABLE:
+            self.inject(in_port, data)
+        else:
+            self._apply(packet_fields(in_port, data), actions, data)
+
+    def _packet_in(self, in_port, data, max_len, table_id=0):
+        ofp = self.ofproto
+        buffer_id = ofp.OFP_NO_BUFFER
+        sent = data
+        if self.n_buffers and max_len != ofp.OFPCML_NO_BUFFER:
+            if len(self.buffers) >= self.n_buffers:
+                self.buffers.popitem(last=False)
+            buffer_id = self.next_buffer
+            self.next_buffer = self.next_buffer % 0xfffffff0 + 1
+            self.buffers[buffer_id] = (in_port, data)
+            self.counters["buffered"] += 1
+            sent = data[:max_len]
+        if self.measure_bytes:
+            # ofp_packet_in: 24 fixed + in_port match padded to 16 + 2 pad + data
+            self.counters["bytes_up"] += 42 + len(sent)
+        self.counters["packet_in"] += 1
+        self.dispatch(packet_in_event(self, in_port, sent, buffer_id, len(data), table_id))
+
+    def release_barriers(self):
+        held, self.held = self.held, []
+        for ev in held:
+            self.dispatch(ev)
+
+    def _shape(self, table_id, priority, fields, create=False):
+        shapes = self.tables.setdefault(table_id, [])
+        for sh in shapes:
+            if sh.priority == priority and sh.fields == fields:
+                return sh
+        if not create:
+            return None
+        sh = _Shape(priority, fields)
+        shapes.append(sh)
+        shapes.sort(key=lambda x: -x.priority)
+        return sh
+
+    def _flow_mod(self, msg):
+        ofp = self.ofproto
+        items = dict(msg.match.items())
+        fields = tuple(sorted(items))
+        if msg.command in (ofp.OFPFC_ADD, ofp.OFPFC_MODIFY, ofp.OFPFC_MODIFY_STRICT):
+            sh = self._shape(msg.table_id, msg.priority, fields, create=True)
+            f = _Flow()
+            f.table_id, f.priority, f.match, f.instructions = msg.table_id, msg.priority, items, msg.instructions
+            f.cookie, f.idle_timeout = msg.cookie, msg.idle_timeout
+            f.hard_timeout, f.flags = msg.hard_timeout, msg.flags
+            f.installed = f.last_used = self.now
+            f.packets = f.bytes = 0
+            if any(isinstance(v, tuple) for v in items.values()):
+                sh.masked = [g for g in sh.masked if g.match != items] + [f]
+            else:
+                sh.exact[tuple(items[k] for k in fields)] = f
+        elif msg.command in (ofp.OFPFC_DELETE, ofp.OFPFC_DELETE_STRICT):
+            strict = msg.command == ofp.OFPFC_DELETE_STRICT
+            for f in list(self.flows(None if msg.table_id == ofp.OFPTT_ALL else msg.table_id)):
+                if (f.cookie & msg.cookie_mask) != (msg.cookie & msg.cookie_mask):
+                    continue
+                if strict and (f.match != items or f.priority != msg.priority):
+                    continue
+                if not strict and any(f.match.get(k) != v for k, v in items.items()):
+                    continue
+                self._remove(f, ofp.OFPRR_DELETE)
+
+    def _remove(self, f, reason):
+        sh = self._shape(f.table_id, f.priority, tuple(sorted(f.match)))
+        key = tuple(f.match[k] for k in sh.fields)
+        if sh.exact.get(key) is f:
+            del sh.exact[key]
+        elif f in sh.masked:
+            sh.masked.remove(f)
+        if f.flags & self.ofproto.OFPFF_SEND_FLOW_REM:
+            self.counters["flow_removed"] += 1
+            msg = self.ofproto_parser.OFPFlowRemoved(
+                self, cookie=f.cookie, priority=f.priority, reason=reason, table_id=f.table_id,
+                duration_sec=int(self.now - f.installed), duration_nsec=0,
+                idle_timeout=f.idle_timeout, hard_timeout=f.hard_timeout,
+                packet_count=f.packets, byte_count=f.bytes,
+                match=self.ofproto_parser.OFPMatch(**f.match))
+            self.dispatch(ofp_event.EventOFPFlowRemoved(msg))
+
+    def _flow_stats(self, req):
+        parser = self.ofproto_parser
+        body = []
+        for f in self.flows(None if req.table_id == self.ofproto.OFPTT_ALL else req.table_id):
+            if (f.cookie & req.cookie_mask) != (req.cookie & req.cookie_mask):
+                continue
+            body.append(parser.OFPFlowStats(
+                table_id=f.table_id, duration_sec=int(self.now - f.installed), duration_nsec=0,
+                priority=f.priority, idle_timeout=f.idle_timeout, hard_timeout=f.hard_timeout,
+                flags=f.flags, cookie=f.cookie, packet_count=f.packets, byte_count=f.bytes,
+                match=parser.OFPMatch(**f.match), instructions=f.instructions))
+        reply = parser.OFPFlowStatsReply(self, type_=self.ofproto.OFPMP_FLOW, flags=0, body=body)
+        reply.xid = req.xid
+        self.dispatch(ofp_event.EventOFPFlowStatsReply(reply))
+
+    def _group_mod(self, msg):
+        ofp = self.ofproto
+        if msg.command == ofp.OFPGC_DELETE:
+            if msg.group_id == ofp.OFPG_ALL:
+                self.groups.clear()
+            else:
+                self.groups.pop(msg.group_id, None)
+        else:
+            self.groups[msg.group_id] = (msg.type, msg.buckets)
+
+    def _meter_mod(self, msg):
+        ofp = self.ofproto
+        if msg.command == ofp.OFPMC_DELETE:
+            if msg.meter_id == ofp.OFPM_ALL:
+                self.meters.clear()
+            else:
+                self.meters.pop(msg.meter_id, None)
+            return
+        band = msg.bands[0]  # one drop band, packets per second
+        self.meters[msg.meter_id] = [band.rate, band.burst_size, float(band.burst_size), self.now, 0, 0]
+
+    def _meter(self, meter_id):
+        # Token bucket on the virtual clock; False if the band drops the packet
+        m = self.meters.get(meter_id)
+        if m is None:
+            return True
+        m[2] = min(m[1], m[2] + (self.now - m[3]) * m[0])
+        m[3] = self.now
+        m[4] += 1
+        if m[2] < 1:
+            m[5] += 1
+            return False
+        m[2] -= 1
+        return True
+
+    def advance(self, seconds):
+        # Move the virtual clock and expire flows on idle/hard timeout
+        self.now += seconds
+        for f in list(self.flows()):
+            if f.hard_timeout and self.now - f.installed >= f.hard_timeout:
+                self._remove(f, self.ofproto.OFPRR_HARD_TIMEOUT)
+            elif f.idle_timeout and self.now - f.last_used >= f.idle_timeout:
+                self._remove(f, self.ofproto.OFPRR_IDLE_TIMEOUT)
+
+    # -- data plane --------------------------------------------------------
+    def lookup(self, fields, table_id=0):
+        for sh in self.tables.get(table_id, ()):
+            f = sh.exact.get(tuple(fields.get(k) for k in sh.fields)) if sh.exact else None
+            if f is None:
+                for g in sh.masked:
+                    if all(_field_matches(fields.get(k), v) for k, v in g.match.items()):
+                        f = g
+                        break
+            if f is not None:
+                return f
+        return None
+
+    def inject(self, in_port, data):
+        """Send a frame into the switch; returns [(out_port, fields), ...] it produced."""
+        start = len(self.delivered)
+        fields = packet_fields(in_port, data)
+        table_id = 0
+        while True:
+            f = self.lookup(fields, table_id)
+            if f is None:
+                self.counters["dropped"] += 1
+                break
+            self.table_id = table_id
+            f.last_used = self.now
+            f.packets += 1
+            f.bytes += len(data)
+            goto = None
+            for i in f.instructions:
+                if isinstance(i, self.ofproto_parser.OFPInstructionMeter):
+                    if not self._meter(i.meter_id):
+                        self.counters["metered"] += 1
+                        break
+                elif isinstance(i, self.ofproto_parser.OFPInstructionActions):
+                    fields = self._apply(fields, i.actions, data)
+                elif isinstance(i, self.ofproto_parser.OFPInstructionGotoTable):
+                    goto = i.table_id
+            if goto is None:
+                break
+            table_id = goto
+        self.table_id = 0
+        return self.delivered[start:]
+
+    def _apply(self, fields, actions, data):
+        ofp = self.ofproto
+        parser = self.ofproto_parser
+        fields = dict(fields)
+        for a in actions:
+            if isinstance(a, parser.OFPActionSetField):
+                fields[a.key] = a.value
+            elif isinstance(a, parser.NXActionRegMove):
+                # Whole-field moves only, as the LB apps use them
+                fields[a.dst_field] = fields.get(a.src_field)
+            elif isinstance(a, parser.OFPActionGroup):
+                self._group(fields, a.group_id, data)
+            elif isinstance(a, parser.OFPActionOutput):
+                if a.port == ofp.OFPP_CONTROLLER:
+                    if self.table_id:
+                        # Sent up as rewritten by the earlier tables
+                        self._packet_in(fields["in_port"], frame_from_fields(fields, data), a.max_len,
+                                        self.table_id)
+                    else:
+                        self._packet_in(fields["in_port"], data, a.max_len)
+                else:
+                    self.counters["forwarded"] += 1
+                    port = fields["in_port"] if a.port == ofp.OFPP_IN_PORT else a.port
+                    if port in self.links:
+                        peer, peer_port = self.links[port]
+                        peer.inject(peer_port, frame_from_fields(fields, data))
+                    else:
+                        self.delivered.append((port, dict(fields)))
+        return fields
+
+    def _group(self, fields, gid, data):
+        gtype, buckets = self.groups.get(gid, (None, []))
+        live = [b for b in buckets if b.weight > 0] if gtype == self.ofproto.OFPGT_SELECT else buckets
+        if not live:
+            self.counters["dropped"] += 1
+            return
+        if gtype == self.ofproto.OFPGT_SELECT:
+            key = "%s %s %s %s" % (fields.get("ipv4_src"), fields.get("ipv4_dst"),
+                                   fields.get("tcp_src"), fields.get("tcp_dst"))
+            h = zlib.crc32(key.encode()) % sum(b.weight for b in live)
+            for b in live:
+                if h < b.weight:
+                    break
+                h -= b.weight
+            live = [b]
+        for b in live:
+            self._apply(fields, b.actions, data)
+
+
+def frame_from_fields(fields, data):
+    # The frame as it leaves the switch, after set-field and reg_move rewrites
+    if fields.get("arp_op") is not None:
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_ARP,
+                                           dst=fields["eth_dst"], src=fields["eth_src"]))
+        pkt.add_protocol(arp.arp(opcode=fields["arp_op"], src_mac=fields["arp_sha"], src_ip=fields["arp_spa"],
+                                 dst_mac=fields["arp_tha"], dst_ip=fields["arp_tpa"]))
+        pkt.serialize()
+        return bytes(pkt.data)
+    if fields.get("tcp_src") is not None:
+        return tcp_segment(fields["eth_src"], fields["eth_dst"], fields["ipv4_src"], fields["ipv4_dst"],
+                           fields["tcp_src"], fields["tcp_dst"], fields.get("tcp_flags", 0))
+    return data
+
+
+class MockFabric(object):
+    """
+    Leaf-spine fabric of MockSwitches behind one app. Leaf l (dpid l) port s
+    goes to spine s (dpid leaves + s) port l; hosts use leaf ports from
+    spines + 1 up.
+    """
+
+    def __init__(self, app, leaves, spines, host_ports=64):
+        self.leaves = list(range(1, leaves + 1))
+        self.spines = list(range(leaves + 1, leaves + spines + 1))
+        self.switches = {d: MockSwitch(app, dpid=d) for d in self.leaves + self.spines}
+        for l in self.leaves:
+            self.switches[l].ports = list(range(1, spines + host_ports + 1))
+        for i, s in enumerate(self.spines, 1):
+            self.switches[s].ports = list(self.leaves)
+            for l in self.leaves:
+                self.switches[l].links[i] = (self.switches[s], l)
+                self.switches[s].links[l] = (self.switches[l], i)
+        self.first_host_port = spines + 1
+
+    def connect(self):
+        for sw in self.switches.values():
+            sw.connect()
+
+    def inject(self, dpid, port, data):
+        # Returns [(dpid, port, fields)] for every edge port the frame reached
+        marks = {d: len(sw.delivered) for d, sw in self.switches.items()}
+        self.switches[dpid].inject(port, data)
+        return [(d, p, f) for d, sw in self.switches.items() for p, f in sw.delivered[marks[d]:]]
+
+    def counter(self, name):
+        return sum(sw.counters[name] for sw in self.switches.values())
+
+
+def event_handlers(app):
+    # {event class: [bound handler, ...]} from the app's @set_ev_cls methods
+    handlers = {}
+    for name in dir(type(app)):
+        method = getattr(app, name, None)
+        for ev_cls in getattr(method, "callers", {}):
+            handlers.setdefault(ev_cls, []).append(method)
+    return handlers
+
+
+def packet_in_event(dp, in_port, data, buffer_id=None, total_len=None, table_id=0):
+    parser = dp.ofproto_parser
+    if buffer_id is None:
+        buffer_id = dp.ofproto.OFP_NO_BUFFER
+    msg = parser.OFPPacketIn(dp, buffer_id=buffer_id, total_len=len(data) if total_len is None else total_len,
+                             reason=dp.ofproto.OFPR_NO_MATCH, table_id=table_id, cookie=0,
+                             match=parser.OFPMatch(in_port=in_port), data=data)
+    return ofp_event.EventOFPPacketIn(msg)
+
+
+# -------------------------------------------------------------------------
+# Frames
+# -------------------------------------------------------------------------
+def client_addr(i):
+    # Clients 10.0.1.0 upwards, one switch port each from port 4
+    return ("10.0.%d.%d" % (1 + i // 250, i % 250 + 1),
+            "02:00:00:%02x:%02x:%02x" % ((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff),
+            4 + i % 60)
+
+
+def arp_request(src_mac, src_ip, dst_ip):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_ARP,
+                                       dst="ff:ff:ff:ff:ff:ff", src=src_mac))
+    pkt.add_protocol(arp.arp(opcode=arp.ARP_REQUEST, src_mac=src_mac, src_ip=src_ip,
+                             dst_mac="00:00:00:00:00:00", dst_ip=dst_ip))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def arp_reply(src_mac, src_ip, dst_mac, dst_ip):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_ARP, dst=dst_mac, src=src_mac))
+    pkt.add_protocol(arp.arp(opcode=arp.ARP_REPLY, src_mac=src_mac, src_ip=src_ip,
+                             dst_mac=dst_mac, dst_ip=dst_ip))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def tcp_segment(src_mac, dst_mac, src_ip, dst_ip, src_port, dst_port, bits, payload=b""):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_IP,
+                                       dst=dst_mac, src=src_mac))
+    pkt.add_protocol(ipv4.ipv4(src=src_ip, dst=dst_ip, proto=6))
+    pkt.add_protocol(tcp.tcp(src_port=src_port, dst_port=dst_port, bits=bits))
+    if payload:
+        pkt.add_protocol(payload)
+    pkt.serialize()
+    return bytes(pkt.data)
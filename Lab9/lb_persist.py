@@ -0,0 +1,165 @@
+"""
+Warm restart for the Lab9 load balancers.
+
+When the controller restarts, the switches keep the LB flows but the app
+forgets its sessions, its clients and the round-robin counters: new
+connections may land on other backends, and backend replies to clients it
+no longer knows are dropped until every client ARPs again. Two sources
+bring the state back:
+
+  StateStore  a sqlite file. Every change is appended to a log table
+              (flushed about once a second, one transaction per flush); once
+              the log holds compact_every rows, the current state is
+              written to a snapshot table and the log emptied. Loading reads
+              the snapshot and then replays the log.
+  flow dump   when a switch connects, one flow-stats request for all LB
+              flows (lb_cookie.lb_match()). Session flows carry the session
+              id and backend index in their cookie and the client and
+              service in their match; reverse and delivery flows carry the
+              client's MAC and port in their actions. The switch is the
+              authority: stored sessions without a flow are dropped, and
+              flows the store missed are restored from the flow alone.
+
+The store needs the controller to keep running against the same file; the
+flow dump needs switches that keep their flows while the controller is
+away (fail_mode=secure on Open vSwitch).
+"""
+
+import json
+import sqlite3
+
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+
+import flow_budget
+import lb_cookie
+
+
+class StateStore(object):
+    """
+    Key/value state by kind ("session", "client", "rr"): put() and
+    delete() change the in-memory copy at once and reach the file at the
+    next flush().
+    """
+
+    def __init__(self, path, compact_every=5000):
+        self.path = path
+        self.compact_every = compact_every
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS snapshot "
+                        "(kind TEXT, key TEXT, value TEXT, PRIMARY KEY (kind, key))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS log "
+                        "(seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, key TEXT, value TEXT)")
+        self.db.commit()
+        self.state = {}
+        self.pending = []
+        self.logged = 0
+        self.flusher = None
+        self._load()
+
+    def _load(self):
+        for kind, key, value in self.db.execute("SELECT kind, key, value FROM snapshot"):
+            self.state.setdefault(kind, {})[key] = json.loads(value)
+        for kind, key, value in self.db.execute("SELECT kind, key, value FROM log ORDER BY seq"):
+            self.logged += 1
+            if value is None:
+                self.state.get(kind, {}).pop(key, None)
+            else:
+                self.state.setdefault(kind, {})[key] = json.loads(value)
+
+    def get(self, kind):
+        return self.state.get(kind, {})
+
+    def put(self, kind, key, value):
+        key = str(key)
+        self.state.setdefault(kind, {})[key] = value
+        self.pending.append((kind, key, json.dumps(value)))
+
+    def delete(self, kind, key):
+        key = str(key)
+        if self.state.get(kind, {}).pop(key, None) is not None:
+            self.pending.append((kind, key, None))
+
+    def flush(self):
+        if self.pending:
+            pending, self.pending = self.pending, []
+            with self.db:
+                self.db.executemany("INSERT INTO log (kind, key, value) VALUES (?, ?, ?)", pending)
+            self.logged += len(pending)
+        if self.logged >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        # Snapshot = current state, log emptied, in one transaction
+        rows = [(kind, key, json.dumps(value)) for kind, entries in self.state.items()
+                for key, value in entries.items()]
+        with self.db:
+            self.db.execute("DELETE FROM snapshot")
+            self.db.executemany("INSERT INTO snapshot (kind, key, value) VALUES (?, ?, ?)", rows)
+            self.db.execute("DELETE FROM log")
+        self.logged = 0
+
+    def start(self, interval=1.0):
+        if self.flusher is None:
+            self.flusher = hub.spawn(self._flush_loop, interval)
+
+    def _flush_loop(self, interval):
+        while True:
+            hub.sleep(interval)
+            self.flush()
+
+    def close(self):
+        if self.flusher is not None:
+            hub.kill(self.flusher)
+            self.flusher = None
+        self.flush()
+        self.db.close()
+
+
+# Flow dump
+def request_flow_dump(dp):
+    # All LB flows of the switch, every table; returns the request's xid
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    cookie, mask = lb_cookie.lb_match()
+    req = parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                     cookie, mask, parser.OFPMatch())
+    dp.set_xid(req)
+    dp.send_msg(req)
+    return req.xid
+
+
+def session_from_flow(stat):
+    """(session id, backend index, client key, service port) of a session flow, else None."""
+    c = lb_cookie.decode(stat.cookie)
+    if c is None or c.kind != lb_cookie.KIND_SESSION or not c.session:
+        return None
+    fields = dict(stat.match.items())
+    src = fields.get("ipv4_src")
+    if isinstance(src, tuple):
+        key = flow_budget.session_key("prefix24", src[0], None)
+    elif "tcp_src" in fields:
+        key = flow_budget.session_key("5tuple", src, fields["tcp_src"])
+    else:
+        key = src
+    return c.session, c.backend, key, fields.get("tcp_dst")
+
+
+def client_from_flow(stat):
+    """(client ip, mac, port) from a per-client reverse or delivery flow, else None."""
+    c = lb_cookie.decode(stat.cookie)
+    if c is None or c.kind not in (lb_cookie.KIND_REVERSE, lb_cookie.KIND_CLIENT):
+        return None
+    ip = dict(stat.match.items()).get("ipv4_dst")
+    mac = port = None
+    for inst in stat.instructions:
+        for action in getattr(inst, "actions", ()):
+            if action.type == ofproto_v1_3.OFPAT_SET_FIELD and action.key == "eth_dst":
+                mac = action.value
+            elif action.type == ofproto_v1_3.OFPAT_OUTPUT:
+                port = action.port
+    if ip is None or mac is None or port is None:
+        return None
+    return ip, mac, port
@@ -0,0 +1,189 @@
+"""
+Proactive ARP answering and return-path flows for the Lab9 load balancers.
+
+In reactive mode every client ARP for the VIP, every backend ARP for a
+client and the first reply packet of every backend -> client pair reach the
+controller. This module installs the same behaviour in the switch when it
+connects:
+
+  table 0  ARP request for the VIP     -> copy to the controller (so the app
+                                          still learns the client), then turn
+                                          the request into the reply in place
+                                          and send it back out of IN_PORT
+  table 0  ARP request for a known     -> answered with the client's MAC, as
+           client                         the reactive app does; other ARP
+                                          requests are left to the table-miss
+  table 0  IPv4 from a backend         -> source rewritten to the VIP, then
+                                          goto table 1
+  table 1  IPv4 to a known client      -> destination MAC, output port
+  table 1  anything else (miss)        -> controller, which re-adds the
+                                          client's delivery flow (it idles
+                                          out) and forwards the packet
+
+The ARP rewrites copy one field into another, which plain OpenFlow 1.3
+set-field cannot do, so they use the Nicira reg_move action (Open vSwitch).
+Only the client ARP responder and the table 1 entry are per client, and
+they are installed when the client's ARP copy arrives: one packet-in per
+new client, none per backend.
+"""
+
+import lb_cookie
+
+# ARP responders sit above everything else in table 0
+arp_priority = 100
+# Backend -> client rewrite, above the reactive flows (10/20)
+reverse_priority = 25
+# Per-client delivery flows after the reverse rewrite
+delivery_table = 1
+
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+
+def _flow_mod(dp, priority, match, actions, cookie, table_id=0, goto=None, idle_timeout=0, meter=None):
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+    if meter is not None:
+        inst.insert(0, parser.OFPInstructionMeter(meter))
+    if goto is not None:
+        inst.append(parser.OFPInstructionGotoTable(goto))
+    return parser.OFPFlowMod(datapath=dp, table_id=table_id, priority=priority, match=match,
+                             instructions=inst, cookie=cookie, idle_timeout=idle_timeout)
+
+
+def _move(parser, src, dst, bits):
+    return parser.NXActionRegMove(src_field=src, dst_field=dst, n_bits=bits)
+
+
+def vip_arp_responder(dp, virtual_ip, virtual_mac, notify=True, meter=None):
+    # "Who has VIP?" -> "VIP is at virtual_mac", built from the request itself.
+    # meter limits the whole flow, reply and controller copy alike (lb_meters).
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    actions = []
+    if notify:
+        # Before the rewrite, so the controller sees the original request
+        actions.append(parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER))
+    actions += [
+        _move(parser, "eth_src", "eth_dst", 48),
+        parser.OFPActionSetField(eth_src=virtual_mac),
+        parser.OFPActionSetField(arp_op=ARP_REPLY),
+        _move(parser, "arp_sha", "arp_tha", 48),
+        _move(parser, "arp_spa", "arp_tpa", 32),
+        parser.OFPActionSetField(arp_sha=virtual_mac),
+        parser.OFPActionSetField(arp_spa=virtual_ip),
+        parser.OFPActionOutput(ofproto.OFPP_IN_PORT),
+    ]
+    match = parser.OFPMatch(eth_type=0x0806, arp_op=ARP_REQUEST, arp_tpa=virtual_ip)
+    return _flow_mod(dp, arp_priority, match, actions, lb_cookie.make(lb_cookie.KIND_ARP), meter=meter)
+
+
+def client_arp_responder(dp, client_ip, client_mac, idle_timeout=0):
+    # "Who has client_ip?" (a backend answering it) -> "client_ip is at
+    # client_mac". Requests for any other address still reach the table-miss.
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    actions = [
+        _move(parser, "eth_src", "eth_dst", 48),
+        parser.OFPActionSetField(eth_src=client_mac),
+        parser.OFPActionSetField(arp_op=ARP_REPLY),
+        _move(parser, "arp_sha", "arp_tha", 48),
+        _move(parser, "arp_spa", "arp_tpa", 32),
+        parser.OFPActionSetField(arp_sha=client_mac),
+        parser.OFPActionSetField(arp_spa=client_ip),
+        parser.OFPActionOutput(ofproto.OFPP_IN_PORT),
+    ]
+    match = parser.OFPMatch(eth_type=0x0806, arp_op=ARP_REQUEST, arp_tpa=client_ip)
+    return _flow_mod(dp, arp_priority, match, actions, lb_cookie.make(lb_cookie.KIND_CLIENT),
+                     idle_timeout=idle_timeout)
+
+
+def reverse_flow(dp, backend_ip, virtual_ip, virtual_mac, backend=None, ip_proto=None):
+    # Backend -> any client: source back to the VIP, delivery in table 1
+    parser = dp.ofproto_parser
+    if ip_proto:
+        match = parser.OFPMatch(eth_type=0x0800, ip_proto=ip_proto, ipv4_src=backend_ip)
+    else:
+        match = parser.OFPMatch(eth_type=0x0800, ipv4_src=backend_ip)
+    actions = [
+        parser.OFPActionSetField(ipv4_src=virtual_ip),
+        parser.OFPActionSetField(eth_src=virtual_mac),
+    ]
+    return _flow_mod(dp, reverse_priority, match, actions,
+                     lb_cookie.make(lb_cookie.KIND_REVERSE, backend), goto=delivery_table)
+
+
+def delivery_actions(dp, client_mac, port):
+    parser = dp.ofproto_parser
+    return [
+        parser.OFPActionSetField(eth_dst=client_mac),
+        parser.OFPActionOutput(port),
+    ]
+
+
+def delivery_flow(dp, client_ip, client_mac, port, idle_timeout=0):
+    parser = dp.ofproto_parser
+    match = parser.OFPMatch(eth_type=0x0800, ipv4_dst=client_ip)
+    return _flow_mod(dp, 10, match, delivery_actions(dp, client_mac, port), lb_cookie.make(lb_cookie.KIND_CLIENT),
+                     table_id=delivery_table, idle_timeout=idle_timeout)
+
+
+def delivery_miss(dp, max_len=None):
+    # Table 1 miss: a reply for a client without a delivery flow goes up
+    parser = dp.ofproto_parser
+    ofproto = dp.ofproto
+    if max_len is None:
+        max_len = ofproto.OFPCML_NO_BUFFER
+    actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, max_len)]
+    return _flow_mod(dp, 0, parser.OFPMatch(), actions, lb_cookie.make(lb_cookie.KIND_PUNT),
+                     table_id=delivery_table)
+
+
+class ProactiveFlows(object):
+    """
+    Installs and refreshes the proactive flows of one VIP. ip_proto limits
+    the reverse rewrite to one protocol (6 for the L4 app).
+    """
+
+    def __init__(self, virtual_ip, virtual_mac, ip_proto=None, client_idle_timeout=300):
+        self.virtual_ip = virtual_ip
+        self.virtual_mac = virtual_mac
+        self.ip_proto = ip_proto
+        self.client_idle_timeout = client_idle_timeout
+        # Meter id for the VIP ARP responder (lb_meters.ARP_METER), or None
+        self.arp_meter = None
+
+    def sync(self, dp, backends, max_len=None):
+        """
+        Install the VIP ARP responder, the per-backend reverse flows for
+        `backends` and the table 1 miss (packet-ins cut to max_len),
+        replacing the ones from an earlier sync (or an earlier controller
+        run). Per-client flows are kept.
+        """
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        for kind in (lb_cookie.KIND_ARP, lb_cookie.KIND_REVERSE):
+            cookie, mask = lb_cookie.kind_match(kind)
+            dp.send_msg(parser.OFPFlowMod(datapath=dp, table_id=0, command=ofproto.OFPFC_DELETE,
+                                          cookie=cookie, cookie_mask=mask,
+                                          out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                          match=parser.OFPMatch()))
+        dp.send_msg(vip_arp_responder(dp, self.virtual_ip, self.virtual_mac, meter=self.arp_meter))
+        for i, b in enumerate(backends):
+            dp.send_msg(reverse_flow(dp, b["ip"], self.virtual_ip, self.virtual_mac, i, self.ip_proto))
+        dp.send_msg(delivery_miss(dp, max_len))
+
+    def add_client(self, dp, client_ip, client_mac, port):
+        dp.send_msg(client_arp_responder(dp, client_ip, client_mac, self.client_idle_timeout))
+        dp.send_msg(delivery_flow(dp, client_ip, client_mac, port, self.client_idle_timeout))
+
+    def redeliver(self, dp, client_ip, client):
+        """
+        For a packet-in from the table 1 miss (msg.table_id ==
+        delivery_table): a backend reply for a client whose delivery flow
+        idled out. Re-adds the flow and returns the actions to forward the
+        packet with; client is the app's client entry ({"mac", "port"}).
+        """
+        dp.send_msg(delivery_flow(dp, client_ip, client["mac"], client["port"], self.client_idle_timeout))
+        return delivery_actions(dp, client["mac"], client["port"])
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Offline PACKET_IN replay for the Lab9 load balancers (no Mininet or OVS).
+
+The apps are instantiated directly and every switch is a lb_mock
+MockDatapath that records what the app sends. Events come from:
+
+  a control-channel capture   tcpdump of the OpenFlow port (like
+                              Lab3/openflow.pcap): the TCP streams are put
+                              back together and their OF1.3 PACKET_INs
+                              replayed, per switch (dpid from the
+                              FEATURES_REPLY when the capture has it)
+  a host capture (--raw)      every frame becomes a PACKET_IN on --in-port
+  --synthetic                 clients x connections: ARP for the VIP, then
+                              per connection the SYN and the backend's
+                              SYN-ACK
+
+Reported per app: handler throughput, per-event latency percentiles and
+histogram, memory allocated (peak) and kept per event (tracemalloc, in a
+second pass), and the flow-mods the app sent, with a digest of the set.
+--json writes the numbers; --baseline compares against such a file and
+exits 1 on a regression beyond --tolerance, or if the flow-mod set changed.
+
+    python3 lb_replay.py ../Lab3/openflow.pcap
+    python3 lb_replay.py --raw hosts.pcap --in-port 4
+    python3 lb_replay.py --synthetic --clients 5000 --conns 3 --json base.json
+    python3 lb_replay.py --synthetic --clients 5000 --conns 3 --baseline base.json
+    python3 lb_replay.py --synthetic --app stateful --set proactive=True
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import logging
+import struct
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from ryu.controller import ofp_event
+from ryu.lib.packet import tcp
+from ryu.ofproto import ofproto_parser, ofproto_v1_3
+
+import lb_cookie
+import lb_mock
+import pied_piper_lb
+import stateful_pied_piper_lb
+
+apps = {
+    "rr": pied_piper_lb.RoundRobinLB,
+    "stateful": stateful_pied_piper_lb.L4StatefulLB,
+}
+
+openflow_ports = (6633, 6653)
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_LINUX_SLL = 113
+
+
+# -------------------------------------------------------------------------
+# pcap
+# -------------------------------------------------------------------------
+def read_pcap(path):
+    """(timestamp, linktype, frame) for every record of a classic pcap file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic = data[:4]
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        endian = "<"
+    elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+        endian = ">"
+    else:
+        raise ValueError("%s: not a pcap file (pcapng? convert with editcap -F pcap)" % path)
+    scale = 1e-9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1e-6
+    linktype = struct.unpack_from(endian + "I", data, 20)[0]
+    off = 24
+    while off + 16 <= len(data):
+        sec, frac, incl, _ = struct.unpack_from(endian + "IIII", data, off)
+        off += 16
+        yield sec + frac * scale, linktype, data[off:off + incl]
+        off += incl
+
+
+def ip_packet(linktype, frame):
+    # The IPv4 packet in a frame, or None
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype, off = struct.unpack_from("!H", frame, 12)[0], 14
+        if ethertype == 0x8100:
+            ethertype, off = struct.unpack_from("!H", frame, 16)[0], 18
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype, off = struct.unpack_from("!H", frame, 14)[0], 16
+    else:
+        return None
+    return frame[off:] if ethertype == 0x0800 else None
+
+
+def ethernet_frame(linktype, frame):
+    # Host capture frame as the switch would see it; SLL gets an Ethernet header back
+    if linktype == LINKTYPE_ETHERNET:
+        return frame
+    if linktype == LINKTYPE_LINUX_SLL:
+        src = frame[6:12] if struct.unpack_from("!H", frame, 4)[0] == 6 else b"\0" * 6
+        return b"\xff" * 6 + src + frame[14:16] + frame[16:]
+    return None
+
+
+def tcp_streams(records, ports=openflow_ports):
+    """
+    Payload bytes per direction of every TCP connection to one of `ports`,
+    in sequence order: {(src ip, src port, dst ip, dst port): bytes}.
+    Retransmitted and overlapping data is dropped; a stream stops at the
+    first gap (bytes missing from the capture).
+    """
+    segments = {}
+    for _, linktype, frame in records:
+        ip = ip_packet(linktype, frame)
+        if ip is None or len(ip) < 20 or ip[9] != 6:
+            continue
+        ihl = (ip[0] & 0x0F) * 4
+        total = struct.unpack_from("!H", ip, 2)[0]
+        sport, dport, seq = struct.unpack_from("!HHI", ip, ihl)
+        if sport not in ports and dport not in ports:
+            continue
+        payload = ip[ihl + (ip[ihl + 12] >> 4) * 4:total]
+        if payload:
+            key = (".".join(map(str, ip[12:16])), sport, ".".join(map(str, ip[16:20])), dport)
+            segments.setdefault(key, []).append((seq, payload))
+    streams = {}
+    for key, segs in segments.items():
+        base = segs[0][0]
+        segs.sort(key=lambda s: (s[0] - base) & 0xFFFFFFFF)
+        buf = bytearray()
+        for seq, payload in segs:
+            rel = (seq - base) & 0xFFFFFFFF
+            if rel > len(buf):
+                break
+            buf += payload[len(buf) - rel:]
+        streams[key] = bytes(buf)
+    return streams
+
+
+def openflow_messages(stream):
+    """(version, type, xid, message bytes) for every whole OF message in a stream."""
+    off = 0
+    while off + 8 <= len(stream):
+        version, msg_type, length, xid = struct.unpack_from("!BBHI", stream, off)
+        if length < 8 or off + length > len(stream):
+            break
+        yield version, msg_type, xid, stream[off:off + length]
+        off += length
+
+
+def capture_events(path):
+    """
+    [(dpid, in_port, frame)] from the switch -> controller direction of a
+    control-channel capture, in capture order per switch, plus counts of
+    what was skipped or truncated.
+    """
+    ofp = ofproto_v1_3
+    streams = tcp_streams(read_pcap(path))
+    notes = Counter()
+    events = []
+    unknown = 0
+    for key in sorted(streams):
+        if key[3] not in openflow_ports:
+            continue  # controller -> switch
+        msgs = list(openflow_messages(streams[key]))
+        dpid = None
+        for version, msg_type, xid, buf in msgs:
+            if version == ofp.OFP_VERSION and msg_type == ofp.OFPT_FEATURES_REPLY:
+                dpid = struct.unpack_from("!Q", buf, 8)[0]
+        if dpid is None:
+            # Connected before the capture started
+            unknown += 1
+            dpid = 0x10000 + unknown
+        dp = lb_mock.MockDatapath(dpid)
+        for version, msg_type, xid, buf in msgs:
+            if version != ofp.OFP_VERSION:
+                notes["skipped OpenFlow version %d" % version] += 1
+                continue
+            if msg_type != ofp.OFPT_PACKET_IN:
+                continue
+            msg = ofproto_parser.msg(dp, version, msg_type, len(buf), xid, buf)
+            if msg.buffer_id != ofp.OFP_NO_BUFFER:
+                notes["buffered (data truncated)"] += 1
+            events.append((dpid, msg.match["in_port"], msg.data))
+    return events, notes
+
+
+def raw_events(path, in_port, dpid=1):
+    events = []
+    for _, linktype, frame in read_pcap(path):
+        frame = ethernet_frame(linktype, frame)
+        if frame is not None and len(frame) >= 14:
+            events.append((dpid, in_port, frame))
+    return events
+
+
+def synthetic_events(backends, clients, conns, services=(8080, 8181), dpid=1):
+    """ARP for the VIP, then SYN and the backend's SYN-ACK per connection."""
+    events = []
+    for i in range(clients):
+        ip, mac, port = lb_mock.client_addr(i)
+        events.append((dpid, port, lb_mock.arp_request(mac, ip, lb_mock.VIP)))
+        for c in range(conns):
+            service = services[(i + c) % len(services)]
+            eligible = [b for b in backends if service in b.get("services", [service])] or backends
+            b = eligible[(i + c) % len(eligible)]
+            sport = 20000 + (i * conns + c) % 40000
+            events.append((dpid, port, lb_mock.tcp_segment(mac, lb_mock.VIP_MAC, ip, lb_mock.VIP, sport,
+                                                            service, tcp.TCP_SYN)))
+            events.append((dpid, b["port"], lb_mock.tcp_segment(b["mac"], lb_mock.VIP_MAC, b["ip"], ip,
+                                                                 service, sport, tcp.TCP_SYN | tcp.TCP_ACK)))
+    return events
+
+
+# -------------------------------------------------------------------------
+# Replay
+# -------------------------------------------------------------------------
+class CountingDatapath(lb_mock.MockDatapath):
+    # Counts sent messages instead of keeping them, for the allocation pass
+    def _deliver(self, msg):
+        self.delivered = getattr(self, "delivered", 0) + 1
+
+def make_app(app_cls, settings):
+    app = app_cls()
+    app.logger.setLevel(logging.WARNING)
+    for name, value in settings.items():
+        if not hasattr(app, name):
+            raise SystemExit("%s has no attribute %r" % (app_cls.__name__, name))
+        setattr(app, name, value)
+    return app
+
+
+def connect(app, dpids, dp_cls=lb_mock.MockDatapath):
+    # A datapath per switch, announced to the app like a real connection
+    handlers = lb_mock.event_handlers(app).get(ofp_event.EventOFPSwitchFeatures, ())
+    dps = {}
+    for dpid in sorted(set(dpids)):
+        dp = dps[dpid] = dp_cls(dpid)
+        msg = dp.ofproto_parser.OFPSwitchFeatures(dp, datapath_id=dpid)
+        for handler in handlers:
+            handler(ofp_event.EventOFPSwitchFeatures(msg))
+        dp.clear()
+    return dps
+
+
+def replay(app_cls, events, settings):
+    """Timing pass: per-event handler latency and the messages sent."""
+    app = make_app(app_cls, settings)
+    dps = connect(app, [e[0] for e in events])
+    evs = [lb_mock.packet_in_event(dps[dpid], port, data) for dpid, port, data in events]
+    handler = app._packet_in_handler
+    latencies = []
+    clock = time.perf_counter
+    for ev in evs:
+        start = clock()
+        handler(ev)
+        latencies.append(clock() - start)
+    return latencies, dps
+
+
+def allocations(app_cls, events, settings, top=5):
+    """
+    Second pass under tracemalloc: bytes allocated at the peak of each
+    event and bytes the app still holds after it (sent messages are not
+    kept), plus the lines holding the most at the end.
+    """
+    app = make_app(app_cls, settings)
+    dps = connect(app, [e[0] for e in events], CountingDatapath)
+    evs = [lb_mock.packet_in_event(dps[dpid], port, data) for dpid, port, data in events]
+    handler = app._packet_in_handler
+    peaks, kept = [0] * len(evs), [0] * len(evs)
+    ignore = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+    tracemalloc.start()
+    before_all = tracemalloc.take_snapshot().filter_traces(ignore)
+    for i, ev in enumerate(evs):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        handler(ev)
+        current, peak = tracemalloc.get_traced_memory()
+        peaks[i] = peak - before
+        kept[i] = current - before
+    after_all = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.stop()
+    sites = [(str(s.traceback[0]), s.size_diff, s.count_diff)
+             for s in after_all.compare_to(before_all, "lineno")[:top] if s.size_diff > 0]
+    return peaks, kept, sites
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+def flow_mod_set(dps):
+    """Counts per flow-mod shape and a digest of every flow-mod, in send order per switch."""
+    shapes = Counter()
+    digest = hashlib.sha1()
+    n = 0
+    for dpid in sorted(dps):
+        for msg in dps[dpid].sent:
+            if not isinstance(msg, dps[dpid].ofproto_parser.OFPFlowMod):
+                continue
+            n += 1
+            items = sorted(msg.match.items())
+            c = lb_cookie.decode(msg.cookie)
+            shapes[(msg.command, msg.table_id, msg.priority, ",".join(k for k, _ in items),
+                    c.kind if c else None)] += 1
+            digest.update(repr((dpid, msg.command, msg.table_id, msg.priority, items, msg.cookie,
+                                msg.idle_timeout, msg.hard_timeout)).encode())
+    return n, shapes, digest.hexdigest()
+
+
+def histogram(latencies, width=40):
+    # Power-of-two microsecond buckets
+    buckets = Counter()
+    for s in latencies:
+        us = max(1, int(s * 1e6))
+        buckets[1 << (us.bit_length() - 1)] += 1
+    most = max(buckets.values()) if buckets else 1
+    lines = []
+    for low in sorted(buckets):
+        lines.append("    %6d-%-6d us %7d %s" % (low, 2 * low - 1, buckets[low],
+                                                   "#" * max(1, buckets[low] * width // most)))
+    return lines
+
+
+def run(name, app_cls, events, settings, show_histogram=True):
+    latencies, dps = replay(app_cls, events, settings)
+    peaks, kept, sites = allocations(app_cls, events, settings)
+    n, shapes, digest = flow_mod_set(dps)
+    lat = sorted(latencies)
+    total = sum(latencies)
+    sent = Counter(type(m).__name__ for dp in dps.values() for m in dp.sent)
+    result = {
+        "events": len(events),
+        "per_sec": len(events) / total if total else 0.0,
+        "mean_us": 1e6 * total / len(events) if events else 0.0,
+        "p50_us": 1e6 * percentile(lat, 50),
+        "p90_us": 1e6 * percentile(lat, 90),
+        "p99_us": 1e6 * percentile(lat, 99),
+        "max_us": 1e6 * (lat[-1] if lat else 0.0),
+        "alloc_peak_per_event": sum(peaks) / float(len(peaks)) if peaks else 0.0,
+        "kept_per_event": sum(kept) / float(len(kept)) if kept else 0.0,
+        "messages": dict(sent),
+        "flow_mods": n,
+        "flow_mod_digest": digest,
+    }
+    print("%s: %d events on %d switch(es)" % (name, len(events), len(dps)))
+    print("  throughput %9.0f events/s   mean %7.1f us" % (result["per_sec"], result["mean_us"]))
+    print("  latency    p50 %7.1f  p90 %7.1f  p99 %7.1f  max %8.1f us"
+          % (result["p50_us"], result["p90_us"], result["p99_us"], result["max_us"]))
+    if show_histogram:
+        for line in histogram(latencies):
+            print(line)
+    print("  memory     %7.0f B allocated (peak) and %6.0f B kept per event"
+          % (result["alloc_peak_per_event"], result["kept_per_event"]))
+    for site, size, count in sites:
+        print("    %+8.1f KiB %+7d blocks  %s" % (size / 1024.0, count, site))
+    print("  sent       %s" % ", ".join("%s %d" % kv for kv in sorted(sent.items())))
+    print("  flow-mods  %d, digest %s" % (n, digest[:12]))
+    for (command, table, priority, fields, kind), count in sorted(shapes.items(), key=lambda kv: -kv[1])[:8]:
+        print("    %6d x cmd %d table %d prio %3d kind %-4s match %s"
+              % (count, command, table, priority, kind, fields or "(any)"))
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against a --json file from an earlier run: [message]."""
+    problems = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            continue
+        if b["events"] != r["events"]:
+            problems.append("%s: %d events, baseline %d (different input)" % (name, r["events"], b["events"]))
+            continue
+        if r["per_sec"] < b["per_sec"] * (1 - tolerance):
+            problems.append("%s: throughput %.0f/s, baseline %.0f/s" % (name, r["per_sec"], b["per_sec"]))
+        if r["p99_us"] > b["p99_us"] * (1 + tolerance):
+            problems.append("%s: p99 %.1f us, baseline %.1f us" % (name, r["p99_us"], b["p99_us"]))
+        if r["kept_per_event"] > b["kept_per_event"] * (1 + tolerance) + 64:
+            problems.append("%s: %.0f B kept per event, baseline %.0f B"
+                            % (name, r["kept_per_event"], b["kept_per_event"]))
+        if r["flow_mod_digest"] != b["flow_mod_digest"]:
+            problems.append("%s: flow-mod set changed (%d flow-mods, baseline %d)"
+                            % (name, r["flow_mods"], b["flow_mods"]))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pcap", nargs="?", help="control-channel capture (or host capture with --raw)")
+    parser.add_argument("--raw", action="store_true", help="pcap holds host traffic, one packet-in per frame")
+    parser.add_argument("--in-port", type=int, default=4, help="in_port for --raw frames")
+    parser.add_argument("--synthetic", action="store_true", help="generated clients and connections")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--conns", type=int, default=3)
+    parser.add_argument("--app", choices=["rr", "stateful", "both"], default="both")
+    parser.add_argument("--set", action="append", default=[], metavar="ATTR=VALUE",
+                        help="app attribute to set before the replay, e.g. proactive=True")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the events this many times")
+    parser.add_argument("--no-histogram", action="store_true")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="results of an earlier --json run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if not args.synthetic and not args.pcap:
+        parser.error("give a pcap file or --synthetic")
+    settings = {}
+    for item in args.set:
+        name, _, value = item.partition("=")
+        try:
+            settings[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            settings[name] = value
+
+    results = {}
+    names = ["rr", "stateful"] if args.app == "both" else [args.app]
+    for name in names:
+        app_cls = apps[name]
+        if args.synthetic:
+            events = synthetic_events(make_app(app_cls, settings).backends, args.clients, args.conns)
+            source = "synthetic, %d clients x %d connections" % (args.clients, args.conns)
+        elif args.raw:
+            events = raw_events(args.pcap, args.in_port)
+            source = args.pcap
+        else:
+            events, notes = capture_events(args.pcap)
+            source = args.pcap
+            if notes:
+                source += " (%s)" % ", ".join("%d %s" % (n, what) for what, n in sorted(notes.items()))
+        events = events * args.repeat
+        print("# %s" % source)
+        results[app_cls.__name__] = run(app_cls.__name__, app_cls, events, settings, not args.no_histogram)
+        print()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for p in problems:
+            print("REGRESSION: %s" % p)
+        if problems:
+            sys.exit(1)
+        print("No regression against %s (tolerance %.0f%%)" % (args.baseline, 100 * args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Per-backend, per-service and per-client traffic of the Lab9 load balancers,
+from flow stats.
+
+Every `interval` seconds TrafficStats sends one OFPFlowStatsRequest per
+switch, selecting all LB flows by cookie (lb_cookie.lb_match()), so the
+controller sends the same one request however many clients there are. The
+flow cookie says which backend a flow belongs to and the match says which
+client and service, so no per-flow state is needed beyond the last
+counters of each flow, to turn the cumulative flow counters into deltas.
+FlowRemoved messages credit the traffic of a flow since its last poll.
+
+Counted flows:
+
+  KIND_SESSION  client -> backend     backend, service (tcp_dst), client
+  KIND_REVERSE  backend -> client(s)  backend, client (reactive mode only;
+                                      proactive reverse flows are per backend)
+
+SELECT group traffic (KIND_VIP) has no backend in its flow, so it is not
+split per backend here.
+
+Deltas go into the current bucket, and each poll round starts a new one;
+report() sums the buckets of the last `window` seconds. backend_rates()
+gives bytes per second per backend, e.g. to set backend weights for the
+weighted strategy.
+"""
+
+import time
+from collections import deque
+
+from ryu.lib import hub
+
+import lb_cookie
+
+
+def _client_key(value):
+    # Per-/24 session flows match the source with a mask
+    if isinstance(value, tuple):
+        return "%s/%s" % value
+    return value
+
+
+class TrafficStats(object):
+    def __init__(self, interval=5.0, window=60.0, top_clients=20):
+        self.interval = interval
+        self.window = window
+        self.top_clients = top_clients
+        self.last = {}    # dpid -> {flow key: (packets, bytes)} as of the last poll
+        self.seen = {}    # dpid -> flow keys in the reply being collected
+        self.polls = {}   # dpid -> xid of the outstanding request
+        self.buckets = deque()  # (start, {(dimension, key): [packets, bytes]}), oldest first
+        self.current = {}
+        self.current_start = self.started = time.time()
+        self.poller = None
+        self.requests = self.replies = 0
+
+    # Collection
+    def poll(self, dp):
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        cookie, mask = lb_cookie.lb_match()
+        req = parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                         cookie, mask, parser.OFPMatch())
+        dp.set_xid(req)
+        self.polls[dp.id] = req.xid
+        self.seen[dp.id] = set()
+        self.requests += 1
+        dp.send_msg(req)
+
+    def is_poll(self, dpid, xid):
+        return self.polls.get(dpid) == xid
+
+    def stats_reply(self, dpid, body, more, backends):
+        """One part of a flow-stats reply; backends maps cookie indexes to backends."""
+        last = self.last.setdefault(dpid, {})
+        seen = self.seen.setdefault(dpid, set())
+        for stat in body:
+            key = (stat.table_id, stat.priority, stat.cookie, tuple(sorted(stat.match.items())))
+            seen.add(key)
+            self._count(stat.cookie, stat.match, stat.packet_count, stat.byte_count, last.get(key), backends)
+            last[key] = (stat.packet_count, stat.byte_count)
+        if more:
+            return
+        self.replies += 1
+        self.polls.pop(dpid, None)
+        # Flows no longer installed
+        for key in set(last) - seen:
+            del last[key]
+        self.seen[dpid] = set()
+
+    def flow_removed(self, dpid, msg, backends):
+        key = (msg.table_id, msg.priority, msg.cookie, tuple(sorted(msg.match.items())))
+        before = self.last.get(dpid, {}).pop(key, None)
+        self._count(msg.cookie, msg.match, msg.packet_count, msg.byte_count, before, backends)
+
+    def forget(self, dpid):
+        self.last.pop(dpid, None)
+        self.seen.pop(dpid, None)
+        self.polls.pop(dpid, None)
+
+    def _count(self, cookie, match, packets, nbytes, before, backends):
+        c = lb_cookie.decode(cookie)
+        if c is None or c.kind not in (lb_cookie.KIND_SESSION, lb_cookie.KIND_REVERSE):
+            return
+        if before is not None and packets >= before[0]:
+            packets, nbytes = packets - before[0], nbytes - before[1]
+        if not packets and not nbytes:
+            return
+        fields = dict(match.items())
+        backend = None
+        if c.backend is not None and c.backend < len(backends):
+            backend = backends[c.backend]["ip"]
+        if c.kind == lb_cookie.KIND_SESSION:
+            keys = (("backend", backend), ("service", fields.get("tcp_dst")),
+                    ("client", _client_key(fields.get("ipv4_src"))))
+        else:
+            keys = (("backend", backend), ("client", fields.get("ipv4_dst")))
+        for key in keys:
+            if key[1] is None:
+                continue
+            counts = self.current.get(key)
+            if counts is None:
+                counts = self.current[key] = [0, 0]
+            counts[0] += packets
+            counts[1] += nbytes
+
+    # Rolling window
+    def tick(self, now=None):
+        # Close the current bucket and drop the ones older than the window
+        now = time.time() if now is None else now
+        self.buckets.append((self.current_start, self.current))
+        self.current = {}
+        self.current_start = now
+        while self.buckets and self.buckets[0][0] < now - self.window:
+            self.buckets.popleft()
+
+    def totals(self):
+        out = {}
+        for _, bucket in list(self.buckets) + [(self.current_start, self.current)]:
+            for key, (packets, nbytes) in bucket.items():
+                counts = out.get(key)
+                if counts is None:
+                    counts = out[key] = [0, 0]
+                counts[0] += packets
+                counts[1] += nbytes
+        return out
+
+    def report(self, now=None):
+        """Packets, bytes and rates per backend, service and top client over the window."""
+        now = time.time() if now is None else now
+        start = self.buckets[0][0] if self.buckets else self.current_start
+        span = max(now - start, 1e-9)
+        out = {"window": self.window, "span": span, "requests": self.requests, "replies": self.replies,
+               "backends": {}, "services": {}, "clients": {}}
+        dimensions = {"backend": "backends", "service": "services", "client": "clients"}
+        for (dimension, key), (packets, nbytes) in self.totals().items():
+            out[dimensions[dimension]][key] = {"packets": packets, "bytes": nbytes,
+                                               "pps": packets / span, "bps": 8 * nbytes / span}
+        top = sorted(out["clients"].items(), key=lambda kv: -kv[1]["bytes"])[:self.top_clients]
+        out["clients"] = dict(top)
+        return out
+
+    def backend_rates(self):
+        # backend ip -> bytes per second over the window
+        return {ip: r["bps"] / 8 for ip, r in self.report()["backends"].items()}
+
+    def start_polling(self, datapaths):
+        # datapaths: the app's dpid -> datapath dict, read on every round
+        if self.poller is None:
+            self.poller = hub.spawn(self._poll_loop, datapaths)
+
+    def _poll_loop(self, datapaths):
+        while True:
+            hub.sleep(self.interval)
+            self.tick()
+            for dp in list(datapaths.values()):
+                self.poll(dp)
@@ -0,0 +1,83 @@
+"""
+REST endpoints for the traffic accounting (lb_stats.py) and the packet-in
+instrumentation (lb_instrument.py) of the Lab9 load balancers. Run it next
+to the LB app, which needs traffic_stats = True and/or instrumentation = True:
+
+    ryu-manager stateful_pied_piper_lb.py lb_stats_rest.py
+
+    GET /lb/stats             everything below
+    GET /lb/stats/backends    packets, bytes, pps, bps per backend
+    GET /lb/stats/services    the same per service port (client -> VIP direction)
+    GET /lb/stats/clients     the same for the top clients by bytes
+    GET /lb/instrumentation   stage timing histograms and event counts
+    GET /metrics              the same in Prometheus text format
+
+Ryu's WSGI server listens on port 8080 (--wsapi-port).
+"""
+
+import json
+
+from ryu.app.wsgi import ControllerBase, WSGIApplication, Response, route
+from ryu.base import app_manager
+
+# LB apps that may carry a TrafficStats collector, by Ryu app name
+lb_apps = ("L4StatefulLB", "RoundRobinLB")
+
+
+def _app(flag):
+    # The running LB app with `flag` set, if any
+    for name in lb_apps:
+        app = app_manager.lookup_service_brick(name)
+        if app is not None and getattr(app, flag, False):
+            return app
+    return None
+
+
+def _collector():
+    app = _app("traffic_stats")
+    return app.traffic if app is not None else None
+
+
+class LBStatsController(ControllerBase):
+    def _reply(self, section=None):
+        stats = _collector()
+        if stats is None:
+            return Response(status=503, content_type="application/json",
+                            text=json.dumps({"error": "no LB app with traffic_stats enabled"}))
+        report = stats.report()
+        if section is not None:
+            report = report[section]
+        return Response(content_type="application/json", text=json.dumps(report, default=str))
+
+    @route("lbstats", "/lb/stats", methods=["GET"])
+    def summary(self, req, **kwargs):
+        return self._reply()
+
+    @route("lbstats", "/lb/stats/{section}", methods=["GET"],
+           requirements={"section": "backends|services|clients"})
+    def section(self, req, section, **kwargs):
+        return self._reply(section)
+
+    @route("lbstats", "/lb/instrumentation", methods=["GET"])
+    def instrumentation(self, req, **kwargs):
+        app = _app("instrumentation")
+        if app is None:
+            return Response(status=503, content_type="application/json",
+                            text=json.dumps({"error": "no LB app with instrumentation enabled"}))
+        return Response(content_type="application/json", text=json.dumps(app.instruments.report()))
+
+    @route("lbstats", "/metrics", methods=["GET"])
+    def metrics(self, req, **kwargs):
+        app = _app("instrumentation")
+        if app is None:
+            return Response(status=503, content_type="text/plain", text="# no LB app with instrumentation enabled\n")
+        return Response(content_type="text/plain", charset="utf-8",
+                        text=app.instruments.prometheus(app.name))
+
+
+class LBStatsRest(app_manager.RyuApp):
+    _CONTEXTS = {"wsgi": WSGIApplication}
+
+    def __init__(self, *args, **kwargs):
+        super(LBStatsRest, self).__init__(*args, **kwargs)
+        kwargs["wsgi"].register(LBStatsController)
@@ -0,0 +1,243 @@
+"""
+Backend selection strategies for the Lab9 load balancers.
+
+Each strategy owns one service's pool of backends (the dicts from the
+app's self.backends) and precomputes everything it needs when the pool
+changes, so select() is O(1) no matter how many backends there are:
+
+  round_robin   plain rotation
+  weighted      weighted round robin over an interleaved table with slots
+                in proportion to the weights
+  least_conn    fewest open sessions; counts kept in buckets (O(1) updates)
+  maglev        Maglev consistent hashing on a key chosen by the app (client
+                IP, 5-tuple string, ...); removing one of N backends
+                remaps little more than the 1/N of keys it held
+
+The app calls acquire(backend) when it maps a session to a backend and
+release(backend) when that session ends. Only least_conn uses these calls.
+"""
+
+import hashlib
+import zlib
+from math import gcd
+
+
+class Strategy(object):
+    name = None
+
+    def __init__(self, backends=()):
+        self.set_backends(backends)
+
+    def set_backends(self, backends):
+        self.backends = list(backends)
+        self.rebuild()
+
+    def rebuild(self):
+        pass
+
+    def select(self, key):
+        raise NotImplementedError
+
+    def acquire(self, backend):
+        pass
+
+    def release(self, backend):
+        pass
+
+    def __len__(self):
+        return len(self.backends)
+
+
+class RoundRobin(Strategy):
+    name = "round_robin"
+
+    def rebuild(self):
+        self.next = 0
+
+    def select(self, key):
+        if not self.backends:
+            return None
+        backend = self.backends[self.next]
+        self.next = (self.next + 1) % len(self.backends)
+        return backend
+
+
+class WeightedRoundRobin(Strategy):
+    """
+    Weighted round robin over a table built at rebuild time. Each backend
+    gets slots in proportion to its weight (divided by the weights' gcd),
+    spaced evenly over the table: slot k of a backend with s slots sits at
+    (k + 0.5) / s, and the table is all slots sorted by that position, so
+    turns are interleaved instead of sent in bursts. When the weights sum
+    to more than max_schedule the slots are scaled down to a table of
+    max_schedule entries, or slots_per_backend per backend in very large
+    pools, with at least one slot each; shares then stay within one slot
+    of the weights. select() walks the table.
+    """
+    name = "weighted"
+    max_schedule = 4096
+    slots_per_backend = 16
+
+    def rebuild(self):
+        weights = [max(0, int(b.get("weight", 1))) for b in self.backends]
+        self.next = 0
+        live = [(b, w) for b, w in zip(self.backends, weights) if w > 0]
+        g = 0
+        for _, w in live:
+            g = gcd(g, w)
+        slots = [w // g for _, w in live]
+        total = sum(slots)
+        if total > self.max_schedule:
+            slots = self._scale(slots, total, max(self.max_schedule, self.slots_per_backend * len(slots)))
+        order = sorted(((k + 0.5) / s, i) for i, s in enumerate(slots) for k in range(s))
+        self.schedule = [live[i][0] for _, i in order]
+
+    @staticmethod
+    def _scale(weights, total, size):
+        # Largest remainder, with every backend keeping at least one slot
+        slots = [max(1, w * size // total) for w in weights]
+        spare = size - sum(slots)
+        if spare > 0:
+            by_remainder = sorted(range(len(weights)), key=lambda i: -(weights[i] * size % total))
+            for i in by_remainder[:spare]:
+                slots[i] += 1
+        return slots
+
+    def select(self, key):
+        if not self.schedule:
+            return None
+        backend = self.schedule[self.next]
+        self.next = (self.next + 1) % len(self.schedule)
+        return backend
+
+
+class LeastConnections(Strategy):
+    """
+    Backends are kept in buckets by open session count. Counts only ever
+    move by one, so both finding the least loaded backend and updating a
+    count are O(1); ties go to the backend that has waited longest.
+    """
+    name = "least_conn"
+
+    def rebuild(self):
+        old = getattr(self, "count", {})
+        self.count = {}
+        self.buckets = {}
+        for b in self.backends:
+            n = old.get(b["ip"], 0)
+            self.count[b["ip"]] = n
+            self.buckets.setdefault(n, {})[b["ip"]] = b
+        self.min_count = min(self.buckets) if self.buckets else 0
+
+    def _move(self, ip, old, new):
+        bucket = self.buckets[old]
+        backend = bucket.pop(ip)
+        if not bucket:
+            del self.buckets[old]
+        self.buckets.setdefault(new, {})[ip] = backend
+        self.count[ip] = new
+
+    def select(self, key):
+        bucket = self.buckets.get(self.min_count)
+        if not bucket:
+            return None
+        return next(iter(bucket.values()))
+
+    def acquire(self, backend):
+        ip = backend["ip"]
+        n = self.count.get(ip)
+        if n is None:
+            return
+        self._move(ip, n, n + 1)
+        if n == self.min_count and n not in self.buckets:
+            self.min_count = n + 1
+
+    def release(self, backend):
+        ip = backend["ip"]
+        n = self.count.get(ip)
+        if not n:
+            return
+        self._move(ip, n, n - 1)
+        if n - 1 < self.min_count:
+            self.min_count = n - 1
+
+    def connections(self, backend):
+        return self.count.get(backend["ip"], 0)
+
+
+# Primes for the Maglev lookup table; the smallest one >= 100 * backends is used
+maglev_primes = (65521, 131071, 262139, 524287, 1048573)
+
+
+def _hash64(text, salt):
+    return int.from_bytes(hashlib.md5((salt + text).encode()).digest()[:8], "big")
+
+
+class Maglev(Strategy):
+    """
+    Maglev consistent hashing (Eisenbud et al., NSDI 2016). Every backend
+    gets a permutation of the table slots from two hashes of its IP, and the
+    backends take turns claiming their next free slot until the table is
+    full. A weight of w means w claims per turn. Lookup is one crc32 of
+    the key plus an index into the table.
+    """
+    name = "maglev"
+
+    def __init__(self, backends=(), table_size=None):
+        self.table_size = table_size
+        super(Maglev, self).__init__(backends)
+
+    def _size(self):
+        # Only ever grows: a new table size would remap almost every key
+        if self.table_size:
+            return self.table_size
+        want = 100 * max(1, len(self.backends))
+        for p in maglev_primes:
+            if p >= want:
+                break
+        return max(p, getattr(self, "m", 0))
+
+    def rebuild(self):
+        m = self.m = self._size()
+        live = [b for b in self.backends if b.get("weight", 1) > 0]
+        self.table = [None] * m
+        if not live:
+            return
+        offsets = [_hash64(b["ip"], "offset") % m for b in live]
+        skips = [_hash64(b["ip"], "skip") % (m - 1) + 1 for b in live]
+        weights = [int(b.get("weight", 1)) for b in live]
+        nexts = [0] * len(live)
+        filled = 0
+        while True:
+            for i, b in enumerate(live):
+                for _ in range(weights[i]):
+                    slot = (offsets[i] + nexts[i] * skips[i]) % m
+                    while self.table[slot] is not None:
+                        nexts[i] += 1
+                        slot = (offsets[i] + nexts[i] * skips[i]) % m
+                    self.table[slot] = b
+                    nexts[i] += 1
+                    filled += 1
+                    if filled == m:
+                        return
+
+    def select(self, key):
+        if self.table[0] is None:
+            return None
+        return self.table[zlib.crc32(key.encode()) % self.m]
+
+
+strategies = {cls.name: cls for cls in (RoundRobin, WeightedRoundRobin, LeastConnections, Maglev)}
+
+
+def build_pools(backends, strategy="round_robin", **kwargs):
+    """
+    One strategy instance per service port: {service: Strategy}. Backends
+    list the ports they serve in b["services"].
+    """
+    cls = strategies[strategy]
+    services = {}
+    for b in backends:
+        for s in b.get("services", []):
+            services.setdefault(s, []).append(b)
+    return {s: cls(pool, **kwargs) for s, pool in services.items()}
@@ -1,8 +1,20 @@
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet, ethernet, ipv4, arp, ether_types
+from ryu.lib.packet import packet, ethernet, arp, ether_types
+
+import fast_parse
+import flow_queue
+import health_check
+import lb_buffering
+import lb_cookie
+import lb_groups
+import lb_instrument
+import lb_meters
+import lb_persist
+import lb_proactive
+import lb_stats
 
 
 class RoundRobinLB(app_manager.RyuApp):
@@ -22,6 +34,30 @@ class RoundRobinLB(app_manager.RyuApp):
         self.virtual_ip = "10.0.0.100"
         self.virtual_mac = "00:00:00:00:ff:ff"
 
+        # Active health checks (health_check.py): clients rotate over the
+        # healthy backends only. Started at the first switch.
+        self.health_checks = False
+        self.health = health_check.HealthChecker(self._health_changed, default_ports=(80,))
+        self.health.set_backends(self.backends)
+        self.live_backends = list(self.backends)
+
+        # Queue FlowMods/PacketOuts per switch (flow_queue.py): duplicate
+        # flow-mods are dropped, each batch is one write and ends with a barrier
+        self.batch_flow_mods = False
+        self.flow_queues = flow_queue.FlowQueues()
+
+        # Packet-in limits (lb_meters.py): table-miss and ARP-to-controller
+        # flows go through OpenFlow meters, per in_port with per_port=True
+        self.packet_in_meters = False
+        self.meters = lb_meters.PacketInMeters(rate=500, arp_rate=100, port_rate=50, per_port=False)
+        self.meter_poll_interval = 10
+
+        # Traffic accounting (lb_stats.py): one flow-stats request per switch
+        # per interval, summed per backend, service and client; served by
+        # lb_stats_rest.py
+        self.traffic_stats = False
+        self.traffic = lb_stats.TrafficStats(interval=5, window=60)
+
         # Per-client rotation
         # self.client_rr = { "10.0.0.4": 0, "10.0.0.5": 2, ... }
         self.client_rr = {}
@@ -29,89 +65,283 @@ class RoundRobinLB(app_manager.RyuApp):
         # Dynamic client table: { "10.0.0.4": {"mac": "...", "port": 4}, ... }
         self.clients = {}
 
+        # Parse packet-ins with fast_parse; False uses the full ryu parser
+        self.use_fast_parse = True
+
+        # Stateless mode: the switch hashes new connections onto backends
+        # with SELECT groups, so VIP traffic never reaches the controller
+        self.select_groups = False
+        self.groups = lb_groups.SelectGroups(self.virtual_ip, self.virtual_mac)
+        self.datapaths = {}
+
+        # Proactive mode: ARP for the VIP and from backends is answered by
+        # the switch, and the return path is one flow per backend
+        self.proactive = False
+        self.proactive_flows = lb_proactive.ProactiveFlows(self.virtual_ip, self.virtual_mac)
+
+        # Warm restart (lb_persist.py): clients and rotation counters are
+        # logged to state_path and reloaded; clients also come back from
+        # each switch's reverse flows when it connects
+        self.warm_restart = False
+        self.state_path = "lb_rr_state.sqlite"
+        self.store = None
+        self.flow_dumps = {}  # dpid -> (xid, flow stats so far)
+
+        # Instrumentation (lb_instrument.py): per-stage packet-in timings,
+        # event counts and sampled logs, served by lb_stats_rest.py
+        self.instrumentation = False
+        self.instruments = lb_instrument.Instruments(sample_every=100)
+
+        # Switch buffering (lb_buffering.py): switches that can buffer send
+        # only the first miss_send_len bytes of a missed packet, and the
+        # packet is released by buffer_id
+        self.switch_buffering = False
+        self.miss_send_len = lb_buffering.MISS_SEND_LEN
+
     # Table-miss flow
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         dp = ev.msg.datapath
         parser = dp.ofproto_parser
         ofproto = dp.ofproto
-        match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(dp, 0, match, actions)
-        self.logger.info("Table-miss flow installed on switch %s", dp.id)
+        max_len = None
+        if self.switch_buffering and lb_buffering.can_buffer(ev.msg):
+            max_len = self.miss_send_len
+            lb_buffering.set_config(dp, max_len)
+            self.meters.max_len[dp.id] = max_len
+            self.logger.info("Switch %s buffers missed packets, %d bytes sent up", dp.id, max_len)
+        elif self.switch_buffering:
+            self.logger.info("Switch %s has no packet buffers, whole packets sent up", dp.id)
+        if self.packet_in_meters:
+            self._sync_meters(dp)
+        else:
+            match = parser.OFPMatch()
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                              lb_buffering.controller_max_len(dp, max_len))]
+            self.add_flow(dp, 0, match, actions)
+            self.logger.info("Table-miss flow installed on switch %s", dp.id)
+
+        self.datapaths[dp.id] = dp
+        if self.warm_restart:
+            self._open_store()
+            self.flow_dumps[dp.id] = (lb_persist.request_flow_dump(dp), [])
+        self.groups.forget(dp.id)
+        self.flow_queues.forget(dp.id)
+        self.traffic.forget(dp.id)
+        if self.traffic_stats:
+            self.traffic.start_polling(self.datapaths)
+        if self.batch_flow_mods:
+            self.flow_queues.start_reporting(self.logger)
+        if self.select_groups:
+            self.groups.sync(dp, {None: self.live_backends})
+            self.logger.info("SELECT groups installed on switch %s", dp.id)
+        if self.proactive:
+            self.proactive_flows.sync(dp, self.backends, self.meters.max_len.get(dp.id))
+            self.logger.info("Proactive ARP and reverse flows installed on switch %s", dp.id)
+        if self.health_checks:
+            self.health.start()
 
     # Add flow helper
-    def add_flow(self, dp, priority, match, actions, idle_timeout=0, hard_timeout=0):
+    def add_flow(self, dp, priority, match, actions, idle_timeout=0, hard_timeout=0, cookie=0,
+                 buffer_id=None):
         parser = dp.ofproto_parser
         ofproto = dp.ofproto
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=dp, priority=priority,
                                 match=match, instructions=inst,
                                 idle_timeout=idle_timeout,
-                                hard_timeout=hard_timeout)
-        dp.send_msg(mod)
+                                hard_timeout=hard_timeout,
+                                cookie=cookie,
+                                buffer_id=ofproto.OFP_NO_BUFFER if buffer_id is None else buffer_id)
+        self._send(dp, mod)
+
+    def _send(self, dp, msg):
+        # Packet-in path messages go through the datapath's queue when batching
+        if self.instrumentation:
+            self.instruments.stage("build")
+        if self.batch_flow_mods:
+            self.flow_queues.send(dp, msg)
+        else:
+            dp.send_msg(msg)
+        if self.instrumentation:
+            self.instruments.stage("send")
+
+    def _log(self, event, msg, *args):
+        # Per-event info log, sampled when instrumented
+        if self.instrumentation:
+            self.instruments.log(self.logger, event, msg, *args)
+        else:
+            self.logger.info(msg, *args)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        # Switch gone: stop polling it and drop what was kept for it
+        if ev.datapath.id is not None:
+            self.datapaths.pop(ev.datapath.id, None)
+            self.flow_dumps.pop(ev.datapath.id, None)
+            self.groups.forget(ev.datapath.id)
+            self.flow_queues.forget(ev.datapath.id)
+            self.meters.forget(ev.datapath.id)
+            self.traffic.forget(ev.datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        self.flow_queues.barrier_reply(ev.msg.datapath, ev.msg.xid)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        dp = ev.msg.datapath
+        dump = self.flow_dumps.get(dp.id)
+        if dump is not None and dump[0] == ev.msg.xid:
+            dump[1].extend(ev.msg.body)
+            if not ev.msg.flags & dp.ofproto.OFPMPF_REPLY_MORE:
+                del self.flow_dumps[dp.id]
+                self._rebuild_from_flows(dp, dump[1])
+            return
+        if self.traffic.is_poll(dp.id, ev.msg.xid):
+            self.traffic.stats_reply(dp.id, ev.msg.body, ev.msg.flags & dp.ofproto.OFPMPF_REPLY_MORE,
+                                     self.backends)
+
+    # Packet-in meters
+    def _sync_meters(self, dp):
+        self.meters.sync(dp)
+        self.proactive_flows.arp_meter = lb_meters.ARP_METER
+        if self.meters.per_port:
+            dp.send_msg(dp.ofproto_parser.OFPPortDescStatsRequest(dp, 0))
+        self.meters.start_polling(self.datapaths, self.meter_poll_interval)
+        self.logger.info("Metered table-miss and ARP flows installed on switch %s", dp.id)
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def _port_desc_handler(self, ev):
+        dp = ev.msg.datapath
+        if self.packet_in_meters:
+            self.meters.sync_ports(dp, [p.port_no for p in ev.msg.body if p.port_no <= dp.ofproto.OFPP_MAX],
+                                   skip=[b["port"] for b in self.backends])
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def _meter_stats_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        self.meters.stats_reply(dpid, ev.msg.body)
+        packets, delivered, dropped = self.meters.report(dpid)["all"]
+        self.logger.info("Switch %s to-controller packets: %d, delivered %d, dropped by meters %d%s",
+                         dpid, packets, delivered, dropped,
+                         "".join(", port %s dropped %d" % p for p in self.meters.noisiest(dpid)))
 
     # Packet-in handler
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        if self.instrumentation:
+            self.instruments.start()
+            try:
+                forwarded = self._handle_packet_in(ev)
+            finally:
+                self.instruments.finish()
+        else:
+            forwarded = self._handle_packet_in(ev)
+        if not forwarded and lb_buffering.is_buffered(ev.msg):
+            # Answered, ignored or dropped: free the switch buffer
+            self._send(ev.msg.datapath, lb_buffering.release(ev.msg))
+
+    def _handle_packet_in(self, ev):
         msg = ev.msg
         dp = msg.datapath
         parser = dp.ofproto_parser
-        ofproto = dp.ofproto
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if self.use_fast_parse:
+            hdr = fast_parse.parse(msg.data)
+        else:
+            hdr = fast_parse.from_packet(packet.Packet(msg.data))
+        if self.instrumentation:
+            self.instruments.stage("parse")
+        if hdr is None or hdr.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
+
+        if self.proactive and msg.table_id == lb_proactive.delivery_table:
+            # Backend reply for a client whose delivery flow idled out
+            c = self.clients.get(hdr.ip_dst)
+            if c is not None:
+                actions = self.proactive_flows.redeliver(dp, hdr.ip_dst, c)
+                self._send(dp, lb_buffering.packet_out(dp, msg, in_port, actions))
+                return True
             return
 
         # Handle ARP
-        arp_pkt = pkt.get_protocol(arp.arp)
-        if arp_pkt and arp_pkt.opcode == arp.ARP_REQUEST:
+        if hdr.arp_op == arp.ARP_REQUEST:
             # learn client
-            self.clients[arp_pkt.src_ip] = {"mac": eth.src, "port": in_port}
+            self._learn_client(hdr.arp_src_ip, hdr.eth_src, in_port)
+            if self.instrumentation:
+                self.instruments.stage("classify")
 
             # Client asking for VIP
-            if arp_pkt.dst_ip == self.virtual_ip:
-                self.logger.info("Replying to ARP for VIP %s from client %s (port %s)",
-                                 self.virtual_ip, arp_pkt.src_ip, in_port)
-                self._send_arp_reply(dp, eth.src, arp_pkt.src_ip, in_port,
+            if hdr.arp_dst_ip == self.virtual_ip:
+                if self.proactive:
+                    # The switch already replied; this is the copy for learning
+                    self.proactive_flows.add_client(dp, hdr.arp_src_ip, hdr.eth_src, in_port)
+                    return
+                self._log("arp_vip", "Replying to ARP for VIP %s from client %s (port %s)",
+                          self.virtual_ip, hdr.arp_src_ip, in_port)
+                self._send_arp_reply(dp, hdr.eth_src, hdr.arp_src_ip, in_port,
                                      self.virtual_mac, self.virtual_ip)
+                if self.select_groups:
+                    # Connections will not show up as packet-ins; set up the return path now
+                    for b in self.backends:
+                        self._install_reverse_flow(dp, b["ip"], hdr.arp_src_ip)
                 return
 
             # Backend asking for client
-            if arp_pkt.dst_ip in self.clients:
-                c = self.clients[arp_pkt.dst_ip]
-                self.logger.info("Replying to ARP for client %s from backend %s (port %s)",
-                                 arp_pkt.dst_ip, arp_pkt.src_ip, in_port)
-                self._send_arp_reply(dp, eth.src, arp_pkt.src_ip, in_port,
-                                     c["mac"], arp_pkt.dst_ip)
+            if hdr.arp_dst_ip in self.clients:
+                c = self.clients[hdr.arp_dst_ip]
+                self._log("arp_client", "Replying to ARP for client %s from backend %s (port %s)",
+                          hdr.arp_dst_ip, hdr.arp_src_ip, in_port)
+                self._send_arp_reply(dp, hdr.eth_src, hdr.arp_src_ip, in_port,
+                                     c["mac"], hdr.arp_dst_ip)
                 return
 
 
         # Handle IPv4
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        if not ip_pkt:
+        if hdr.ip_src is None:
             return
 
         # learn new client
-        if ip_pkt.src not in self.clients and in_port >= 4:
-            self.clients[ip_pkt.src] = {"mac": eth.src, "port": in_port}
-            self.logger.info("Learned new client %s at port %s", ip_pkt.src, in_port)
+        if hdr.ip_src not in self.clients and in_port >= 4:
+            self._learn_client(hdr.ip_src, hdr.eth_src, in_port)
+            self._log("new_client", "Learned new client %s at port %s", hdr.ip_src, in_port)
+            if self.proactive:
+                self.proactive_flows.add_client(dp, hdr.ip_src, hdr.eth_src, in_port)
 
 
+        if self.instrumentation:
+            self.instruments.stage("classify")
+
         # Client → VIP
-        if ip_pkt.dst == self.virtual_ip:
+        if hdr.ip_dst == self.virtual_ip:
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                    ipv4_dst=self.virtual_ip,
+                                    ipv4_src=hdr.ip_src)
+            pending = self.flow_queues.installing(dp, match, 10) if self.batch_flow_mods else None
+            if pending:
+                # Flow for this client is on its way: forward along it, don't rotate again
+                self._send(dp, lb_buffering.packet_out(dp, msg, in_port, pending.instructions[0].actions))
+                return True
+
+            backends = self.live_backends
+            if not backends:
+                self.logger.warning("No healthy backend for client %s", hdr.ip_src)
+                return
             # get or initialize client rotation index
-            idx = self.client_rr.get(ip_pkt.src, 0)
-            backend = self.backends[idx]
+            idx = self.client_rr.get(hdr.ip_src, 0) % len(backends)
+            backend = backends[idx]
             # update client-specific index
-            self.client_rr[ip_pkt.src] = (idx + 1) % len(self.backends)
+            self.client_rr[hdr.ip_src] = (idx + 1) % len(backends)
+            if self.store is not None:
+                self.store.put("rr", hdr.ip_src, self.client_rr[hdr.ip_src])
+            if self.instrumentation:
+                self.instruments.stage("select")
 
-            self.logger.info("Client %s -> VIP %s -> backend %s (port %s) [rr=%s]",
-                             ip_pkt.src, self.virtual_ip,
-                             backend["ip"], backend["port"], self.client_rr[ip_pkt.src])
+            self._log("client_to_vip", "Client %s -> VIP %s -> backend %s (port %s) [rr=%s]",
+                      hdr.ip_src, self.virtual_ip,
+                      backend["ip"], backend["port"], self.client_rr[hdr.ip_src])
 
             actions = [
                 parser.OFPActionSetField(ipv4_dst=backend["ip"]),
@@ -119,43 +349,117 @@ class RoundRobinLB(app_manager.RyuApp):
                 parser.OFPActionSetField(eth_src=self.virtual_mac),
                 parser.OFPActionOutput(backend["port"]),
             ]
-            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
-                                    ipv4_dst=self.virtual_ip,
-                                    ipv4_src=ip_pkt.src)
-            self.add_flow(dp, 10, match, actions, idle_timeout=30)
-
-            out = parser.OFPPacketOut(datapath=dp,
-                                      buffer_id=ofproto.OFP_NO_BUFFER,
-                                      in_port=in_port,
-                                      actions=actions,
-                                      data=msg.data)
-            dp.send_msg(out)
-            return
+            buffer_id = lb_buffering.flow_buffer_id(msg, self.batch_flow_mods)
+            self.add_flow(dp, 10, match, actions, idle_timeout=30,
+                          cookie=self._cookie(lb_cookie.KIND_SESSION, backend["ip"]), buffer_id=buffer_id)
+
+            if buffer_id is None:
+                self._send(dp, lb_buffering.packet_out(dp, msg, in_port, actions))
+            return True
 
         
         # Backend → Client
         backend_ips = [b["ip"] for b in self.backends]
-        if ip_pkt.src in backend_ips and ip_pkt.dst in self.clients:
-            c = self.clients[ip_pkt.dst]
-            actions = [
-                parser.OFPActionSetField(ipv4_src=self.virtual_ip),
-                parser.OFPActionSetField(eth_src=self.virtual_mac),
-                parser.OFPActionSetField(eth_dst=c["mac"]),
-                parser.OFPActionOutput(c["port"]),
-            ]
-            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
-                                    ipv4_src=ip_pkt.src,
-                                    ipv4_dst=ip_pkt.dst)
-            self.add_flow(dp, 10, match, actions, idle_timeout=30)
-
-            out = parser.OFPPacketOut(datapath=dp,
-                                      buffer_id=ofproto.OFP_NO_BUFFER,
-                                      in_port=in_port,
-                                      actions=actions,
-                                      data=msg.data)
-            dp.send_msg(out)
+        if hdr.ip_src in backend_ips and hdr.ip_dst in self.clients:
+            if self.instrumentation:
+                self.instruments.count("backend_to_client")
+            buffer_id = lb_buffering.flow_buffer_id(msg, self.batch_flow_mods)
+            actions = self._install_reverse_flow(dp, hdr.ip_src, hdr.ip_dst, buffer_id)
+            if buffer_id is None:
+                self._send(dp, lb_buffering.packet_out(dp, msg, in_port, actions))
+            return True
+
+
+    def _install_reverse_flow(self, dp, backend_ip, client_ip, buffer_id=None):
+        # Backend -> client flow: rewrite the source back to the VIP
+        parser = dp.ofproto_parser
+        c = self.clients[client_ip]
+        actions = [
+            parser.OFPActionSetField(ipv4_src=self.virtual_ip),
+            parser.OFPActionSetField(eth_src=self.virtual_mac),
+            parser.OFPActionSetField(eth_dst=c["mac"]),
+            parser.OFPActionOutput(c["port"]),
+        ]
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                ipv4_src=backend_ip,
+                                ipv4_dst=client_ip)
+        self.add_flow(dp, 10, match, actions, idle_timeout=30,
+                      cookie=self._cookie(lb_cookie.KIND_REVERSE, backend_ip), buffer_id=buffer_id)
+        return actions
+
+    def _learn_client(self, ip, mac, port):
+        old = self.clients.get(ip)
+        self.clients[ip] = {"mac": mac, "port": port}
+        if self.store is not None and old != self.clients[ip]:
+            self.store.put("client", ip, self.clients[ip])
+
+    # Warm restart
+    def _open_store(self):
+        if self.store is not None:
             return
+        store = lb_persist.StateStore(self.state_path)
+        for ip, c in store.get("client").items():
+            self.clients[ip] = {"mac": c["mac"], "port": c["port"]}
+        for ip, idx in store.get("rr").items():
+            self.client_rr[ip] = idx
+        self.store = store
+        self.store.start()
+        self.logger.info("Warm restart: %d clients and %d rotation counters loaded from %s",
+                         len(self.clients), len(self.client_rr), self.state_path)
+
+    def _rebuild_from_flows(self, dp, stats):
+        # Clients the store missed, from their reverse flows
+        added = 0
+        for stat in stats:
+            client = lb_persist.client_from_flow(stat)
+            if client is not None and client[0] not in self.clients:
+                self._learn_client(*client)
+                added += 1
+        self.logger.info("Switch %s flow dump: %d LB flows, %d clients added", dp.id, len(stats), added)
+
+    def _cookie(self, kind, backend_ip):
+        # Flow cookie carrying the backend's index in self.backends
+        for i, b in enumerate(self.backends):
+            if b["ip"] == backend_ip:
+                return lb_cookie.make(kind, i)
+        return lb_cookie.make(kind)
+
+    def update_backends(self, backends):
+        # Replace the backend list; SELECT groups are modified in place and
+        # proactive flows reinstalled
+        lb_cookie.check_backends(backends)
+        self.backends = backends
+        self.health.set_backends(backends)
+        self.live_backends = self.health.healthy(backends)
+        self._sync_datapaths()
+
+    def _sync_datapaths(self):
+        self.flow_queues.flush_all()
+        for dp in self.datapaths.values():
+            if self.select_groups:
+                self.groups.sync(dp, {None: self.live_backends})
+            if self.proactive:
+                self.proactive_flows.sync(dp, self.backends, self.meters.max_len.get(dp.id))
 
+    def _health_changed(self, down, up):
+        # Health checker callback: rotate over the healthy backends only and
+        # flush every flow that still points at a failed one
+        self.flow_queues.flush_all()
+        for b in down:
+            self.logger.warning("Backend %s is down (%s)", b["ip"], self.health.state[b["ip"]].error)
+        for b in up:
+            self.logger.warning("Backend %s is up again", b["ip"])
+        self.live_backends = self.health.healthy(self.backends)
+        for dp in self.datapaths.values():
+            parser = dp.ofproto_parser
+            ofproto = dp.ofproto
+            for b in down:
+                cookie, mask = lb_cookie.backend_match(self.backends.index(b))
+                dp.send_msg(parser.OFPFlowMod(datapath=dp, table_id=ofproto.OFPTT_ALL,
+                                              command=ofproto.OFPFC_DELETE, cookie=cookie, cookie_mask=mask,
+                                              out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                              match=parser.OFPMatch()))
+        self._sync_datapaths()
 
     # Send ARP reply helper
     def _send_arp_reply(self, dp, dst_mac, dst_ip, out_port,
@@ -180,6 +484,6 @@ class RoundRobinLB(app_manager.RyuApp):
                                   in_port=ofproto.OFPP_CONTROLLER,
                                   actions=actions,
                                   data=pkt.data)
-        dp.send_msg(out)
-        self.logger.info("Sent ARP reply: %s is-at %s -> %s (%s) via port %s",
-                         src_ip, src_mac, dst_ip, dst_mac, out_port)
+        self._send(dp, out)
+        self._log("arp_reply", "Sent ARP reply: %s is-at %s -> %s (%s) via port %s",
+                  src_ip, src_mac, dst_ip, dst_mac, out_port)
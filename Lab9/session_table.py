@@ -0,0 +1,174 @@
+"""
+Session state for L4StatefulLB with bounded memory.
+
+Sessions are created when a client's first packet for a service reaches the
+controller. They end when the switch reports that their flow was removed
+(idle timeout, delete), or when the controller sees FIN/RST. A hierarchical
+timer wheel is the backstop: every session and client has a deadline, and
+when one passes the app checks whether the flow is still there (FlowRemoved
+can be lost, for example when a switch reconnects) instead of keeping the
+entry forever. Scheduling, cancelling and expiring timers are O(1) per
+timer, so the table only ever holds live sessions and recently active
+clients.
+"""
+
+import lb_cookie
+
+
+class Session(object):
+    __slots__ = ("id", "client_ip", "service_port", "backend", "dpid", "created")
+
+    def __init__(self, sid, client_ip, service_port, backend, dpid, created):
+        self.id = sid
+        self.client_ip = client_ip
+        self.service_port = service_port
+        self.backend = backend
+        self.dpid = dpid
+        self.created = created
+
+    def __repr__(self):
+        return "Session(%d, %s:%s -> %s)" % (self.id, self.client_ip, self.service_port,
+                                              self.backend["ip"])
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timing wheel. Level L has `slots` buckets of slots**L ticks
+    each. A timer goes to the lowest level whose span still covers its
+    deadline, and moves down a level each time the level above turns over.
+    With 64 slots and 4 levels at 1 s per tick it covers about 194 days.
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=4, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self.where = {}  # key -> (level, slot)
+        self.current = int(now / tick)
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def _place(self, key, due):
+        level = 0
+        span = self.slots
+        while level < self.levels - 1 and due // span != self.current // span:
+            level += 1
+            span *= self.slots
+        slot = (due // (span // self.slots)) % self.slots
+        self.wheels[level][slot][key] = due
+        self.where[key] = (level, slot)
+
+    def schedule(self, key, when):
+        # (Re)schedule key to fire at time `when`
+        self.cancel(key)
+        self._place(key, max(int(when / self.tick), self.current + 1))
+
+    def cancel(self, key):
+        pos = self.where.pop(key, None)
+        if pos is not None:
+            del self.wheels[pos[0]][pos[1]][key]
+
+    def advance(self, now):
+        """Move the wheel to `now`; returns the keys whose deadline passed."""
+        target = int(now / self.tick)
+        fired = []
+        if not self.where:
+            self.current = max(self.current, target)
+            return fired
+        while self.current < target:
+            self.current += 1
+            span = self.slots
+            for level in range(1, self.levels):
+                if self.current % span:
+                    break
+                # Level turned over: spread its next bucket over the levels below
+                bucket = self.wheels[level][(self.current // span) % self.slots]
+                if bucket:
+                    items = list(bucket.items())
+                    bucket.clear()
+                    for key, due in items:
+                        self._place(key, due)
+                span *= self.slots
+            slot = self.current % self.slots
+            bucket = self.wheels[0][slot]
+            if bucket:
+                for key in list(bucket):
+                    if bucket[key] <= self.current:
+                        del bucket[key]
+                        del self.where[key]
+                        fired.append(key)
+                if not bucket:
+                    # A fresh dict, so a burst of timers does not pin a big table
+                    self.wheels[0][slot] = {}
+        return fired
+
+
+class SessionTable(object):
+    def __init__(self, now=0.0, tick=1.0):
+        self.by_id = {}
+        self.by_key = {}        # (client_ip, service_port) -> Session
+        self.per_client = {}    # client_ip -> open session count
+        self.next_id = 1
+        self.wheel = TimerWheel(tick, now=now)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(list(self.by_id.values()))
+
+    def _new_id(self):
+        # Ids sized for the flow cookie's session field; skip ids still in use after a wrap
+        sid = self.next_id
+        while sid in self.by_id or sid == 0:
+            sid = (sid + 1) & lb_cookie.SESSION_MASK
+        self.next_id = (sid + 1) & lb_cookie.SESSION_MASK
+        return sid
+
+    def get(self, client_ip, service_port):
+        return self.by_key.get((client_ip, service_port))
+
+    def open(self, client_ip, service_port, backend, dpid, now, backstop):
+        s = Session(self._new_id(), client_ip, service_port, backend, dpid, now)
+        self.by_id[s.id] = s
+        self.by_key[(client_ip, service_port)] = s
+        self.per_client[client_ip] = self.per_client.get(client_ip, 0) + 1
+        self.wheel.schedule(("session", s.id), now + backstop)
+        return s
+
+    def restore(self, sid, client_ip, service_port, backend, dpid, created, due):
+        """A session rebuilt after a restart, keeping its id (and so its flow cookie)."""
+        old = self.get(client_ip, service_port)
+        if old is not None and old.id != sid:
+            self.close(old.id)
+        if sid in self.by_id:
+            self.close(sid)
+        s = Session(sid, client_ip, service_port, backend, dpid, created)
+        self.by_id[sid] = s
+        self.by_key[(client_ip, service_port)] = s
+        self.per_client[client_ip] = self.per_client.get(client_ip, 0) + 1
+        self.wheel.schedule(("session", sid), due)
+        # New ids continue after the restored ones
+        self.next_id = max(self.next_id, (sid + 1) & lb_cookie.SESSION_MASK)
+        return s
+
+    def close(self, sid):
+        s = self.by_id.pop(sid, None)
+        if s is None:
+            return None
+        del self.by_key[(s.client_ip, s.service_port)]
+        n = self.per_client[s.client_ip] - 1
+        if n:
+            self.per_client[s.client_ip] = n
+        else:
+            del self.per_client[s.client_ip]
+        self.wheel.cancel(("session", sid))
+        return s
+
+    def client_sessions(self, client_ip):
+        return self.per_client.get(client_ip, 0)
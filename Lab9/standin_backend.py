@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Stand-in backend server for trying out the LB health checks.
+
+Serves a one-line HTTP answer on every given port. Run it on the Mininet
+backends (h1 python3 standin_backend.py --ports 8080 8181 &) or locally on
+loopback addresses. To make it fail:
+
+    kill <pid>          connection refused: TCP and HTTP checks fail
+    kill -USR1 <pid>    toggles "sick" mode: still accepts connections but
+                        answers 503, so only HTTP checks fail
+"""
+
+import argparse
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sick = False
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        code = 503 if sick else 200
+        body = ("%s %s:%d\n" % ("sick" if sick else "ok", self.server.server_address[0],
+                                self.server.server_address[1])).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def toggle_sick(signum, frame):
+    global sick
+    sick = not sick
+    print("sick" if sick else "healthy", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in LB backend")
+    parser.add_argument("--ip", default="0.0.0.0")
+    parser.add_argument("--ports", type=int, nargs="+", default=[8080])
+    parser.add_argument("--sick", action="store_true", help="start in sick (503) mode")
+    args = parser.parse_args()
+
+    global sick
+    sick = args.sick
+    signal.signal(signal.SIGUSR1, toggle_sick)
+
+    servers = [ThreadingHTTPServer((args.ip, port), Handler) for port in args.ports]
+    for srv in servers[1:]:
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    print("serving on %s ports %s" % (args.ip, " ".join(map(str, args.ports))), flush=True)
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
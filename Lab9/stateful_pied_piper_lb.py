@@ -1,8 +1,26 @@
+import time
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
+from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet, ethernet, ipv4, arp, tcp, ether_types
+from ryu.lib.packet import packet, ethernet, arp, tcp, ether_types
+
+import fast_parse
+import flow_budget
+import flow_queue
+import health_check
+import lb_buffering
+import lb_cookie
+import lb_groups
+import lb_instrument
+import lb_meters
+import lb_persist
+import lb_proactive
+import lb_stats
+import lb_strategies
+import session_table
 
 
 class L4StatefulLB(app_manager.RyuApp):
@@ -21,14 +39,91 @@ class L4StatefulLB(app_manager.RyuApp):
         self.virtual_ip = "10.0.0.100"
         self.virtual_mac = "00:00:00:00:ff:ff"
 
-        # State: { client_ip: { service_port: backend_dict } }
-        self.state = {}
+        # Sessions (client, service -> backend), ended by FlowRemoved
+        self.idle_timeout = 60
+        self.sessions = session_table.SessionTable(now=time.time())
+        # Backstop if no FlowRemoved arrives: check the flow after this long
+        self.session_backstop = 2 * self.idle_timeout
+        self.stats_probes = {}  # flow-stats xid -> session id
 
-        # Clients: { client_ip: { mac, port } }
+        # Clients: { client_ip: { mac, port, seen } }, dropped when idle without sessions
         self.clients = {}
+        self.client_timeout = 300
+
+        # Active health checks (health_check.py): failed backends leave the
+        # pools and their flows are flushed. Started at the first switch.
+        self.health_checks = False
+        self.health = health_check.HealthChecker(self._health_changed)
+        self.health.set_backends(self.backends)
+
+        # Backend selection: one precomputed pool per service port, built
+        # from the healthy backends.
+        # Strategies: round_robin, weighted (uses b["weight"]), least_conn, maglev
+        self.strategy = "round_robin"
+        self.pools = lb_strategies.build_pools(self.backends, self.strategy)
+        self.backend_index = {b["ip"]: i for i, b in enumerate(self.backends)}
+
+        # Parse packet-ins with fast_parse; False uses the full ryu parser
+        self.use_fast_parse = True
+
+        # Stateless mode: the switch hashes new connections onto backends
+        # with SELECT groups, so VIP traffic never reaches the controller
+        self.select_groups = False
+        self.groups = lb_groups.SelectGroups(self.virtual_ip, self.virtual_mac)
+        self.datapaths = {}
+
+        # Proactive mode: ARP for the VIP and from backends is answered by
+        # the switch, and the return path is one flow per backend
+        self.proactive = False
+        self.proactive_flows = lb_proactive.ProactiveFlows(self.virtual_ip, self.virtual_mac,
+                                                           ip_proto=6,
+                                                           client_idle_timeout=self.client_timeout)
+
+        # Queue FlowMods/PacketOuts per switch (flow_queue.py): duplicate
+        # flow-mods are dropped, each batch is one write and ends with a barrier
+        self.batch_flow_mods = False
+        self.flow_queues = flow_queue.FlowQueues()
+
+        # Packet-in limits (lb_meters.py): table-miss and ARP-to-controller
+        # flows go through OpenFlow meters, per in_port with per_port=True
+        self.packet_in_meters = False
+        self.meters = lb_meters.PacketInMeters(rate=500, arp_rate=100, port_rate=50, per_port=False)
+        self.meter_poll_interval = 10
+
+        # Traffic accounting (lb_stats.py): one flow-stats request per switch
+        # per interval, summed per backend, service and client; served by
+        # lb_stats_rest.py
+        self.traffic_stats = False
+        self.traffic = lb_stats.TrafficStats(interval=5, window=60)
 
-        # RR index per service
-        self.next_backend = {8080: 0, 8181: 0}
+        # Flow-table budget (flow_budget.py): session flows tracked in LRU
+        # order per switch, coarser flows and eviction as the table fills
+        self.flow_budget = False
+        self.budget = flow_budget.FlowBudget(capacity=2000)
+        self.budget_poll_interval = 10
+        self.last_budget_poll = 0.0
+
+        # Warm restart (lb_persist.py): sessions and clients are logged to
+        # state_path and reloaded, and each switch's LB flows are read back
+        # when it connects
+        self.warm_restart = False
+        self.state_path = "lb_state.sqlite"
+        self.store = None
+        self.restored = set()   # session ids from the store, not yet confirmed by a flow dump
+        self.flow_dumps = {}    # dpid -> (xid, flow stats so far)
+
+        # Instrumentation (lb_instrument.py): per-stage packet-in timings,
+        # event counts and sampled logs, served by lb_stats_rest.py
+        self.instrumentation = False
+        self.instruments = lb_instrument.Instruments(sample_every=100)
+
+        # Switch buffering (lb_buffering.py): switches that can buffer send
+        # only the first miss_send_len bytes of a missed packet, and the
+        # packet is released by buffer_id
+        self.switch_buffering = False
+        self.miss_send_len = lb_buffering.MISS_SEND_LEN
+
+        self.expiry_thread = hub.spawn(self._expiry_loop)
 
     # Table-miss flow
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -37,76 +132,219 @@ class L4StatefulLB(app_manager.RyuApp):
         parser = dp.ofproto_parser
         ofproto = dp.ofproto
 
-        match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
-        self._add_flow(dp, 0, match, actions)
-        self.logger.info("Table-miss installed on switch %s", dp.id)
+        max_len = None
+        if self.switch_buffering and lb_buffering.can_buffer(ev.msg):
+            max_len = self.miss_send_len
+            lb_buffering.set_config(dp, max_len)
+            self.meters.max_len[dp.id] = max_len
+            self.logger.info("Switch %s buffers missed packets, %d bytes sent up", dp.id, max_len)
+        elif self.switch_buffering:
+            self.logger.info("Switch %s has no packet buffers, whole packets sent up", dp.id)
+        if self.packet_in_meters:
+            self._sync_meters(dp)
+        else:
+            match = parser.OFPMatch()
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                              lb_buffering.controller_max_len(dp, max_len))]
+            self._add_flow(dp, 0, match, actions)
+            self.logger.info("Table-miss installed on switch %s", dp.id)
+
+        self.datapaths[dp.id] = dp
+        if self.warm_restart:
+            self._open_store()
+            self.flow_dumps[dp.id] = (lb_persist.request_flow_dump(dp), [])
+        self.groups.forget(dp.id)
+        self.flow_queues.forget(dp.id)
+        self.traffic.forget(dp.id)
+        if self.traffic_stats:
+            self.traffic.start_polling(self.datapaths)
+        self.budget.forget(dp.id)
+        if self.batch_flow_mods:
+            self.flow_queues.start_reporting(self.logger)
+        if self.select_groups:
+            self.groups.sync(dp, self._group_pools())
+            self.logger.info("SELECT groups installed on switch %s", dp.id)
+        if self.proactive:
+            self.proactive_flows.sync(dp, self.backends, self.meters.max_len.get(dp.id))
+            self.logger.info("Proactive ARP and reverse flows installed on switch %s", dp.id)
+        if self.health_checks:
+            self.health.start()
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.datapaths.pop(ev.datapath.id, None)
+            self.flow_dumps.pop(ev.datapath.id, None)
+            self.groups.forget(ev.datapath.id)
+            self.flow_queues.forget(ev.datapath.id)
+            self.meters.forget(ev.datapath.id)
+            self.traffic.forget(ev.datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        self.flow_queues.barrier_reply(ev.msg.datapath, ev.msg.xid)
+
+    # Packet-in meters
+    def _sync_meters(self, dp):
+        self.meters.sync(dp)
+        self.proactive_flows.arp_meter = lb_meters.ARP_METER
+        if self.meters.per_port:
+            dp.send_msg(dp.ofproto_parser.OFPPortDescStatsRequest(dp, 0))
+        self.meters.start_polling(self.datapaths, self.meter_poll_interval)
+        self.logger.info("Metered table-miss and ARP flows installed on switch %s", dp.id)
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def _port_desc_handler(self, ev):
+        dp = ev.msg.datapath
+        if self.packet_in_meters:
+            self.meters.sync_ports(dp, [p.port_no for p in ev.msg.body if p.port_no <= dp.ofproto.OFPP_MAX],
+                                   skip=[b["port"] for b in self.backends])
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def _meter_stats_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        self.meters.stats_reply(dpid, ev.msg.body)
+        packets, delivered, dropped = self.meters.report(dpid)["all"]
+        self.logger.info("Switch %s to-controller packets: %d, delivered %d, dropped by meters %d%s",
+                         dpid, packets, delivered, dropped,
+                         "".join(", port %s dropped %d" % p for p in self.meters.noisiest(dpid)))
+
+    def _send(self, dp, msg):
+        # Packet-in path messages go through the datapath's queue when batching
+        if self.instrumentation:
+            self.instruments.stage("build")
+        if self.batch_flow_mods:
+            self.flow_queues.send(dp, msg)
+        else:
+            dp.send_msg(msg)
+        if self.instrumentation:
+            self.instruments.stage("send")
+
+    def _log(self, event, msg, *args):
+        # Per-event info log, sampled when instrumented
+        if self.instrumentation:
+            self.instruments.log(self.logger, event, msg, *args)
+        else:
+            self.logger.info(msg, *args)
 
-    def _add_flow(self, dp, priority, match, actions, idle_timeout=0, hard_timeout=0):
+    def _add_flow(self, dp, priority, match, actions, idle_timeout=0, hard_timeout=0,
+                  cookie=0, flags=0, buffer_id=None):
         parser = dp.ofproto_parser
         ofproto = dp.ofproto
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=dp, priority=priority,
                                 match=match, instructions=inst,
                                 idle_timeout=idle_timeout,
-                                hard_timeout=hard_timeout)
-        dp.send_msg(mod)
+                                hard_timeout=hard_timeout,
+                                cookie=cookie, flags=flags,
+                                buffer_id=ofproto.OFP_NO_BUFFER if buffer_id is None else buffer_id)
+        self._send(dp, mod)
 
     # Packet-in
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        if self.instrumentation:
+            self.instruments.start()
+            try:
+                forwarded = self._handle_packet_in(ev)
+            finally:
+                self.instruments.finish()
+        else:
+            forwarded = self._handle_packet_in(ev)
+        if not forwarded and lb_buffering.is_buffered(ev.msg):
+            # Answered, ignored or dropped: free the switch buffer
+            self._send(ev.msg.datapath, lb_buffering.release(ev.msg))
+
+    def _handle_packet_in(self, ev):
         msg = ev.msg
         dp = msg.datapath
         parser = dp.ofproto_parser
         ofproto = dp.ofproto
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if self.use_fast_parse:
+            hdr = fast_parse.parse(msg.data)
+        else:
+            hdr = fast_parse.from_packet(packet.Packet(msg.data))
+        if self.instrumentation:
+            self.instruments.stage("parse")
+        if hdr is None or hdr.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
+
+        if self.proactive and msg.table_id == lb_proactive.delivery_table:
+            # Backend reply for a client whose delivery flow idled out
+            c = self.clients.get(hdr.ip_dst)
+            if c is not None:
+                actions = self.proactive_flows.redeliver(dp, hdr.ip_dst, c)
+                self._send(dp, lb_buffering.packet_out(dp, msg, in_port, actions))
+                return True
             return
 
         # ARP handling
-        arp_pkt = pkt.get_protocol(arp.arp)
-        if arp_pkt and arp_pkt.opcode == arp.ARP_REQUEST:
-            self.clients[arp_pkt.src_ip] = {"mac": eth.src, "port": in_port}
-            if arp_pkt.dst_ip == self.virtual_ip:
-                self._send_arp_reply(dp, eth.src, arp_pkt.src_ip, in_port,
+        if hdr.arp_op == arp.ARP_REQUEST:
+            self._learn_client(hdr.arp_src_ip, hdr.eth_src, in_port)
+            if self.instrumentation:
+                self.instruments.stage("classify")
+            if hdr.arp_dst_ip == self.virtual_ip:
+                if self.proactive:
+                    # The switch already replied; this is the copy for learning
+                    self.proactive_flows.add_client(dp, hdr.arp_src_ip, hdr.eth_src, in_port)
+                    return
+                self._send_arp_reply(dp, hdr.eth_src, hdr.arp_src_ip, in_port,
                                      self.virtual_mac, self.virtual_ip)
-                self.logger.info("ARP reply for VIP to %s", arp_pkt.src_ip)
+                self._log("arp_vip", "ARP reply for VIP to %s", hdr.arp_src_ip)
+                if self.select_groups:
+                    # Connections will not show up as packet-ins; set up the return path now
+                    for b in self.backends:
+                        self._install_reverse_flow(dp, b["ip"], hdr.arp_src_ip)
                 return
-            if arp_pkt.dst_ip in self.clients:
-                c = self.clients[arp_pkt.dst_ip]
-                self._send_arp_reply(dp, eth.src, arp_pkt.src_ip, in_port,
-                                     c["mac"], arp_pkt.dst_ip)
+            if hdr.arp_dst_ip in self.clients:
+                c = self.clients[hdr.arp_dst_ip]
+                if self.instrumentation:
+                    self.instruments.count("arp_client")
+                self._send_arp_reply(dp, hdr.eth_src, hdr.arp_src_ip, in_port,
+                                     c["mac"], hdr.arp_dst_ip)
                 return
 
         # IPv4
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        if not ip_pkt:
+        if hdr.ip_src is None:
             return
 
-        if ip_pkt.src not in self.clients and in_port >= 4:
-            self.clients[ip_pkt.src] = {"mac": eth.src, "port": in_port}
+        if hdr.ip_src not in self.clients and in_port >= 4:
+            self._learn_client(hdr.ip_src, hdr.eth_src, in_port)
+            if self.proactive:
+                self.proactive_flows.add_client(dp, hdr.ip_src, hdr.eth_src, in_port)
 
         # --- TCP ---
-        tcp_pkt = pkt.get_protocol(tcp.tcp)
-        if not tcp_pkt:
+        if hdr.ip_proto != fast_parse.IPPROTO_TCP or hdr.dst_port is None:
             return
+        if self.instrumentation:
+            self.instruments.stage("classify")
 
         # Detect FIN or RST from either side and clear state
-        if tcp_pkt.bits & (tcp.TCP_FIN | tcp.TCP_RST):
-            self._clear_session_state(ip_pkt.src, ip_pkt.dst, tcp_pkt)
+        if hdr.tcp_flags & (tcp.TCP_FIN | tcp.TCP_RST):
+            if self.instrumentation:
+                self.instruments.count("tcp_fin")
+            self._clear_session_state(hdr.ip_src, hdr.ip_dst, hdr)
             return
 
         # Client -> VIP
-        if ip_pkt.dst == self.virtual_ip:
-            service_port = tcp_pkt.dst_port
-            backend = self._select_backend(ip_pkt.src, service_port)
-            if not backend:
+        if hdr.ip_dst == self.virtual_ip:
+            service_port = hdr.dst_port
+            if self.flow_budget:
+                self.budget.miss(dp.id)
+                granularity = self.budget.granularity(dp.id)
+            else:
+                granularity = "client"
+            key = flow_budget.session_key(granularity, hdr.ip_src, hdr.src_port)
+            session = self._select_backend(key, service_port, dp.id)
+            if self.instrumentation:
+                self.instruments.stage("select")
+                self.instruments.count("client_to_vip")
+            if not session:
                 self.logger.warning("No backend supports service port %s", service_port)
                 return
+            backend = session.backend
 
             actions = [
                 parser.OFPActionSetField(ipv4_dst=backend["ip"]),
@@ -114,87 +352,361 @@ class L4StatefulLB(app_manager.RyuApp):
                 parser.OFPActionSetField(eth_src=self.virtual_mac),
                 parser.OFPActionOutput(backend["port"]),
             ]
-            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
-                                    ip_proto=6,
-                                    ipv4_src=ip_pkt.src,
-                                    ipv4_dst=self.virtual_ip,
-                                    tcp_dst=service_port)
-            self._add_flow(dp, 20, match, actions, idle_timeout=60)
-
-            out = parser.OFPPacketOut(datapath=dp,
-                                      buffer_id=ofproto.OFP_NO_BUFFER,
-                                      in_port=in_port,
-                                      actions=actions,
-                                      data=msg.data)
-            dp.send_msg(out)
-            return
+            match = parser.OFPMatch(**flow_budget.match_fields(granularity, hdr.ip_src, hdr.src_port,
+                                                               service_port, self.virtual_ip))
+            priority = flow_budget.priorities[granularity]
+            cookie = lb_cookie.make(lb_cookie.KIND_SESSION, self.backend_index.get(backend["ip"]), session.id)
+            buffer_id = lb_buffering.flow_buffer_id(msg, self.batch_flow_mods)
+            self._add_flow(dp, priority, match, actions, idle_timeout=self.idle_timeout,
+                           cookie=cookie, flags=ofproto.OFPFF_SEND_FLOW_REM, buffer_id=buffer_id)
+            if self.flow_budget:
+                self.budget.installed(dp.id, session.id, cookie, match, priority)
+                for entry in self.budget.victims(dp.id):
+                    self._evict(dp, entry)
+
+            if buffer_id is None:
+                self._send(dp, lb_buffering.packet_out(dp, msg, in_port, actions))
+            return True
 
         # Backend -> Client
         backend_ips = [b["ip"] for b in self.backends]
-        if ip_pkt.src in backend_ips and ip_pkt.dst in self.clients:
-            c = self.clients[ip_pkt.dst]
-            actions = [
-                parser.OFPActionSetField(ipv4_src=self.virtual_ip),
-                parser.OFPActionSetField(eth_src=self.virtual_mac),
-                parser.OFPActionSetField(eth_dst=c["mac"]),
-                parser.OFPActionOutput(c["port"]),
-            ]
-            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
-                                    ip_proto=6,
-                                    ipv4_src=ip_pkt.src,
-                                    ipv4_dst=ip_pkt.dst)
-            self._add_flow(dp, 20, match, actions, idle_timeout=60)
-
-            out = parser.OFPPacketOut(datapath=dp,
-                                      buffer_id=ofproto.OFP_NO_BUFFER,
-                                      in_port=in_port,
-                                      actions=actions,
-                                      data=msg.data)
-            dp.send_msg(out)
-            return
+        if hdr.ip_src in backend_ips and hdr.ip_dst in self.clients:
+            if self.instrumentation:
+                self.instruments.count("backend_to_client")
+            buffer_id = lb_buffering.flow_buffer_id(msg, self.batch_flow_mods)
+            actions = self._install_reverse_flow(dp, hdr.ip_src, hdr.ip_dst, buffer_id)
+            if buffer_id is None:
+                self._send(dp, lb_buffering.packet_out(dp, msg, in_port, actions))
+            return True
 
     # Backend selection
-    def _select_backend(self, client_ip, service_port):
-        # Return cached mapping if exists
-        if client_ip in self.state and service_port in self.state[client_ip]:
-            return self.state[client_ip][service_port]
-
-        # Filter eligible servers
-        eligible = [b for b in self.backends if service_port in b["services"]]
-        if not eligible:
-            return None
+    def _select_backend(self, client_ip, service_port, dpid=None):
+        # Return the client's open session for this service if there is one
+        session = self.sessions.get(client_ip, service_port)
+        if session:
+            return session
 
-        # Round robin selection
-        idx = self.next_backend.get(service_port, 0)
-        backend = eligible[idx % len(eligible)]
-        self.next_backend[service_port] = (idx + 1) % len(eligible)
+        # Pick from the service's pool
+        pool = self.pools.get(service_port)
+        backend = pool.select(client_ip) if pool else None
+        if not backend:
+            return None
+        pool.acquire(backend)
 
         # Record new mapping
-        if client_ip not in self.state:
-            self.state[client_ip] = {}
-        self.state[client_ip][service_port] = backend
-
-        self.logger.info("New mapping: %s:%s -> %s", client_ip, service_port, backend["ip"])
-        return backend
+        session = self.sessions.open(client_ip, service_port, backend, dpid,
+                                     time.time(), self.session_backstop)
+        self._persist_session(session)
+        self._log("new_session", "New mapping: %s:%s -> %s", client_ip, service_port, backend["ip"])
+        return session
 
     # State cleanup
-    def _clear_session_state(self, src_ip, dst_ip, tcp_pkt):
+    def _clear_session_state(self, src_ip, dst_ip, hdr):
         """
         When TCP FIN or RST is seen from either side, remove that session state.
         """
-        service_port = tcp_pkt.dst_port if dst_ip == self.virtual_ip else tcp_pkt.src_port
-
-        # Remove state if known
-        if src_ip in self.state and service_port in self.state[src_ip]:
-            backend = self.state[src_ip].pop(service_port)
-            self.logger.info("Session ended: %s:%s (backend %s)", src_ip, service_port, backend["ip"])
-            if not self.state[src_ip]:
-                del self.state[src_ip]
-        elif dst_ip in self.state and service_port in self.state[dst_ip]:
-            backend = self.state[dst_ip].pop(service_port)
-            self.logger.info("Session ended (reverse): %s:%s (backend %s)", dst_ip, service_port, backend["ip"])
-            if not self.state[dst_ip]:
-                del self.state[dst_ip]
+        if dst_ip == self.virtual_ip:
+            client_ip, client_port, service_port, reason = src_ip, hdr.src_port, hdr.dst_port, "ended"
+        else:
+            client_ip, client_port, service_port, reason = dst_ip, hdr.dst_port, hdr.src_port, "ended (reverse)"
+
+        # Remove state if known. Per-/24 sessions are shared, one client's FIN does not end them.
+        for key in (flow_budget.session_key("5tuple", client_ip, client_port), client_ip):
+            session = self.sessions.get(key, service_port)
+            if session:
+                self._end_session(session.id, reason)
+                return
+
+    def _end_session(self, sid, reason):
+        session = self.sessions.close(sid)
+        if session is None:
+            return None
+        self.restored.discard(sid)
+        if self.store is not None:
+            self.store.delete("session", sid)
+        pool = self.pools.get(session.service_port)
+        if pool:
+            pool.release(session.backend)
+        c = self.clients.get(session.client_ip)
+        if c is not None and not self.sessions.client_sessions(session.client_ip):
+            # Last session gone: check the client when it goes idle, not a
+            # full client_timeout after its last check
+            self.sessions.wheel.schedule(("client", session.client_ip), c["seen"] + self.client_timeout)
+        self._log("session_end", "Session %s: %s:%s (backend %s)", reason, session.client_ip,
+                  session.service_port, session.backend["ip"])
+        return session
+
+    # Session lifecycle
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        if self.traffic_stats:
+            self.traffic.flow_removed(ev.msg.datapath.id, ev.msg, self.backends)
+        c = lb_cookie.decode(ev.msg.cookie)
+        if c is not None and c.kind == lb_cookie.KIND_SESSION:
+            self._end_session(c.session, "expired")
+            if self.flow_budget:
+                self.budget.removed(ev.msg.datapath.id, c.session)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        dp = ev.msg.datapath
+        dump = self.flow_dumps.get(dp.id)
+        if dump is not None and dump[0] == ev.msg.xid:
+            dump[1].extend(ev.msg.body)
+            if not ev.msg.flags & dp.ofproto.OFPMPF_REPLY_MORE:
+                del self.flow_dumps[dp.id]
+                self._rebuild_from_flows(dp, dump[1])
+            return
+        if self.traffic.is_poll(dp.id, ev.msg.xid):
+            self.traffic.stats_reply(dp.id, ev.msg.body, ev.msg.flags & dp.ofproto.OFPMPF_REPLY_MORE,
+                                     self.backends)
+            return
+        if self.budget.is_poll(dp.id, ev.msg.xid):
+            self._budget_poll_reply(dp, ev.msg)
+            return
+        sid = self.stats_probes.pop(ev.msg.xid, None)
+        if sid is None or sid not in self.sessions.by_id:
+            return
+        if ev.msg.body:
+            # Flow still installed, FlowRemoved will come later
+            self.sessions.wheel.schedule(("session", sid), time.time() + self.session_backstop)
+        else:
+            self._end_session(sid, "expired (no flow)")
+
+    def _learn_client(self, ip, mac, port):
+        old = self.clients.get(ip)
+        self.clients[ip] = {"mac": mac, "port": port, "seen": time.time()}
+        if old is None:
+            self.sessions.wheel.schedule(("client", ip), time.time() + self.client_timeout)
+        if self.store is not None and (old is None or (old["mac"], old["port"]) != (mac, port)):
+            self.store.put("client", ip, {"mac": mac, "port": port})
+
+    def _expiry_loop(self):
+        while True:
+            hub.sleep(self.sessions.wheel.tick)
+            self._expire(time.time())
+
+    def _expire(self, now):
+        for kind, key in self.sessions.wheel.advance(now):
+            if kind == "session":
+                self._check_session(key, now)
+            else:
+                self._check_client(key, now)
+        if self.flow_budget and now - self.last_budget_poll >= self.budget_poll_interval:
+            self.last_budget_poll = now
+            for dp in list(self.datapaths.values()):
+                self._poll_flow_budget(dp)
+
+    # Flow-table budget
+    def _poll_flow_budget(self, dp):
+        # Session flows' packet counts, to keep the LRU order current
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        cookie, mask = lb_cookie.kind_match(lb_cookie.KIND_SESSION)
+        req = parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                         cookie, mask, parser.OFPMatch())
+        dp.set_xid(req)
+        self.budget.poll_sent(dp.id, req.xid)
+        dp.send_msg(req)
+
+    def _budget_poll_reply(self, dp, msg):
+        more = msg.flags & dp.ofproto.OFPMPF_REPLY_MORE
+        gone = self.budget.stats_reply(dp.id, msg.xid, msg.body, more,
+                                       lambda cookie: cookie & lb_cookie.SESSION_MASK)
+        for sid in gone:
+            self._end_session(sid, "expired (not in flow stats)")
+        if more:
+            return
+        for entry in self.budget.victims(dp.id):
+            self._evict(dp, entry)
+        r = self.budget.report(dp.id)
+        self.logger.info("Switch %s flow table: %d/%d (%.0f%%), %s flows, hits %d misses %d (%.1f%% hit), "
+                         "evictions %d", dp.id, r["flows"], r["capacity"], 100 * r["occupancy"],
+                         r["granularity"], r["hits"], r["misses"], 100 * r["hit_ratio"], r["evictions"])
+
+    def _evict(self, dp, entry):
+        # Delete one cold session flow; its FlowRemoved ends the session
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        self._send(dp, parser.OFPFlowMod(datapath=dp, command=ofproto.OFPFC_DELETE_STRICT,
+                                         priority=entry.priority, match=entry.match,
+                                         cookie=entry.cookie, cookie_mask=0xFFFFFFFFFFFFFFFF,
+                                         out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY))
+
+    def _check_session(self, sid, now):
+        # Backstop fired without a FlowRemoved: ask the switch whether the flow still exists
+        session = self.sessions.by_id.get(sid)
+        if session is None:
+            return
+        dp = self.datapaths.get(session.dpid)
+        if dp is None:
+            self._end_session(sid, "expired (switch gone)")
+            return
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        cookie, mask = lb_cookie.session_match(sid)
+        req = parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                         cookie, mask, parser.OFPMatch())
+        # Retry if the reply never comes
+        self.sessions.wheel.schedule(("session", sid), now + self.session_backstop)
+        dp.set_xid(req)
+        self.stats_probes[req.xid] = sid
+        dp.send_msg(req)
+
+    def _check_client(self, ip, now):
+        c = self.clients.get(ip)
+        if c is None:
+            return
+        idle_until = c["seen"] + self.client_timeout
+        if self.sessions.client_sessions(ip) or idle_until > now:
+            self.sessions.wheel.schedule(("client", ip), max(idle_until, now + self.client_timeout))
+        else:
+            del self.clients[ip]
+            if self.store is not None:
+                self.store.delete("client", ip)
+
+    # Warm restart
+    def _open_store(self):
+        # Sessions and clients of the previous run, kept until the flow dumps confirm them
+        if self.store is not None:
+            return
+        store = lb_persist.StateStore(self.state_path)
+        # Restored with self.store unset, so nothing is logged again
+        for ip, c in list(store.get("client").items()):
+            self._learn_client(ip, c["mac"], c["port"])
+        for sid, rec in list(store.get("session").items()):
+            backend = next((b for b in self.backends if b["ip"] == rec["backend"]), None)
+            if backend is None:
+                store.delete("session", sid)
+                continue
+            self._restore_session(int(sid), rec["client"], rec["service"], backend, rec["dpid"], rec["created"])
+            self.restored.add(int(sid))
+        self.store = store
+        self.store.start()
+        self.logger.info("Warm restart: %d sessions and %d clients loaded from %s",
+                         len(self.sessions), len(self.clients), self.state_path)
+
+    def _restore_session(self, sid, client, service_port, backend, dpid, created):
+        s = self.sessions.by_id.get(sid)
+        if s is not None and (s.client_ip, s.service_port, s.backend["ip"]) == (client, service_port, backend["ip"]):
+            return s
+        for other in (s, self.sessions.get(client, service_port)):
+            if other is not None:
+                self._end_session(other.id, "replaced on restore")
+        s = self.sessions.restore(sid, client, service_port, backend, dpid, created,
+                                  time.time() + self.session_backstop)
+        pool = self.pools.get(service_port)
+        if pool:
+            pool.acquire(backend)
+        self._persist_session(s)
+        return s
+
+    def _rebuild_from_flows(self, dp, stats):
+        # The switch's LB flows are the truth: restore what they show, drop
+        # stored sessions of this switch that have no flow any more
+        now = time.time()
+        seen = set()
+        clients = 0
+        for stat in stats:
+            client = lb_persist.client_from_flow(stat)
+            if client is not None and client[0] not in self.clients:
+                self._learn_client(*client)
+                clients += 1
+            found = lb_persist.session_from_flow(stat)
+            if found is None:
+                continue
+            sid, index, key, service_port = found
+            if index is None or index >= len(self.backends):
+                continue
+            self._restore_session(sid, key, service_port, self.backends[index], dp.id, now - stat.duration_sec)
+            seen.add(sid)
+        gone = [sid for sid in self.restored if sid not in seen and self.sessions.by_id[sid].dpid == dp.id]
+        for sid in gone:
+            self._end_session(sid, "gone while restarting")
+        self.restored -= seen
+        self.logger.info("Switch %s flow dump: %d sessions confirmed, %d dropped, %d clients added",
+                         dp.id, len(seen), len(gone), clients)
+
+    def _persist_session(self, s):
+        if self.store is not None:
+            self.store.put("session", s.id, {"client": s.client_ip, "service": s.service_port,
+                                             "backend": s.backend["ip"], "dpid": s.dpid, "created": s.created})
+
+    def _group_pools(self):
+        return {service: pool.backends for service, pool in self.pools.items()}
+
+    def _install_reverse_flow(self, dp, backend_ip, client_ip, buffer_id=None):
+        # Backend -> client flow: rewrite the source back to the VIP
+        parser = dp.ofproto_parser
+        c = self.clients[client_ip]
+        actions = [
+            parser.OFPActionSetField(ipv4_src=self.virtual_ip),
+            parser.OFPActionSetField(eth_src=self.virtual_mac),
+            parser.OFPActionSetField(eth_dst=c["mac"]),
+            parser.OFPActionOutput(c["port"]),
+        ]
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                ip_proto=6,
+                                ipv4_src=backend_ip,
+                                ipv4_dst=client_ip)
+        cookie = lb_cookie.make(lb_cookie.KIND_REVERSE, self.backend_index.get(backend_ip))
+        self._add_flow(dp, 20, match, actions, idle_timeout=self.idle_timeout, cookie=cookie,
+                       buffer_id=buffer_id)
+        return actions
+
+    def update_backends(self, backends):
+        # Replace the backend list; SELECT groups are modified in place and
+        # proactive flows reinstalled
+        lb_cookie.check_backends(backends)
+        self.backends = backends
+        self.health.set_backends(backends)
+        self.set_strategy(self.strategy)
+        self._sync_datapaths()
+
+    def _sync_datapaths(self):
+        self.flow_queues.flush_all()
+        for dp in self.datapaths.values():
+            if self.select_groups:
+                self.groups.sync(dp, self._group_pools())
+            if self.proactive:
+                self.proactive_flows.sync(dp, self.backends, self.meters.max_len.get(dp.id))
+
+    def _health_changed(self, down, up):
+        # Health checker callback: move sessions off failed backends, swap in
+        # pools built from the healthy ones and flush the failed backends' flows
+        self.flow_queues.flush_all()
+        for b in down:
+            self.logger.warning("Backend %s is down (%s)", b["ip"], self.health.state[b["ip"]].error)
+            for session in self.sessions:
+                if session.backend["ip"] == b["ip"]:
+                    self._end_session(session.id, "backend down")
+        for b in up:
+            self.logger.warning("Backend %s is up again", b["ip"])
+        self.set_strategy(self.strategy)
+        for dp in self.datapaths.values():
+            for b in down:
+                self._flush_backend(dp, self.backend_index[b["ip"]])
+        self._sync_datapaths()
+
+    def _flush_backend(self, dp, index):
+        # Delete every LB flow carrying this backend's index, in all tables
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        cookie, mask = lb_cookie.backend_match(index)
+        dp.send_msg(parser.OFPFlowMod(datapath=dp, table_id=ofproto.OFPTT_ALL,
+                                      command=ofproto.OFPFC_DELETE, cookie=cookie, cookie_mask=mask,
+                                      out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                      match=parser.OFPMatch()))
+
+    def set_strategy(self, strategy, **kwargs):
+        # Rebuild every pool with another strategy (open sessions keep their backend).
+        # The new pools replace the old ones in a single assignment.
+        self.strategy = strategy
+        self.pools = lb_strategies.build_pools(self.health.healthy(self.backends), strategy, **kwargs)
+        self.backend_index = {b["ip"]: i for i, b in enumerate(self.backends)}
+        for session in self.sessions:
+            if session.service_port in self.pools:
+                self.pools[session.service_port].acquire(session.backend)
 
     # ARP reply helper
     def _send_arp_reply(self, dp, dst_mac, dst_ip, out_port, src_mac, src_ip):
@@ -215,4 +727,4 @@ class L4StatefulLB(app_manager.RyuApp):
                                   in_port=ofproto.OFPP_CONTROLLER,
                                   actions=actions,
                                   data=pkt.data)
-        dp.send_msg(out)
+        self._send(dp, out)